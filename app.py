@@ -1,8 +1,24 @@
+import functools
+import json
 import os
 import random
-from flask import Flask, request, jsonify
+import threading
+import time
+import click
+import metrics
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS, cross_origin
-from azure_blob import AzureBlob
+from azure_blob import AzureBlob, DocumentTooLargeError
+from document_cache import DocumentCache
+from idempotency import (IdempotencyKeyInUseError, IdempotencyKeyMismatchError, IdempotencyManager,
+                         InMemoryIdempotencyStore, SQLiteIdempotencyStore)
+from jobs import InMemoryJobStore, JobManager, JobQueueFullError
+from pre_extraction import pre_extract
+from prompt_compaction import PromptCompactor, estimate_tokens
+from question_bank import QuestionBank
+from resilience import CircuitBreaker, CircuitOpenError, Resilience, RetryPolicy
+from scheduler import LLMScheduler, QuotaExceededError
+from single_flight import SingleFlight
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,39 +27,505 @@ from llm import LLM
 app = Flask(__name__)
 cors = CORS(app, resources={r"/*": {"origins": "*"}})
 
+document_cache = None
+if os.getenv("DOCUMENT_CACHE_ENABLED", "true").lower() == "true":
+    document_cache = DocumentCache(
+        max_memory_bytes=int(os.getenv("DOCUMENT_CACHE_MAX_MEMORY_BYTES", str(64 * 1024 * 1024))),
+        max_memory_entries=int(os.getenv("DOCUMENT_CACHE_MAX_MEMORY_ENTRIES", "256")),
+        disk_dir=os.getenv("DOCUMENT_CACHE_DIR") or None,
+        max_disk_bytes=int(os.getenv("DOCUMENT_CACHE_MAX_DISK_BYTES", str(1024 * 1024 * 1024))),
+    )
+
+
+
+def resilience_from_env(name, prefix, pool_size, deadline, attempt_timeout=None):
+    """
+    Build the retry policy and circuit breaker for one remote dependency from <prefix>_* environment variables
+    :param name: The dependency name used in logs, errors and /stats
+    :param prefix: The environment variable prefix
+    :param pool_size: The connection pool size configured on the dependency's client
+    :param deadline: The default total time budget for one call, in seconds
+    :param attempt_timeout: The longest one attempt can take with the client's timeouts, in seconds
+    :return: The Resilience wrapper
+    """
+    return Resilience(
+        name,
+        retry_policy=RetryPolicy(
+            max_attempts=int(os.getenv(f"{prefix}_RETRY_ATTEMPTS", "3")),
+            base_delay=float(os.getenv(f"{prefix}_RETRY_BASE_DELAY_SECONDS", "0.5")),
+            max_delay=float(os.getenv(f"{prefix}_RETRY_MAX_DELAY_SECONDS", "8")),
+            deadline=float(os.getenv(f"{prefix}_DEADLINE_SECONDS", str(deadline))),
+            attempt_timeout=attempt_timeout,
+        ),
+        breaker=CircuitBreaker(
+            name,
+            failure_threshold=int(os.getenv(f"{prefix}_CIRCUIT_FAILURE_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv(f"{prefix}_CIRCUIT_RESET_SECONDS", "30")),
+        ),
+        pool_size=pool_size,
+    )
+
+
+# Concurrent identical requests, e.g. a class opening the same quest at once, share one download and one LLM call
+single_flight_enabled = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+document_flight = SingleFlight("document", enabled=single_flight_enabled)
+questions_flight = SingleFlight("questions", enabled=single_flight_enabled, copy_results=True)
+bonus_game_flight = SingleFlight("bonus_game", enabled=single_flight_enabled, copy_results=True)
+
+blob_pool_size = int(os.getenv("BLOB_POOL_SIZE", "10"))
+llm_pool_size = int(os.getenv("LLM_POOL_SIZE", "20"))
+blob_connection_timeout = float(os.getenv("BLOB_CONNECTION_TIMEOUT_SECONDS", "10"))
+blob_read_timeout = float(os.getenv("BLOB_READ_TIMEOUT_SECONDS", "60"))
+llm_timeout = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
 azure_blob = AzureBlob(
     connection_string=os.getenv("AZURE_STORAGE_CONNECTION_STRING"),
-    container_name=os.getenv("AZURE_STORAGE_CONTAINER_NAME")
+    container_name=os.getenv("AZURE_STORAGE_CONTAINER_NAME"),
+    cache=document_cache,
+    pdf_workers=int(os.getenv("PDF_EXTRACTION_WORKERS", "0")),
+    pdf_timeout=float(os.getenv("PDF_EXTRACTION_TIMEOUT_SECONDS", "120")),
+    pdf_parallel_min_pages=int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32")),
+    streaming=os.getenv("DOCUMENT_STREAMING", "false").lower() == "true",
+    max_document_bytes=int(os.getenv("MAX_DOCUMENT_BYTES")) if os.getenv("MAX_DOCUMENT_BYTES") else None,
+    spool_max_bytes=int(os.getenv("DOCUMENT_SPOOL_MAX_BYTES", str(8 * 1024 * 1024))),
+    resilience=resilience_from_env("Azure Blob Storage", "BLOB", blob_pool_size, deadline=120,
+                                   attempt_timeout=blob_connection_timeout + blob_read_timeout),
+    pool_size=blob_pool_size,
+    connection_timeout=blob_connection_timeout,
+    read_timeout=blob_read_timeout,
+    single_flight=document_flight,
+    sidecars=os.getenv("DOCUMENT_SIDECARS_ENABLED", "false").lower() == "true"
 )
+# Admission control against the Azure OpenAI deployment's quotas (both 0 disables it)
+llm_scheduler = None
+if int(os.getenv("LLM_TOKENS_PER_MINUTE", "0")) or int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")):
+    llm_scheduler = LLMScheduler(
+        tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+        requests_per_minute=int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+        completion_tokens=int(os.getenv("LLM_COMPLETION_TOKEN_ESTIMATE", "1000")),
+        max_wait_seconds=float(os.getenv("LLM_QUEUE_MAX_WAIT_SECONDS", "20")),
+    )
 llm = LLM(
     azure_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
     openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
     temperature=float(os.getenv("AZURE_OPENAI_TEMPERATURE")),
+    question_chunk_chars=int(os.getenv("QUESTION_CHUNK_CHARS", "0")),
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "4")),
+    compactor=PromptCompactor(
+        enabled=os.getenv("PROMPT_COMPACTION_ENABLED", "true").lower() == "true",
+        token_budget=int(os.getenv("PROMPT_DOCUMENT_TOKEN_BUDGET", "0")),
+        min_repeats=int(os.getenv("PROMPT_BOILERPLATE_MIN_REPEATS", "3")),
+    ),
+    resilience=resilience_from_env("Azure OpenAI", "LLM", llm_pool_size, deadline=180, attempt_timeout=llm_timeout),
+    timeout=llm_timeout,
+    pool_size=llm_pool_size,
+    scheduler=llm_scheduler,
+)
+
+# Serve question requests from a pre-generated pool per document and difficulty, topped up in the background
+question_bank = None
+if os.getenv("QUESTION_BANK_ENABLED", "false").lower() == "true":
+    question_bank = QuestionBank(
+        generate=llm.generate_questions_and_answers,
+        pool_size=int(os.getenv("QUESTION_BANK_SIZE", "40")),
+        batch_size=int(os.getenv("QUESTION_BANK_BATCH_SIZE", "10")),
+        similarity_threshold=float(os.getenv("QUESTION_BANK_SIMILARITY", "0.6")),
+        max_documents=int(os.getenv("QUESTION_BANK_MAX_DOCUMENTS", "256")),
+        workers=int(os.getenv("QUESTION_BANK_WORKERS", "1")),
+    )
+
+# Bonus games and questions targeted at a topic get the best-fitting sections of a document instead of all of it
+section_index_enabled = os.getenv("SECTION_INDEX_ENABLED", "true").lower() == "true"
+section_index_token_budget = int(os.getenv("SECTION_INDEX_TOKEN_BUDGET", "6000"))
+
+
+def warm_up_llm():
+    try:
+        llm.warm_up()
+    except Exception as e:
+        print(f"[Warm Up] Failed to warm up the LLM: {str(e)}", flush=True)
+
+
+# Build the LLM client and render every prompt in the background so /status answers immediately on a cold start
+if os.getenv("LLM_WARM_UP", "background") == "background":
+    threading.Thread(target=warm_up_llm, name="llm-warm-up", daemon=True).start()
+elif os.getenv("LLM_WARM_UP") == "eager":
+    warm_up_llm()
+feedback_batch_max_attempts = int(os.getenv("FEEDBACK_BATCH_MAX_ATTEMPTS", "500"))
+# Sample the stacks of requests slower than this many seconds and log where they spent their time (0 disables)
+metrics.configure_profiler(
+    threshold_seconds=float(os.getenv("SLOW_REQUEST_PROFILE_SECONDS", "0")),
+    interval_seconds=float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "10")) / 1000,
+)
+# Health and monitoring endpoints are not traced, so probes and scrapes do not flood the logs
+UNTRACED_ENDPOINTS = {"status", "stats", "prometheus_metrics"}
+# Retries that carry the same Idempotency-Key header replay the stored response instead of generating again
+idempotency = None
+if os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true":
+    idempotency = IdempotencyManager(
+        store=SQLiteIdempotencyStore(os.getenv("IDEMPOTENCY_SQLITE_PATH", "idempotency.sqlite3"))
+        if os.getenv("IDEMPOTENCY_STORE", "memory") == "sqlite" else InMemoryIdempotencyStore(),
+        ttl_seconds=int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400")),
+        wait_seconds=float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "120")),
+        stale_after_seconds=float(os.getenv("IDEMPOTENCY_STALE_AFTER_SECONDS", "600")),
+    )
+job_manager = JobManager(
+    store=InMemoryJobStore(ttl_seconds=int(os.getenv("JOB_TTL_SECONDS", "3600"))),
+    max_workers=int(os.getenv("JOB_WORKERS", "4")),
+    max_pending=int(os.getenv("JOB_MAX_PENDING", "100")),
 )
 
 
+@app.before_request
+def start_request_trace():
+    if request.endpoint is not None and request.endpoint not in UNTRACED_ENDPOINTS:
+        g.trace_token = metrics.start_trace(request.endpoint)
+
+
+@app.after_request
+def record_response_status(response):
+    metrics.set_status(response.status_code)
+    return response
+
+
+@app.teardown_request
+def finish_request_trace(exception):
+    token = g.pop("trace_token", None)
+    if token is not None:
+        metrics.finish_trace(token, status=500 if exception is not None else None)
+
+
+def idempotent(view):
+    """
+    Run a JSON endpoint at most once per Idempotency-Key header, replaying the stored response for repeated keys.
+    Requests without the header are not affected.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if idempotency is None or not key:
+            return view(*args, **kwargs)
+
+        responses = []
+
+        def run_view():
+            response = app.make_response(view(*args, **kwargs))
+            responses.append(response)
+            return response.get_json(), response.status_code
+
+        try:
+            body, status_code, replayed = idempotency.run(f"{request.endpoint}:{key}", request.get_data(), run_view)
+        except IdempotencyKeyMismatchError as e:
+            return jsonify({"error": str(e)}), 422
+        except IdempotencyKeyInUseError as e:
+            return jsonify({"error": str(e)}), 409, {"Retry-After": str(e.retry_after)}
+        metrics.annotate("idempotent_replay", replayed)
+        if not replayed:
+            return responses[-1]
+        response = jsonify(body)
+        response.status_code = status_code
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+    return wrapper
+
+
+def json_response(body, status_code):
+    """
+    Build a JSON response, adding a Retry-After header to 429 responses from the body's retry_after field
+    """
+    response = jsonify(body)
+    response.status_code = status_code
+    if status_code == 429:
+        response.headers["Retry-After"] = str(body["retry_after"])
+    return response
+
+
+def retrieve_prompt_document(document_id, label, topic=None):
+    """
+    Retrieve the text of a document to send to a prompt. With the section index enabled, this is the sections most
+    relevant to the topic, or without a topic the most representative sections, that fit the token budget.
+    :param document_id: The document ID, relative to the documents folder
+    :param label: The name of the calling prompt, for logging
+    :param topic: The topic to focus on, or None
+    :return: The document text
+    """
+    if not section_index_enabled:
+        if topic:
+            print(f"[Section Index] Disabled, ignoring the topic of a {label} request", flush=True)
+        return azure_blob.retrieve_document(document_id=f"documents/{document_id}")
+    return select_sections(azure_blob.retrieve_section_index(f"documents/{document_id}"), label, topic)
+
+
+def select_sections(index, label, topic=None):
+    """
+    Select the sections of an indexed document to send to a prompt
+    :param index: The SectionIndex of the document, or None if its format is not supported
+    :param label: The name of the calling prompt, for logging
+    :param topic: The topic to focus on, or None
+    :return: The selected text
+    """
+    if index is None:
+        return None
+    text, strategy = index.select(section_index_token_budget, topic)
+    metrics.annotate("section_selection", strategy)
+    print(f"[Section Index] {label}: {strategy} selection, ~{estimate_tokens(index.text())} -> "
+          f"~{estimate_tokens(text)} tokens", flush=True)
+    return text
+
+
+def request_topic(payload):
+    """
+    Read the optional topic of a question request
+    :param payload: The request body
+    :return: The topic, or None for an untargeted request
+    :raise ValueError: If the topic is not a string
+    """
+    topic = payload.get('topic')
+    if topic is None:
+        return None
+    if not isinstance(topic, str):
+        raise ValueError("topic must be a string")
+    return topic.strip() or None
+
+
+def request_num_questions(payload):
+    """
+    Read the number of questions a question request asks for
+    :param payload: The request body
+    :return: The number of questions, as a positive int
+    :raise ValueError: If it is missing or not a positive integer, or a string holding one
+    """
+    num_questions = payload.get('num_questions')
+    if isinstance(num_questions, str) and num_questions.strip().isdecimal():
+        num_questions = int(num_questions)
+    if not isinstance(num_questions, int) or isinstance(num_questions, bool) or num_questions < 1:
+        raise ValueError("num_questions must be a positive integer")
+    return num_questions
+
+
+def sample_question_bank(payload, document_content, num_questions):
+    """
+    Serve a question request from the question bank. A failure is logged and treated as a miss, so the request
+    falls back to generating.
+    :param payload: The request body
+    :param document_content: The document text
+    :param num_questions: The number of questions wanted
+    :return: The sampled questions, or None to generate
+    """
+    try:
+        return question_bank.sample(payload['document_id'], payload['difficulty'], document_content, num_questions)
+    except Exception as e:
+        print(f"[Question Bank] Sampling failed, generating instead: {str(e)}", flush=True)
+        return None
+
+
+def add_to_question_bank(payload, document_content, questions):
+    """
+    Pool generated questions in the question bank. A failure is logged, since the questions are still returned.
+    :param payload: The request body
+    :param document_content: The document text
+    :param questions: The generated questions
+    """
+    try:
+        question_bank.add(payload['document_id'], payload['difficulty'], document_content, questions)
+    except Exception as e:
+        print(f"[Question Bank] Failed to pool generated questions: {str(e)}", flush=True)
+
+
+def questions_from_document(payload):
+    """
+    Generate questions for a document, focused on the sections matching payload["topic"] when one is given
+    :param payload: The request body
+    :return: A (response body, status code) tuple
+    """
+    try:
+        topic = request_topic(payload)
+        num_questions = request_num_questions(payload)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    try:
+        # Get the document content
+        if topic:
+            document_content = retrieve_prompt_document(payload['document_id'], "questions", topic)
+        else:
+            document_content = azure_blob.retrieve_document(
+                document_id=f"documents/{payload['document_id']}"
+            )
+    except DocumentTooLargeError as e:
+        return {"error retrieving document": str(e)}, 413
+    except CircuitOpenError as e:
+        return {"error retrieving document": str(e)}, 503
+    except Exception as e:
+        return {"error retrieving document": str(e)}, 404
+
+    # Pools hold questions on the whole document, so targeted requests always generate
+    if question_bank is not None and not topic:
+        questions = sample_question_bank(payload, document_content, num_questions)
+        if questions is not None:
+            return questions, 200
+
+    try:
+        # Generate questions and answers
+        questions = questions_flight.do(
+            (payload['document_id'], num_questions, payload['difficulty'], topic),
+            llm.generate_questions_and_answers,
+            document_content=document_content,
+            num_questions=num_questions,
+            difficulty=payload['difficulty']
+        )
+    except QuotaExceededError as e:
+        return {"error generating questions": str(e), "retry_after": e.retry_after}, 429
+    except CircuitOpenError as e:
+        return {"error generating questions": str(e)}, 503
+    except Exception as e:
+        return {"error generating questions": str(e)}, 500
+
+    if question_bank is not None and not topic:
+        add_to_question_bank(payload, document_content, questions)
+    return questions, 200
+
+
+def bonus_game_from_document(payload):
+    """
+    Generate a bonus mini-game for a document
+    :param payload: The request body
+    :return: A (response body, status code) tuple
+    """
+    try:
+        document_id = payload['document_id']
+    except Exception as e:
+        print(f"[Bonus Game] Missing document_id: {str(e)}", flush=True)
+        return {"error": f"Missing document_id: {str(e)}"}, 400
+
+    try:
+        document_content = retrieve_prompt_document(document_id, "bonus_game")
+    except DocumentTooLargeError as e:
+        print(f"[Bonus Game] Document too large: {str(e)}", flush=True)
+        return {"error retrieving document": str(e)}, 413
+    except CircuitOpenError as e:
+        print(f"[Bonus Game] Storage unavailable: {str(e)}", flush=True)
+        return {"error retrieving document": str(e)}, 503
+    except Exception as e:
+        print(f"[Bonus Game] Error retrieving document: {str(e)}", flush=True)
+        return {"error retrieving document": str(e)}, 404
+
+    try:
+        game_type = random.choice(["matching", "ordering"])
+        game = bonus_game_flight.do(
+            (document_id, game_type), llm.generate_bonus_game, document_content=document_content, game_type=game_type
+        )
+    except QuotaExceededError as e:
+        print(f"[Bonus Game] Shed by the LLM scheduler: {str(e)}", flush=True)
+        return {"error generating bonus game": str(e), "retry_after": e.retry_after}, 429
+    except CircuitOpenError as e:
+        print(f"[Bonus Game] LLM unavailable: {str(e)}", flush=True)
+        return {"error generating bonus game": str(e)}, 503
+    except Exception as e:
+        print(f"[Bonus Game] Error generating bonus game: {str(e)}", flush=True)
+        return {"error generating bonus game": str(e)}, 500
+
+    return game, 200
+
+
+def submit_job(job_type, fn):
+    """
+    Queue a generation request on the job worker pool
+    :param job_type: A label for the kind of job
+    :param fn: The generation function to run with the request body
+    :return: A 202 response with the job ID and where to poll for it
+    """
+    def traced(payload):
+        with metrics.trace_request(f"job_{job_type}"):
+            body, status_code = fn(payload)
+            metrics.set_status(status_code)
+            return body, status_code
+
+    try:
+        job = job_manager.submit(job_type, traced, request.json)
+    except JobQueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['job_id']}"
+    }), 202
+
+
 @app.route('/generate_questions_from_document', methods=['POST'])
 @cross_origin()
+@idempotent
 def generate_questions_from_document():
+    body, status_code = questions_from_document(request.json)
+    return json_response(body, status_code)
+
+
+@app.route('/generate_questions_from_document/stream', methods=['POST'])
+@cross_origin()
+def generate_questions_from_document_stream():
+    """
+    Stream generated questions as Server-Sent Events, one "question" event per completed question
+    """
+    payload = request.json
     try:
-        # Get the document content
-        document_content = azure_blob.retrieve_document(
-            document_id=f"documents/{request.json['document_id']}"
-        )
+        topic = request_topic(payload)
+        num_questions = request_num_questions(payload)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        if topic:
+            document_content = retrieve_prompt_document(payload['document_id'], "questions_stream", topic)
+        else:
+            document_content = azure_blob.retrieve_document(
+                document_id=f"documents/{payload['document_id']}"
+            )
+    except DocumentTooLargeError as e:
+        return jsonify({"error retrieving document": str(e)}), 413
+    except CircuitOpenError as e:
+        return jsonify({"error retrieving document": str(e)}), 503
     except Exception as e:
         return jsonify({"error retrieving document": str(e)}), 404
 
+    # Admission through the LLM scheduler happens here, so a shed call gets a 429 before the stream starts
     try:
-        # Generate questions and answers
-        questions = llm.generate_questions_and_answers(
+        questions = llm.stream_questions_and_answers(
             document_content=document_content,
-            num_questions=request.json['num_questions'],
-            difficulty=request.json['difficulty']
+            num_questions=num_questions,
+            difficulty=payload['difficulty']
         )
+    except QuotaExceededError as e:
+        return json_response({"error generating questions": str(e), "retry_after": e.retry_after}, 429)
     except Exception as e:
         return jsonify({"error generating questions": str(e)}), 500
 
-    return jsonify(questions)
+    def event_stream():
+        count = 0
+        try:
+            for question in questions:
+                count += 1
+                yield server_sent_event("question", question)
+        except Exception as e:
+            print(f"[Question Stream] Error generating questions: {str(e)}", flush=True)
+            yield server_sent_event("error", {"error generating questions": str(e)})
+            return
+        yield server_sent_event("done", {"count": count})
+
+    # Keep the request context, and with it the request trace, open until the stream finishes
+    return Response(stream_with_context(event_stream()), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/jobs/generate_questions_from_document', methods=['POST'])
+@cross_origin()
+def generate_questions_from_document_job():
+    return submit_job("generate_questions_from_document", questions_from_document)
 
 
 @app.route('/status', methods=['GET'])
@@ -51,8 +533,39 @@ def generate_questions_from_document():
 def status():
     return jsonify({"status": "API is running"})
 
+
+@app.route('/stats', methods=['GET'])
+@cross_origin()
+def stats():
+    return jsonify({
+        "document_cache": document_cache.stats() if document_cache is not None else None,
+        "jobs": job_manager.stats(),
+        "idempotency": idempotency.stats() if idempotency is not None else None,
+        "question_bank": question_bank.stats() if question_bank is not None else None,
+        "single_flight": {
+            "document": document_flight.stats(),
+            "questions": questions_flight.stats(),
+            "bonus_game": bonus_game_flight.stats()
+        },
+        "llm_scheduler": llm_scheduler.stats() if llm_scheduler is not None else None,
+        "resilience": {
+            "blob": azure_blob.resilience.stats(),
+            "llm": llm.resilience.stats()
+        }
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Latency histograms, token usage and fallback counters in the Prometheus text format
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/generate_feedback', methods=['POST'])
 @cross_origin()
+@idempotent
 def generate_feedback():
     """
     Generate personalized feedback for a quest attempt
@@ -63,36 +576,99 @@ def generate_feedback():
         feedback = llm.generate_personalised_feedback(attempt_data)
         print("[Generated Feedback]", feedback, flush=True)
         return jsonify(feedback)
+    except QuotaExceededError as e:
+        return json_response({"error generating feedback": str(e), "retry_after": e.retry_after}, 429)
     except Exception as e:
         return jsonify({"error generating feedback": str(e)}), 500
 
 
+@app.route('/generate_feedback/batch', methods=['POST'])
+@cross_origin()
+def generate_feedback_batch():
+    """
+    Generate personalised feedback for many quest attempts concurrently.
+    Results are keyed by each attempt's attempt_id, falling back to its position in the list, so a batch whose
+    keys are not unique is rejected.
+    """
+    payload = request.json
+    attempts = payload.get('attempts') if isinstance(payload, dict) else None
+    if not isinstance(attempts, list) or not attempts:
+        return jsonify({"error": "attempts must be a non-empty list"}), 400
+    if len(attempts) > feedback_batch_max_attempts:
+        return jsonify({"error": f"A batch can contain at most {feedback_batch_max_attempts} attempts"}), 400
+
+    keys = []
+    for index, attempt in enumerate(attempts):
+        attempt_id = attempt.get('attempt_id') if isinstance(attempt, dict) else None
+        keys.append(str(attempt_id if attempt_id is not None else index))
+    duplicates = sorted({key for key in keys if keys.count(key) > 1})
+    if duplicates:
+        return jsonify({
+            "error": f"attempt_id values must be unique and must not match the position of an attempt without "
+                     f"one; duplicated keys: {', '.join(duplicates)}"
+        }), 400
+
+    start = time.perf_counter()
+    items = llm.generate_personalised_feedback_batch(attempts)
+
+    results = {}
+    latencies = []
+    for key, item in zip(keys, items):
+        results[key] = item
+        if item["latency_ms"] is not None:
+            latencies.append(item["latency_ms"])
+    latencies.sort()
+
+    summary = {
+        "total": len(items),
+        "succeeded": sum(1 for item in items if item["status"] == "ok"),
+        "fallbacks": sum(1 for item in items if item["status"] == "fallback"),
+        "failed": sum(1 for item in items if item["status"] == "error"),
+        "wall_time_ms": round((time.perf_counter() - start) * 1000, 1),
+        "latency_ms": {
+            "min": latencies[0] if latencies else None,
+            "p50": latencies[len(latencies) // 2] if latencies else None,
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+    print(f"[Feedback Batch] {summary}", flush=True)
+    return jsonify({"results": results, "summary": summary})
+
+
 @app.route('/generate_bonus_game', methods=['POST'])
 @cross_origin()
+@idempotent
 def generate_bonus_game():
-    try:
-        document_id = request.json['document_id']
-    except Exception as e:
-        print(f"[Bonus Game] Missing document_id: {str(e)}", flush=True)
-        return jsonify({"error": f"Missing document_id: {str(e)}"}), 400
+    body, status_code = bonus_game_from_document(request.json)
+    return json_response(body, status_code)
 
-    try:
-        document_content = azure_blob.retrieve_document(
-            document_id=f"documents/{document_id}"
-        )
-    except Exception as e:
-        print(f"[Bonus Game] Error retrieving document: {str(e)}", flush=True)
-        return jsonify({"error retrieving document": str(e)}), 404
 
-    try:
-        game_type = random.choice(["matching", "ordering"])
-        game = llm.generate_bonus_game(document_content=document_content, game_type=game_type)
-    except Exception as e:
-        print(f"[Bonus Game] Error generating bonus game: {str(e)}", flush=True)
-        return jsonify({"error generating bonus game": str(e)}), 500
+@app.route('/jobs/generate_bonus_game', methods=['POST'])
+@cross_origin()
+def generate_bonus_game_job():
+    return submit_job("generate_bonus_game", bonus_game_from_document)
 
-    return jsonify(game)
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+@cross_origin()
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    return jsonify(job)
+
+
+@app.cli.command("pre-extract")
+@click.option("--prefix", default="documents/", show_default=True, help="Blob name prefix of the documents")
+@click.option("--workers", default=os.cpu_count() or 1, show_default=True, help="Number of extraction processes")
+@click.option("--force", is_flag=True, help="Re-extract documents whose sidecar is up to date")
+def pre_extract_command(prefix, workers, force):
+    """
+    Extract the text of every document and store it as a compressed sidecar blob next to the document
+    """
+    summary = pre_extract(azure_blob, prefix=prefix, workers=workers, force=force)
+    if summary["failed"]:
+        raise click.ClickException(f"{summary['failed']} documents failed to extract")
 
 
 if __name__ == '__main__':
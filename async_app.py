@@ -0,0 +1,262 @@
+import functools
+import json
+import os
+import random
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from azure_blob import DocumentTooLargeError
+from idempotency import IdempotencyKeyInUseError, IdempotencyKeyMismatchError
+from resilience import CircuitOpenError
+from scheduler import QuotaExceededError
+from app import (UNTRACED_ENDPOINTS, add_to_question_bank, azure_blob, bonus_game_flight, idempotency, llm,
+                 question_bank, questions_flight, request_num_questions, request_topic, sample_question_bank,
+                 section_index_enabled, select_sections)
+
+# Async serving mode. The generation endpoints are coroutines, so a waiting blob download or LLM call holds no
+# thread and one process can keep hundreds of them in flight. Text extraction is CPU-bound and runs on a small
+# thread pool instead of the event loop. Configuration is shared with app.py.
+extraction_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ASYNC_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    thread_name_prefix="extraction"
+)
+
+routes = web.RouteTableDef()
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    if request.method == "OPTIONS":
+        response = web.Response()
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = request.headers.get(
+            "Access-Control-Request-Headers", "Content-Type"
+        )
+    else:
+        response = await handler(request)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+@web.middleware
+async def trace_middleware(request, handler):
+    endpoint = getattr(request.match_info.handler, "__name__", None)
+    if endpoint is None or endpoint in UNTRACED_ENDPOINTS:
+        return await handler(request)
+    # Coroutines share the event loop thread, so the sampling profiler cannot attribute stacks to one request
+    token = metrics.start_trace(endpoint, profile=False)
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    finally:
+        metrics.finish_trace(token, status=status)
+
+
+def idempotent(handler):
+    """
+    Async counterpart of the idempotent decorator in app.py
+    """
+    @functools.wraps(handler)
+    async def wrapper(request):
+        key = request.headers.get("Idempotency-Key")
+        if idempotency is None or not key:
+            return await handler(request)
+
+        responses = []
+
+        async def run_handler():
+            response = await handler(request)
+            responses.append(response)
+            return json.loads(response.text), response.status
+
+        try:
+            body, status_code, replayed = await idempotency.arun(
+                f"{handler.__name__}:{key}", await request.read(), run_handler
+            )
+        except IdempotencyKeyMismatchError as e:
+            return web.json_response({"error": str(e)}, status=422)
+        except IdempotencyKeyInUseError as e:
+            return web.json_response({"error": str(e)}, status=409, headers={"Retry-After": str(e.retry_after)})
+        metrics.annotate("idempotent_replay", replayed)
+        if not replayed:
+            return responses[-1]
+        return web.json_response(body, status=status_code, headers={"Idempotent-Replayed": "true"})
+
+    return wrapper
+
+
+def quota_exceeded_response(label, e):
+    return web.json_response({label: str(e), "retry_after": e.retry_after}, status=429,
+                             headers={"Retry-After": str(e.retry_after)})
+
+
+async def retrieve_document(document_id):
+    """
+    Retrieve a document through the async storage client
+    :param document_id: The document ID, relative to the documents folder
+    :return: A (document text, error response) tuple, one of which is None
+    """
+    try:
+        document_content = await azure_blob.aretrieve_document(
+            document_id=f"documents/{document_id}",
+            executor=extraction_executor
+        )
+    except DocumentTooLargeError as e:
+        return None, web.json_response({"error retrieving document": str(e)}, status=413)
+    except CircuitOpenError as e:
+        return None, web.json_response({"error retrieving document": str(e)}, status=503)
+    except Exception as e:
+        return None, web.json_response({"error retrieving document": str(e)}, status=404)
+    return document_content, None
+
+
+async def retrieve_prompt_document(document_id, label, topic=None):
+    """
+    Async counterpart of app.retrieve_prompt_document
+    :param document_id: The document ID, relative to the documents folder
+    :param label: The name of the calling prompt, for logging
+    :param topic: The topic to focus on, or None
+    :return: A (document text, error response) tuple, one of which is None
+    """
+    if not section_index_enabled:
+        if topic:
+            print(f"[Section Index] Disabled, ignoring the topic of a {label} request", flush=True)
+        return await retrieve_document(document_id)
+    try:
+        index = await azure_blob.aretrieve_section_index(
+            document_id=f"documents/{document_id}",
+            executor=extraction_executor
+        )
+    except DocumentTooLargeError as e:
+        return None, web.json_response({"error retrieving document": str(e)}, status=413)
+    except CircuitOpenError as e:
+        return None, web.json_response({"error retrieving document": str(e)}, status=503)
+    except Exception as e:
+        return None, web.json_response({"error retrieving document": str(e)}, status=404)
+    return select_sections(index, label, topic), None
+
+
+@routes.get('/status')
+async def status(request):
+    return web.json_response({"status": "API is running"})
+
+
+@routes.get('/metrics')
+async def prometheus_metrics(request):
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
+
+@routes.post('/generate_questions_from_document')
+@idempotent
+async def generate_questions_from_document(request):
+    payload = await request.json()
+    try:
+        topic = request_topic(payload)
+        num_questions = request_num_questions(payload)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    if topic:
+        document_content, error_response = await retrieve_prompt_document(payload['document_id'], "questions", topic)
+    else:
+        document_content, error_response = await retrieve_document(payload['document_id'])
+    if error_response is not None:
+        return error_response
+
+    if question_bank is not None and not topic:
+        questions = sample_question_bank(payload, document_content, num_questions)
+        if questions is not None:
+            return web.json_response(questions)
+
+    try:
+        questions = await questions_flight.ado(
+            (payload['document_id'], num_questions, payload['difficulty'], topic),
+            llm.agenerate_questions_and_answers,
+            document_content=document_content,
+            num_questions=num_questions,
+            difficulty=payload['difficulty']
+        )
+    except QuotaExceededError as e:
+        return quota_exceeded_response("error generating questions", e)
+    except CircuitOpenError as e:
+        return web.json_response({"error generating questions": str(e)}, status=503)
+    except Exception as e:
+        return web.json_response({"error generating questions": str(e)}, status=500)
+
+    if question_bank is not None and not topic:
+        add_to_question_bank(payload, document_content, questions)
+    return web.json_response(questions)
+
+
+@routes.post('/generate_feedback')
+@idempotent
+async def generate_feedback(request):
+    """
+    Generate personalized feedback for a quest attempt
+    """
+    try:
+        attempt_data = await request.json()
+        print("[Attempt Data]", attempt_data, flush=True)
+        feedback = await llm.agenerate_personalised_feedback(attempt_data)
+        print("[Generated Feedback]", feedback, flush=True)
+        return web.json_response(feedback)
+    except QuotaExceededError as e:
+        return quota_exceeded_response("error generating feedback", e)
+    except Exception as e:
+        return web.json_response({"error generating feedback": str(e)}, status=500)
+
+
+@routes.post('/generate_bonus_game')
+@idempotent
+async def generate_bonus_game(request):
+    payload = await request.json()
+    try:
+        document_id = payload['document_id']
+    except Exception as e:
+        print(f"[Bonus Game] Missing document_id: {str(e)}", flush=True)
+        return web.json_response({"error": f"Missing document_id: {str(e)}"}, status=400)
+
+    document_content, error_response = await retrieve_prompt_document(document_id, "bonus_game")
+    if error_response is not None:
+        print(f"[Bonus Game] Error retrieving document: {error_response.text}", flush=True)
+        return error_response
+
+    try:
+        game_type = random.choice(["matching", "ordering"])
+        game = await bonus_game_flight.ado(
+            (document_id, game_type), llm.agenerate_bonus_game, document_content=document_content,
+            game_type=game_type
+        )
+    except QuotaExceededError as e:
+        print(f"[Bonus Game] Shed by the LLM scheduler: {str(e)}", flush=True)
+        return quota_exceeded_response("error generating bonus game", e)
+    except CircuitOpenError as e:
+        print(f"[Bonus Game] LLM unavailable: {str(e)}", flush=True)
+        return web.json_response({"error generating bonus game": str(e)}, status=503)
+    except Exception as e:
+        print(f"[Bonus Game] Error generating bonus game: {str(e)}", flush=True)
+        return web.json_response({"error generating bonus game": str(e)}, status=500)
+
+    return web.json_response(game)
+
+
+async def close_clients(app):
+    await azure_blob.aclose()
+
+
+def create_app():
+    """
+    Build the async web application
+    :return: The aiohttp application
+    """
+    async_app = web.Application(middlewares=[cors_middleware, trace_middleware])
+    async_app.add_routes(routes)
+    async_app.on_cleanup.append(close_clients)
+    return async_app
+
+
+if __name__ == '__main__':
+    port = int(os.getenv("PORT", "5000"))
+    web.run_app(create_app(), host='0.0.0.0', port=port)
@@ -1,20 +1,146 @@
-from azure.storage.blob import BlobServiceClient
-from docx import Document
+import asyncio
+import contextvars
+import gzip
+import math
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
 from io import BytesIO
-from pptx import Presentation
-from pypdf import PdfReader
+import extractors
+import metrics
+from resilience import Resilience
+from section_index import SectionIndex
+from single_flight import SingleFlight
+
+
+# Pre-extracted text and section indexes are stored gzipped next to their source document, tagged with the ETag
+# they were extracted from
+SIDECAR_SUFFIXES = {"document": ".txt.gz", "section_index": ".sections.json.gz"}
+SIDECAR_ETAG_KEY = "source_etag"
+
+
+class DocumentTooLargeError(ValueError):
+    """
+    Raised when a document exceeds the configured maximum size
+    """
+    pass
 
 
 class AzureBlob:
-    def __init__(self, connection_string, container_name):
-        self.blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+    def __init__(self, connection_string, container_name, cache=None, pdf_workers=0, pdf_timeout=120,
+                 pdf_parallel_min_pages=32, streaming=False, max_document_bytes=None,
+                 spool_max_bytes=8 * 1024 * 1024, resilience=None, pool_size=10, connection_timeout=10,
+                 read_timeout=60, single_flight=None, sidecars=False):
+        # The storage SDK is slow to import, so the client is created on first use
+        self.connection_string = connection_string
+        self._blob_service_client = None
+        self._blob_service_client_lock = threading.Lock()
+        self._async_blob_service_client = None
         self.container_name = container_name
+        self.cache = cache
+
+        # Retries and the circuit breaker wrap every storage request; the SDK's own retries are turned off
+        self.resilience = resilience if resilience is not None else Resilience("blob", pool_size=pool_size)
+        self.pool_size = pool_size
+        self.connection_timeout = connection_timeout
+        self.read_timeout = read_timeout
+
+        # Concurrent retrievals of the same document share one download and extraction
+        self.single_flight = single_flight if single_flight is not None else SingleFlight("document", enabled=False)
+
+        # Read pre-extracted text sidecars, written by the pre-extract command, before extracting on request
+        self.sidecars = sidecars
+
+        # Streaming mode downloads in chunks to a spooled temporary file and parses from there
+        self.streaming = streaming
+        self.max_document_bytes = max_document_bytes
+        self.spool_max_bytes = spool_max_bytes
+
+        # Parallel PDF extraction is enabled with more than one worker, capped at the number of CPUs
+        self.pdf_workers = min(pdf_workers, os.cpu_count() or 1)
+        self.pdf_timeout = pdf_timeout
+        self.pdf_parallel_min_pages = pdf_parallel_min_pages
+        self._pdf_pool = None
+        self._pdf_pool_lock = threading.Lock()
+        # The queue each pool's workers report their process IDs to, so a timed out pool can be killed
+        self._pdf_worker_pids = {}
+
+    @property
+    def blob_service_client(self):
+        if self._blob_service_client is None:
+            with self._blob_service_client_lock:
+                if self._blob_service_client is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    from azure.core.pipeline.transport import RequestsTransport
+                    from azure.storage.blob import BlobServiceClient
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._blob_service_client = BlobServiceClient.from_connection_string(
+                        self.connection_string,
+                        transport=RequestsTransport(session=session, session_owner=True,
+                                                    connection_timeout=self.connection_timeout,
+                                                    read_timeout=self.read_timeout),
+                        retry_total=0
+                    )
+        return self._blob_service_client
+
+    @blob_service_client.setter
+    def blob_service_client(self, client):
+        self._blob_service_client = client
+
+    @property
+    def async_blob_service_client(self):
+        """
+        Client from the async storage SDK, for the async serving mode. Bound to the event loop it is first used on.
+        """
+        if self._async_blob_service_client is None:
+            import aiohttp
+            from azure.core.pipeline.transport import AioHttpTransport
+            from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+
+            session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+            self._async_blob_service_client = AsyncBlobServiceClient.from_connection_string(
+                self.connection_string,
+                transport=AioHttpTransport(session=session, session_owner=True,
+                                           connection_timeout=self.connection_timeout,
+                                           read_timeout=self.read_timeout),
+                retry_total=0
+            )
+        return self._async_blob_service_client
+
+    @async_blob_service_client.setter
+    def async_blob_service_client(self, client):
+        self._async_blob_service_client = client
+
+    async def aclose(self):
+        """
+        Close the async storage client. It owns an HTTP session bound to the event loop it was created on.
+        """
+        if self._async_blob_service_client is not None:
+            client, self._async_blob_service_client = self._async_blob_service_client, None
+            await client.close()
 
     def retrieve_document(self, document_id):
         """
         Retrieve a document from Azure Blob Storage
         :param document_id: The document ID
-        :return: The document content in bytes
+        :return: The extracted text of the document
+        """
+        return self.single_flight.do(document_id, self.fetch_document, document_id)
+
+    def fetch_document(self, document_id):
+        """
+        Download a document and extract its text, using the cache when it holds this version of the blob and
+        otherwise a sidecar pre-extracted from it
+        :param document_id: The document ID
+        :return: The extracted text of the document
         """
         # Get the BlobClient
         blob_client = self.blob_service_client.get_blob_client(
@@ -22,16 +148,517 @@ class AzureBlob:
             blob=document_id
         )
 
+        # Reject oversized documents before downloading anything
+        properties = None
+        if self.cache is not None or self.max_document_bytes is not None or self.sidecars:
+            with metrics.stage("blob_properties"):
+                properties = self.resilience.call(blob_client.get_blob_properties)
+            self.check_document_size(document_id, properties.size)
+
+        # Look up the extracted text for this exact version of the blob
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(document_id, properties.etag, properties.last_modified)
+            cached_text = self.cache.get(cache_key)
+            metrics.annotate("document_cache", "hit" if cached_text is not None else "miss")
+            if cached_text is not None:
+                return cached_text
+
+        if self.sidecars:
+            document_text = self.read_sidecar(document_id, properties.etag)
+            if document_text is not None:
+                if cache_key is not None:
+                    self.cache.put(cache_key, document_text)
+                return document_text
+
         # Download the blob content
+        with metrics.stage("blob_download"):
+            download_stream, document_content = self.resilience.call(self.download, document_id, blob_client)
+        metrics.observe_document(self.get_document_extension(document_id), download_stream.size)
+
+        with metrics.stage("extraction"):
+            if self.streaming:
+                with document_content as document_file:
+                    document_text = self.extract_text_from_file(document_id, document_file)
+            else:
+                document_text = self.extract_text(document_id, document_content)
+
+        if cache_key is not None:
+            # Key on the version actually downloaded in case the blob changed after the properties lookup
+            downloaded = download_stream.properties
+            cache_key = self.cache.make_key(document_id, downloaded.etag, downloaded.last_modified)
+            self.cache.put(cache_key, document_text)
+        return document_text
+
+    async def aretrieve_document(self, document_id, executor=None):
+        """
+        Retrieve a document from Azure Blob Storage using the async storage SDK.
+        Text extraction is CPU-bound, so it runs on the given executor instead of the event loop.
+        :param document_id: The document ID
+        :param executor: The executor for text extraction, defaults to the event loop's default executor
+        :return: The extracted text of the document
+        """
+        return await self.single_flight.ado(document_id, self.afetch_document, document_id, executor)
+
+    async def afetch_document(self, document_id, executor=None):
+        """
+        Async counterpart of fetch_document
+        """
+        blob_client = self.async_blob_service_client.get_blob_client(
+            container=self.container_name,
+            blob=document_id
+        )
+
+        properties = None
+        if self.cache is not None or self.max_document_bytes is not None or self.sidecars:
+            with metrics.stage("blob_properties"):
+                properties = await self.resilience.acall(blob_client.get_blob_properties)
+            self.check_document_size(document_id, properties.size)
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(document_id, properties.etag, properties.last_modified)
+            cached_text = self.cache.get(cache_key)
+            metrics.annotate("document_cache", "hit" if cached_text is not None else "miss")
+            if cached_text is not None:
+                return cached_text
+
+        if self.sidecars:
+            document_text = await self.aread_sidecar(document_id, properties.etag)
+            if document_text is not None:
+                if cache_key is not None:
+                    self.cache.put(cache_key, document_text)
+                return document_text
+
+        with metrics.stage("blob_download"):
+            download_stream, document_content = await self.resilience.acall(
+                self.adownload, document_id, blob_client
+            )
+        metrics.observe_document(self.get_document_extension(document_id), download_stream.size)
+
+        # Run extraction in a copy of the request context so its stage timings land on this request's trace
+        loop = asyncio.get_running_loop()
+        with metrics.stage("extraction"):
+            if self.streaming:
+                with document_content as document_file:
+                    document_text = await loop.run_in_executor(
+                        executor, contextvars.copy_context().run, self.extract_text_from_file, document_id,
+                        document_file
+                    )
+            else:
+                document_text = await loop.run_in_executor(
+                    executor, contextvars.copy_context().run, self.extract_text, document_id, document_content
+                )
+
+        if cache_key is not None:
+            downloaded = download_stream.properties
+            cache_key = self.cache.make_key(document_id, downloaded.etag, downloaded.last_modified)
+            self.cache.put(cache_key, document_text)
+        return document_text
+
+    def retrieve_section_index(self, document_id):
+        """
+        Retrieve the section index of a document from Azure Blob Storage
+        :param document_id: The document ID
+        :return: The SectionIndex of the document, or None if the format is not supported
+        """
+        return self.single_flight.do((document_id, "section_index"), self.fetch_section_index, document_id)
+
+    def fetch_section_index(self, document_id):
+        """
+        Load the section index of a document from the cache or its sidecar, or build it from the document and
+        persist it as a sidecar. Building an index also caches the document text, which is the sections joined.
+        :param document_id: The document ID
+        :return: The SectionIndex of the document, or None if the format is not supported
+        """
+        blob_client = self.blob_service_client.get_blob_client(
+            container=self.container_name,
+            blob=document_id
+        )
+
+        with metrics.stage("blob_properties"):
+            properties = self.resilience.call(blob_client.get_blob_properties)
+        self.check_document_size(document_id, properties.size)
+
+        index = self.load_section_index(document_id, properties)
+        if index is None and self.sidecars:
+            index = self.cache_section_index(
+                document_id, properties, self.read_sidecar(document_id, properties.etag, "section_index")
+            )
+        if index is not None:
+            return index
+
+        with metrics.stage("blob_download"):
+            download_stream, document_content = self.resilience.call(self.download, document_id, blob_client)
+        metrics.observe_document(self.get_document_extension(document_id), download_stream.size)
+
+        with metrics.stage("extraction"):
+            sections = self.extract_sections(document_id, document_content)
+            if sections is None:
+                return None
+            index = SectionIndex(sections)
+
+        data = self.store_section_index(document_id, download_stream.properties, index)
+        if self.sidecars:
+            try:
+                self.write_sidecar(document_id, data, download_stream.properties.etag, "section_index")
+            except Exception as e:
+                print(f"[Sidecar] Failed to write the section index of {document_id}: {str(e)}", flush=True)
+        return index
+
+    async def aretrieve_section_index(self, document_id, executor=None):
+        """
+        Async counterpart of retrieve_section_index
+        :param document_id: The document ID
+        :param executor: The executor for text extraction, defaults to the event loop's default executor
+        :return: The SectionIndex of the document, or None if the format is not supported
+        """
+        return await self.single_flight.ado(
+            (document_id, "section_index"), self.afetch_section_index, document_id, executor
+        )
+
+    async def afetch_section_index(self, document_id, executor=None):
+        """
+        Async counterpart of fetch_section_index
+        """
+        blob_client = self.async_blob_service_client.get_blob_client(
+            container=self.container_name,
+            blob=document_id
+        )
+
+        with metrics.stage("blob_properties"):
+            properties = await self.resilience.acall(blob_client.get_blob_properties)
+        self.check_document_size(document_id, properties.size)
+
+        index = self.load_section_index(document_id, properties)
+        if index is None and self.sidecars:
+            index = self.cache_section_index(
+                document_id, properties, await self.aread_sidecar(document_id, properties.etag, "section_index")
+            )
+        if index is not None:
+            return index
+
+        with metrics.stage("blob_download"):
+            download_stream, document_content = await self.resilience.acall(
+                self.adownload, document_id, blob_client
+            )
+        metrics.observe_document(self.get_document_extension(document_id), download_stream.size)
+
+        def build():
+            sections = self.extract_sections(document_id, document_content)
+            return SectionIndex(sections) if sections is not None else None
+
+        loop = asyncio.get_running_loop()
+        with metrics.stage("extraction"):
+            index = await loop.run_in_executor(executor, contextvars.copy_context().run, build)
+        if index is None:
+            return None
+
+        data = self.store_section_index(document_id, download_stream.properties, index)
+        if self.sidecars:
+            try:
+                await self.awrite_sidecar(document_id, data, download_stream.properties.etag, "section_index")
+            except Exception as e:
+                print(f"[Sidecar] Failed to write the section index of {document_id}: {str(e)}", flush=True)
+        return index
+
+    def section_index_cache_key(self, document_id, properties):
+        return self.cache.make_key(self.sidecar_name(document_id, "section_index"), properties.etag,
+                                   properties.last_modified)
+
+    def load_section_index(self, document_id, properties):
+        """
+        Look up the section index for this exact version of the blob in the document cache
+        :return: The SectionIndex, or None on a miss
+        """
+        if self.cache is None:
+            return None
+        data = self.cache.get(self.section_index_cache_key(document_id, properties))
+        metrics.annotate("section_index_cache", "hit" if data is not None else "miss")
+        return SectionIndex.from_json(data) if data is not None else None
+
+    def cache_section_index(self, document_id, properties, data):
+        """
+        Parse a serialised section index read from a sidecar and keep it in the document cache
+        :return: The SectionIndex, or None if there is no data or it was written in another format version
+        """
+        index = SectionIndex.from_json(data) if data is not None else None
+        if index is not None and self.cache is not None:
+            self.cache.put(self.section_index_cache_key(document_id, properties), data)
+        return index
+
+    def store_section_index(self, document_id, properties, index):
+        """
+        Cache a freshly built section index, and the document text it was built from
+        :param properties: The properties of the downloaded version of the blob
+        :return: The serialised index
+        """
+        data = index.to_json()
+        if self.cache is not None:
+            self.cache.put(self.section_index_cache_key(document_id, properties), data)
+            self.cache.put(self.cache.make_key(document_id, properties.etag, properties.last_modified), index.text())
+        return data
+
+    def extract_sections(self, document_id, document_content):
+        """
+        Split a downloaded document into sections
+        :param document_id: The document ID
+        :param document_content: The document in bytes, or a spooled file in streaming mode
+        :return: The list of section texts, or None if the format is not supported
+        """
+        extension = self.get_document_extension(document_id)
+        extractor = extractors.get_section_extractor(extension)
+        if self.streaming:
+            with document_content as document_file:
+                return list(extractor(document_file)) if extractor is not None else None
+        if extension == 'pdf':
+            # PDF sections are pages, which may be extracted in parallel like the document text
+            return self.extract_pdf_pages(document_content)
+        if extractor is None:
+            return None
+        return list(extractor(BytesIO(document_content)))
+
+    @staticmethod
+    def sidecar_name(document_id, kind="document"):
+        return document_id + SIDECAR_SUFFIXES[kind]
+
+    def read_sidecar(self, document_id, source_etag, kind="document"):
+        """
+        Download a sidecar of a document, if it was written from this version of the source
+        :param document_id: The document ID
+        :param source_etag: The ETag of the current version of the document
+        :param kind: The sidecar kind, one of SIDECAR_SUFFIXES
+        :return: The sidecar contents, or None if there is no fresh sidecar
+        """
+        blob_client = self.blob_service_client.get_blob_client(
+            container=self.container_name,
+            blob=self.sidecar_name(document_id, kind)
+        )
+        try:
+            with metrics.stage("sidecar_download"):
+                contents = self.resilience.call(self.download_sidecar, blob_client, source_etag)
+        except Exception as e:
+            contents = self.sidecar_error(document_id, kind, e)
+        metrics.annotate(f"{kind}_sidecar", "hit" if contents is not None else "miss")
+        return contents
+
+    async def aread_sidecar(self, document_id, source_etag, kind="document"):
+        """
+        Async counterpart of read_sidecar
+        """
+        blob_client = self.async_blob_service_client.get_blob_client(
+            container=self.container_name,
+            blob=self.sidecar_name(document_id, kind)
+        )
+        try:
+            with metrics.stage("sidecar_download"):
+                contents = await self.resilience.acall(self.adownload_sidecar, blob_client, source_etag)
+        except Exception as e:
+            contents = self.sidecar_error(document_id, kind, e)
+        metrics.annotate(f"{kind}_sidecar", "hit" if contents is not None else "miss")
+        return contents
+
+    @staticmethod
+    def download_sidecar(blob_client, source_etag):
+        """
+        Download a sidecar, stopping after the response headers if it was written from another version of the source
+        :return: The document text, or None if the sidecar is stale
+        """
         download_stream = blob_client.download_blob()
-        document_content = download_stream.readall()
+        if (download_stream.properties.metadata or {}).get(SIDECAR_ETAG_KEY) != source_etag:
+            return None
+        return gzip.decompress(download_stream.readall()).decode("utf-8")
+
+    @staticmethod
+    async def adownload_sidecar(blob_client, source_etag):
+        """
+        Async counterpart of download_sidecar
+        """
+        download_stream = await blob_client.download_blob()
+        if (download_stream.properties.metadata or {}).get(SIDECAR_ETAG_KEY) != source_etag:
+            return None
+        return gzip.decompress(await download_stream.readall()).decode("utf-8")
+
+    @staticmethod
+    def sidecar_error(document_id, kind, e):
+        # A missing sidecar just means the document has not been pre-extracted; anything else is worth logging
+        if getattr(e, "status_code", None) != 404:
+            print(f"[Sidecar] Failed to read the {kind} sidecar of {document_id}, extracting instead: {str(e)}",
+                  flush=True)
+        return None
 
-        if self.get_document_extension(document_id) == 'docx':
-            return self.extract_text_from_docx(document_content)
-        elif self.get_document_extension(document_id) == 'pdf':
+    def write_sidecar(self, document_id, contents, source_etag, kind="document"):
+        """
+        Upload extracted contents of a document as a gzipped sidecar blob next to it
+        :param document_id: The document ID
+        :param contents: The sidecar contents, as a string
+        :param source_etag: The ETag of the document version the contents were extracted from
+        :param kind: The sidecar kind, one of SIDECAR_SUFFIXES
+        :return: The compressed size in bytes
+        """
+        from azure.storage.blob import ContentSettings
+
+        data = gzip.compress(contents.encode("utf-8"))
+        blob_client = self.blob_service_client.get_blob_client(
+            container=self.container_name,
+            blob=self.sidecar_name(document_id, kind)
+        )
+        self.resilience.call(
+            blob_client.upload_blob, data, overwrite=True, metadata={SIDECAR_ETAG_KEY: source_etag},
+            content_settings=ContentSettings(content_type="application/gzip")
+        )
+        return len(data)
+
+    async def awrite_sidecar(self, document_id, contents, source_etag, kind="document"):
+        """
+        Async counterpart of write_sidecar
+        """
+        from azure.storage.blob import ContentSettings
+
+        data = gzip.compress(contents.encode("utf-8"))
+        blob_client = self.async_blob_service_client.get_blob_client(
+            container=self.container_name,
+            blob=self.sidecar_name(document_id, kind)
+        )
+        await self.resilience.acall(
+            blob_client.upload_blob, data, overwrite=True, metadata={SIDECAR_ETAG_KEY: source_etag},
+            content_settings=ContentSettings(content_type="application/gzip")
+        )
+        return len(data)
+
+    def list_documents(self, prefix="documents/"):
+        """
+        List the source documents under a prefix together with their sidecars
+        :param prefix: The blob name prefix
+        :return: A (documents, sidecars) tuple: the source blob properties, with name, etag and size, and a dict of
+            sidecar blob name to the ETag of the source it was extracted from
+        """
+        container_client = self.blob_service_client.get_container_client(self.container_name)
+        blobs = self.resilience.call(
+            lambda: list(container_client.list_blobs(name_starts_with=prefix, include=["metadata"]))
+        )
+        suffixes = tuple(SIDECAR_SUFFIXES.values())
+        documents = [blob for blob in blobs if not blob.name.endswith(suffixes)]
+        sidecars = {blob.name: (blob.metadata or {}).get(SIDECAR_ETAG_KEY)
+                    for blob in blobs if blob.name.endswith(suffixes)}
+        return documents, sidecars
+
+    def download(self, document_id, blob_client, spool=None):
+        """
+        Download a blob, either into memory or spooled to a temporary file in streaming mode
+        :param document_id: The document ID
+        :param blob_client: The blob client
+        :param spool: Whether to spool the download, defaults to the streaming setting
+        :return: A (download stream, document bytes or spooled file) tuple
+        """
+        download_stream = blob_client.download_blob()
+        self.check_document_size(document_id, download_stream.size)
+        if self.streaming if spool is None else spool:
+            return download_stream, self.spool_download(document_id, download_stream)
+        return download_stream, download_stream.readall()
+
+    async def adownload(self, document_id, blob_client):
+        """
+        Async counterpart of download
+        """
+        download_stream = await blob_client.download_blob()
+        self.check_document_size(document_id, download_stream.size)
+        if self.streaming:
+            return download_stream, await self.aspool_download(document_id, download_stream)
+        return download_stream, await download_stream.readall()
+
+    def check_document_size(self, document_id, size):
+        """
+        Raise if a document is larger than the configured maximum
+        :param document_id: The document ID
+        :param size: The document size in bytes
+        """
+        if self.max_document_bytes is not None and size is not None and size > self.max_document_bytes:
+            raise DocumentTooLargeError(
+                f"Document {document_id} is {size} bytes, which exceeds the limit of {self.max_document_bytes} bytes"
+            )
+
+    def spool_download(self, document_id, download_stream):
+        """
+        Download a blob in chunks into a temporary file that spills to disk once it grows large
+        :param document_id: The document ID
+        :param download_stream: The blob download stream
+        :return: The temporary file, rewound to the start
+        """
+        document_file = tempfile.SpooledTemporaryFile(max_size=self.spool_max_bytes)
+        try:
+            downloaded = 0
+            for chunk in download_stream.chunks():
+                downloaded += len(chunk)
+                self.check_document_size(document_id, downloaded)
+                document_file.write(chunk)
+            document_file.seek(0)
+        except Exception:
+            document_file.close()
+            raise
+        return document_file
+
+    async def aspool_download(self, document_id, download_stream):
+        """
+        Async counterpart of spool_download
+        """
+        document_file = tempfile.SpooledTemporaryFile(max_size=self.spool_max_bytes)
+        try:
+            downloaded = 0
+            async for chunk in download_stream.chunks():
+                downloaded += len(chunk)
+                self.check_document_size(document_id, downloaded)
+                document_file.write(chunk)
+            document_file.seek(0)
+        except Exception:
+            document_file.close()
+            raise
+        return document_file
+
+    def extract_text_from_file(self, document_id, document_file):
+        """
+        Extract text from a document file based on its extension
+        :param document_id: The document ID
+        :param document_file: A seekable file object holding the document
+        :return: The extracted text in string format, or None if the format is not supported
+        """
+        text_iterator = self.iter_text(document_id, document_file)
+        if text_iterator is None:
+            return None
+        # Callers need the whole text, and join would build a list of the fragments anyway
+        fragments = list(text_iterator)
+        if self.get_document_extension(document_id) == 'pdf':
+            # The PDF extractor yields one fragment per page
+            metrics.observe_document('pdf', pages=len(fragments))
+        return '\n'.join(fragments)
+
+    def iter_text(self, document_id, document_file):
+        """
+        Extract text from a document file based on its extension
+        :param document_id: The document ID
+        :param document_file: A seekable file object holding the document
+        :return: A generator of text fragments, or None if the format is not supported
+        """
+        extractor = extractors.get_extractor(self.get_document_extension(document_id))
+        if extractor is None:
+            return None
+        return extractor(document_file)
+
+    def extract_text(self, document_id, document_content):
+        """
+        Extract text from a document based on its extension
+        :param document_id: The document ID
+        :param document_content: The document in bytes
+        :return: The extracted text in string format
+        """
+        extension = self.get_document_extension(document_id)
+        if extension == 'pdf':
+            # PDFs may be extracted in parallel, which needs the raw bytes
             return self.extract_text_from_pdf(document_content)
-        elif self.get_document_extension(document_id) == 'pptx':
-            return self.extract_text_from_pptx(document_content)
+        extractor = extractors.get_extractor(extension)
+        if extractor is None:
+            return None
+        return '\n'.join(extractor(BytesIO(document_content)))
 
 
     def get_document_extension(self, document_id):
@@ -50,11 +677,7 @@ class AzureBlob:
         """
         # Read the docx file from the memory stream
         docx_stream = BytesIO(document_bytes)
-        doc = Document(docx_stream)
-        full_text = []
-        for para in doc.paragraphs:
-            full_text.append(para.text)
-        return '\n'.join(full_text)
+        return '\n'.join(extractors.iter_text_from_docx(docx_stream))
 
     def extract_text_from_pdf(self, document_bytes):
         """
@@ -62,12 +685,82 @@ class AzureBlob:
         :param document_bytes: The document in bytes
         :return: The extracted text in string format
         """
+        return '\n'.join(self.extract_pdf_pages(document_bytes))
+
+    def extract_pdf_pages(self, document_bytes):
+        """
+        Extract the text of each page of a PDF document, in parallel for documents with enough pages
+        :param document_bytes: The document in bytes
+        :return: The list of page texts, in page order
+        """
         pdf_stream = BytesIO(document_bytes)
-        pdf = PdfReader(pdf_stream)
-        full_text = []
-        for page in pdf.pages:
-            full_text.append(page.extract_text())
-        return '\n'.join(full_text)
+        pdf = extractors.open_pdf(pdf_stream)
+        metrics.observe_document('pdf', pages=len(pdf.pages))
+        if self.pdf_workers > 1 and len(pdf.pages) >= self.pdf_parallel_min_pages:
+            return self.extract_pdf_pages_parallel(document_bytes, len(pdf.pages))
+
+        return list(extractors.iter_text_from_pdf(pdf_stream, pdf=pdf))
+
+    def extract_pdf_pages_parallel(self, document_bytes, page_count):
+        """
+        Extract the text of each page of a PDF document by sharding page ranges across a process pool
+        :param document_bytes: The document in bytes
+        :param page_count: The number of pages in the document
+        :return: The list of page texts, in page order
+        """
+        shard_size = math.ceil(page_count / self.pdf_workers)
+        pool = self._get_pdf_pool()
+        futures = [
+            pool.submit(
+                extractors.extract_text_from_pdf_pages, document_bytes, start, min(start + shard_size, page_count)
+            )
+            for start in range(0, page_count, shard_size)
+        ]
+
+        _, not_done = wait(futures, timeout=self.pdf_timeout)
+        if not_done:
+            # Replace the pool so a stuck shard does not hold up later documents
+            self._reset_pdf_pool(pool)
+            raise TimeoutError(f"PDF extraction exceeded {self.pdf_timeout} seconds")
+
+        pages = []
+        for future in futures:
+            pages.extend(future.result())
+        return pages
+
+    def _get_pdf_pool(self):
+        with self._pdf_pool_lock:
+            if self._pdf_pool is None:
+                worker_pids = multiprocessing.SimpleQueue()
+                self._pdf_pool = ProcessPoolExecutor(max_workers=self.pdf_workers,
+                                                     initializer=extractors.report_worker_pid, initargs=(worker_pids,))
+                self._pdf_worker_pids[self._pdf_pool] = worker_pids
+            return self._pdf_pool
+
+    def _reset_pdf_pool(self, pool):
+        """
+        Stop using a pool whose shards timed out and kill its worker processes, since shutting the pool down only
+        cancels shards that have not started. Shards of other documents still running on the pool fail with it.
+        :param pool: The pool to replace
+        """
+        with self._pdf_pool_lock:
+            if self._pdf_pool is pool:
+                self._pdf_pool = None
+            worker_pids = self._pdf_worker_pids.pop(pool, None)
+        pool.shutdown(wait=False, cancel_futures=True)
+        if worker_pids is None:
+            # Another timed out request already killed this pool
+            return
+        killed = 0
+        while not worker_pids.empty():
+            try:
+                os.kill(worker_pids.get(), signal.SIGTERM)
+                killed += 1
+            except OSError:
+                # The worker already exited
+                pass
+        worker_pids.close()
+        print(f"[PDF Pool] Terminated {killed} worker processes after a timeout", flush=True)
 
     def extract_text_from_pptx(self, document_bytes):
         """
@@ -76,14 +769,4 @@ class AzureBlob:
         :return: The extracted text in string format
         """
         pptx_stream = BytesIO(document_bytes)
-        ppt = Presentation(pptx_stream)
-        full_text = []
-        for slide in ppt.slides:
-            for shape in slide.shapes:
-                if not shape.has_text_frame:
-                    continue
-                for paragraph in shape.text_frame.paragraphs:
-                    for run in paragraph.runs:
-                        full_text.append(run.text)
-
-        return '\n'.join(full_text)
+        return '\n'.join(extractors.iter_text_from_pptx(pptx_stream))
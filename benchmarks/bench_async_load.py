@@ -0,0 +1,191 @@
+"""
+Load test comparing the threaded Flask server with the async serving mode, using local fake blob and LLM
+backends with a fixed simulated latency. Each server runs in its own process and is restarted for every
+concurrency level, so the peak thread count is per level.
+
+Usage:
+    python -m benchmarks.bench_async_load [--concurrency 10 50 200] [--requests-per-client 3]
+                                          [--llm-latency 0.5] [--blob-latency 0.05]
+                                          [--endpoint generate_questions_from_document]
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import aiohttp
+
+from benchmarks.fakes import DUMMY_ENV, PROJECT_ROOT
+
+DOCUMENT_ID = "sample_lecture_notes.docx"
+PAYLOADS = {
+    "generate_questions_from_document": {"document_id": DOCUMENT_ID, "num_questions": 5, "difficulty": "Medium"},
+    "generate_bonus_game": {"document_id": DOCUMENT_ID},
+    "generate_feedback": {"answers": [
+        {"question_id": question_id, "question_text": f"Question {question_id}?", "answer_text": f"Answer {index}",
+         "is_correct": index == 0, "is_selected": index == question_id % 4}
+        for question_id in range(10) for index in range(4)
+    ]},
+}
+
+
+def serve(mode, port, llm_latency, blob_latency):
+    """
+    Run one server with fake backends until terminated, then print its peak thread count
+    """
+    from benchmarks.fakes import AsyncFakeBlobServiceClient, FakeBlobServiceClient, FakeChatModel
+    import app
+
+    app.azure_blob.blob_service_client = FakeBlobServiceClient.from_directory(latency=blob_latency)
+    app.azure_blob.async_blob_service_client = AsyncFakeBlobServiceClient.from_directory(latency=blob_latency)
+    app.llm.model = FakeChatModel(latency=llm_latency)
+    app.llm.warm_up()
+
+    peak_threads = [threading.active_count()]
+
+    def sample_threads():
+        while True:
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            time.sleep(0.01)
+
+    def report(*_):
+        print(f"PEAK_THREADS {peak_threads[0]}", flush=True)
+        os._exit(0)
+
+    threading.Thread(target=sample_threads, daemon=True).start()
+    signal.signal(signal.SIGTERM, report)
+
+    if mode == "threaded":
+        from werkzeug.serving import make_server
+
+        make_server("127.0.0.1", port, app.app, threaded=True).serve_forever()
+    else:
+        from aiohttp import web
+        import async_app
+
+        web.run_app(async_app.create_app(), host="127.0.0.1", port=port, print=None, backlog=1024,
+                    handle_signals=False)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, args, log_file):
+    port = free_port()
+    env = dict(os.environ)
+    for key, value in DUMMY_ENV.items():
+        env.setdefault(key, value)
+    # Every request pays for its own download and extraction, so identical concurrent requests are not coalesced
+    # and text and section index sidecars are neither read nor written
+    env.update({"DOCUMENT_CACHE_ENABLED": "false", "LLM_WARM_UP": "off", "PROMPT_COMPACTION_ENABLED": "false",
+                "SINGLE_FLIGHT_ENABLED": "false", "DOCUMENT_SIDECARS_ENABLED": "false"})
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.bench_async_load", "--serve", mode, "--port", str(port),
+         "--llm-latency", str(args.llm_latency), "--blob-latency", str(args.blob_latency)],
+        cwd=PROJECT_ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process, port
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"The {mode} server did not start, see {log_file.name}")
+
+
+def stop_server(process, log_file):
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout=30)
+    log_file.seek(0)
+    for line in reversed(log_file.read().decode(errors="replace").splitlines()):
+        if line.startswith("PEAK_THREADS"):
+            return int(line.split()[1])
+    return None
+
+
+async def run_load(port, endpoint, concurrency, requests_per_client):
+    """
+    Send requests from concurrent clients, each waiting for its response before sending the next
+    :return: The per-request latencies in seconds, the number of failed requests and the wall time
+    """
+    url = f"http://127.0.0.1:{port}/{endpoint}"
+    payload = PAYLOADS[endpoint]
+    latencies = []
+    failures = 0
+
+    async def client(session):
+        nonlocal failures
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            try:
+                async with session.post(url, json=payload) as response:
+                    await response.read()
+                    if response.status != 200:
+                        failures += 1
+            except aiohttp.ClientError:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=600)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        wall_time = time.perf_counter() - start
+    return latencies, failures, wall_time
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--requests-per-client", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--blob-latency", type=float, default=0.05)
+    parser.add_argument("--endpoint", choices=sorted(PAYLOADS), default="generate_questions_from_document")
+    parser.add_argument("--serve", choices=["threaded", "async"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.llm_latency, args.blob_latency)
+        return
+
+    print(f"POST /{args.endpoint}, LLM latency {args.llm_latency}s, blob latency {args.blob_latency}s, "
+          f"{args.requests_per_client} requests per client")
+    print(f"{'server':<10}{'clients':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'failed':>8}{'threads':>9}")
+    for concurrency in args.concurrency:
+        for mode in ("threaded", "async"):
+            with tempfile.TemporaryFile() as log_file:
+                process, port = start_server(mode, args, log_file)
+                try:
+                    latencies, failures, wall_time = asyncio.run(
+                        run_load(port, args.endpoint, concurrency, args.requests_per_client)
+                    )
+                finally:
+                    peak_threads = stop_server(process, log_file)
+            print(f"{mode:<10}{concurrency:>8}{len(latencies) / wall_time:>10.1f}"
+                  f"{statistics.median(latencies) * 1000:>10.0f}{percentile(latencies, 0.95) * 1000:>10.0f}"
+                  f"{failures:>8}{peak_threads if peak_threads is not None else '?':>9}")
+
+
+if __name__ == "__main__":
+    main()
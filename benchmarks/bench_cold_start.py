@@ -0,0 +1,85 @@
+"""
+Cold-start benchmark: how long a fresh interpreter takes to import the app and answer GET /status, and which
+imports dominate according to `python -X importtime`.
+
+Usage:
+    python -m benchmarks.bench_cold_start [--runs 5] [--top 15]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from benchmarks.fakes import DUMMY_ENV, PROJECT_ROOT
+
+TIME_TO_STATUS = (
+    "import time\n"
+    "start = time.perf_counter()\n"
+    "import app\n"
+    "imported = time.perf_counter()\n"
+    "assert app.app.test_client().get('/status').status_code == 200\n"
+    "print(imported - start, time.perf_counter() - start)\n"
+)
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+
+def benchmark_env(warm_up):
+    env = dict(os.environ)
+    for key, value in DUMMY_ENV.items():
+        env.setdefault(key, value)
+    env["LLM_WARM_UP"] = warm_up
+    return env
+
+
+def time_to_status(runs, warm_up):
+    imports, statuses = [], []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", TIME_TO_STATUS], cwd=PROJECT_ROOT, env=benchmark_env(warm_up),
+            capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        import_seconds, status_seconds = (float(value) for value in output.split())
+        imports.append(import_seconds)
+        statuses.append(status_seconds)
+    return statistics.median(imports), statistics.median(statuses)
+
+
+def heaviest_imports(top):
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"], cwd=PROJECT_ROOT, env=benchmark_env("off"),
+        capture_output=True, text=True, check=True
+    ).stderr
+    first_party = {name[:-3] for name in os.listdir(PROJECT_ROOT) if name.endswith(".py")}
+    modules = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        # Direct imports of the app modules, plus the app itself
+        if name in first_party or indent <= 3:
+            modules.append((cumulative, name))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    print(f"{'LLM_WARM_UP':<12} {'import s':>9} {'first /status s':>16}   (median of {args.runs} runs)")
+    for warm_up in ("off", "background", "eager"):
+        import_seconds, status_seconds = time_to_status(args.runs, warm_up)
+        print(f"{warm_up:<12} {import_seconds:>9.3f} {status_seconds:>16.3f}")
+
+    print(f"\nHeaviest imports with LLM_WARM_UP=off (cumulative ms):")
+    for cumulative, name in heaviest_imports(args.top):
+        print(f"{cumulative / 1000:>9.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark serial against parallel PDF text extraction on the bundled test documents.
+
+Each document is truncated to several page counts so the speedup can be read against document length.
+
+Usage:
+    python -m benchmarks.bench_pdf_extraction [--workers 2 4] [--repeat 3]
+"""
+import argparse
+import glob
+import logging
+import os
+import time
+from io import BytesIO
+
+from pypdf import PdfReader, PdfWriter
+
+from azure_blob import AzureBlob
+
+DUMMY_CONNECTION_STRING = ("DefaultEndpointsProtocol=https;AccountName=benchmark;AccountKey=YmVuY2htYXJr;"
+                           "EndpointSuffix=core.windows.net")
+TEST_DOCUMENTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_documents")
+
+
+def load_documents():
+    """
+    Load the bundled PDFs plus one document concatenating all of them
+    :return: A list of (name, bytes) tuples
+    """
+    documents = []
+    combined = PdfWriter()
+    for path in sorted(glob.glob(os.path.join(TEST_DOCUMENTS, "*.pdf"))):
+        with open(path, "rb") as f:
+            data = f.read()
+        documents.append((os.path.basename(path), data))
+        combined.append(BytesIO(data))
+    stream = BytesIO()
+    combined.write(stream)
+    documents.append(("combined.pdf", stream.getvalue()))
+    return documents
+
+
+def truncate(document_bytes, page_count):
+    writer = PdfWriter()
+    writer.append(BytesIO(document_bytes), pages=(0, page_count))
+    stream = BytesIO()
+    writer.write(stream)
+    return stream.getvalue()
+
+
+def time_extraction(azure_blob, document_bytes, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        azure_blob.extract_text_from_pdf(document_bytes)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # Truncating the lecture packs leaves dangling object references that pypdf warns about
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+
+    serial = AzureBlob(DUMMY_CONNECTION_STRING, "benchmark")
+    parallel = {}
+    for workers in args.workers:
+        azure_blob = AzureBlob(DUMMY_CONNECTION_STRING, "benchmark", pdf_workers=workers, pdf_parallel_min_pages=1)
+        if azure_blob.pdf_workers < workers:
+            print(f"Requested {workers} workers, capped at {azure_blob.pdf_workers} by the available CPUs")
+        parallel.setdefault(azure_blob.pdf_workers, azure_blob)
+    # Start the worker processes before timing anything
+    for azure_blob in parallel.values():
+        if azure_blob.pdf_workers > 1:
+            azure_blob._get_pdf_pool().submit(int).result()
+
+    print(f"CPUs available: {os.cpu_count()}")
+    header = f"{'document':<40} {'pages':>5} {'serial s':>9}"
+    for workers, azure_blob in parallel.items():
+        header += f" {f'{azure_blob.pdf_workers}w s':>8} {'speedup':>7}"
+    print(header)
+
+    for name, data in load_documents():
+        total_pages = len(PdfReader(BytesIO(data)).pages)
+        page_counts = sorted({count for count in (10, 25, 50, total_pages) if count <= total_pages})
+        for page_count in page_counts:
+            document_bytes = data if page_count == total_pages else truncate(data, page_count)
+            serial_time = time_extraction(serial, document_bytes, args.repeat)
+            row = f"{name[:40]:<40} {page_count:>5} {serial_time:>9.3f}"
+            for azure_blob in parallel.values():
+                parallel_time = time_extraction(azure_blob, document_bytes, args.repeat)
+                row += f" {parallel_time:>8.3f} {serial_time / parallel_time:>6.2f}x"
+            print(row, flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark of the per-request overhead outside the LLM call: building prompts and chains on every request
+against reusing the ones prebuilt by PromptRegistry. The model is an instant fake, so the timings are pure overhead.
+
+Usage:
+    python -m benchmarks.bench_prompt_overhead [--iterations 500]
+"""
+import argparse
+import time
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.prompts import PromptTemplate
+
+from output_parser import parser
+from prompts import PromptRegistry, WARM_UP_INPUTS
+
+FAKE_RESPONSE = '{"questions": []}'
+
+
+def build_per_request(registry, name, model):
+    """
+    Rebuild a prompt and chain the way the LLM methods did before the registry existed
+    """
+    template = registry.prompts[name]
+    partial_variables = {}
+    if "format_instructions" in template.partial_variables:
+        partial_variables["format_instructions"] = parser.get_format_instructions()
+    prompt = PromptTemplate(
+        template=template.template,
+        input_variables=list(template.input_variables),
+        partial_variables=partial_variables
+    )
+    if name.startswith("questions"):
+        return prompt | model | parser
+    return prompt | model
+
+
+def time_calls(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--iterations", type=int, default=500)
+    args = arg_parser.parse_args()
+
+    model = FakeListChatModel(responses=[FAKE_RESPONSE])
+    start = time.perf_counter()
+    registry = PromptRegistry(model)
+    registry.warm_up()
+    print(f"Registry build and warm-up: {(time.perf_counter() - start) * 1000:.2f} ms (once at startup)\n")
+
+    print(f"{'chain':<20} {'per-request ms':>15} {'registry ms':>12} {'saved ms':>9}")
+    for name, inputs in WARM_UP_INPUTS.items():
+        before = time_calls(lambda: build_per_request(registry, name, model).invoke(inputs), args.iterations)
+        after = time_calls(lambda: registry.chain(name).invoke(inputs), args.iterations)
+        print(f"{name:<20} {before:>15.3f} {after:>12.3f} {before - after:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Offline benchmark suite: extraction throughput per document format, endpoint latency at several concurrency levels
+and peak memory per request. Azure Blob Storage and Azure OpenAI are replaced with the local fakes in
+benchmarks/fakes.py and the documents come from test_documents/, so results are reproducible without credentials.
+
+Results are written as JSON to benchmarks/results/ (ignored by git) together with the commit they were measured
+on. Pass an earlier results file to --compare to print the change against it.
+
+Usage:
+    python -m benchmarks.bench_suite [--concurrency 1 4 16] [--requests 32] [--llm-latency 0.2]
+                                     [--tokens-per-second 0] [--reason-chars 0] [--repeat 3]
+                                     [--output PATH] [--compare PATH]
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import DUMMY_ENV, PROJECT_ROOT, FakeBlobServiceClient, FakeChatModel, load_test_documents
+
+RESULTS_DIR = os.path.join(PROJECT_ROOT, "benchmarks", "results")
+DOCX_DOCUMENT = "sample_lecture_notes.docx"
+FEEDBACK_ATTEMPT = {"answers": [
+    {"question_id": question_id, "question_text": f"Question {question_id}?", "answer_text": f"Answer {index}",
+     "is_correct": index == 0, "is_selected": index == question_id % 4}
+    for question_id in range(10) for index in range(4)
+]}
+
+
+def endpoint_requests(document):
+    """
+    The request made to each endpoint
+    :param document: The document name for the document-based endpoints
+    :return: A dict of label to (path, body)
+    """
+    return {
+        "questions": ("/generate_questions_from_document",
+                      {"document_id": document, "num_questions": 10, "difficulty": "Medium"}),
+        "bonus_game": ("/generate_bonus_game", {"document_id": document}),
+        "feedback": ("/generate_feedback", FEEDBACK_ATTEMPT),
+    }
+
+
+def load_app(args):
+    """
+    Import the app with placeholder credentials and swap in the fake backends
+    """
+    for key, value in DUMMY_ENV.items():
+        os.environ.setdefault(key, value)
+    # Every request should pay for its download and extraction, and nothing should run in the background.
+    # Concurrent identical requests must not be coalesced into one, nor read text or section indexes from sidecars;
+    # with sidecars off, the first bonus game does not persist a section index for the later ones either
+    os.environ.update({"DOCUMENT_CACHE_ENABLED": "false", "LLM_WARM_UP": "off", "SLOW_REQUEST_PROFILE_SECONDS": "0",
+                       "SINGLE_FLIGHT_ENABLED": "false", "DOCUMENT_SIDECARS_ENABLED": "false"})
+    import app
+
+    app.azure_blob.blob_service_client = FakeBlobServiceClient.from_directory()
+    app.llm.model = FakeChatModel(latency=args.llm_latency, tokens_per_second=args.tokens_per_second,
+                                  reason_chars=args.reason_chars)
+    app.llm.warm_up()
+    return app
+
+
+def bench_extraction(azure_blob, repeat):
+    """
+    Time text extraction of every bundled document
+    :return: A dict of document name to its size, extracted length and throughput
+    """
+    results = {}
+    for blob_name, data in load_test_documents().items():
+        name = blob_name.split("/", 1)[1]
+        # An untimed first run imports the parser library for the format
+        text = azure_blob.extract_text(name, data)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            text = azure_blob.extract_text(name, data)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = {
+            "format": azure_blob.get_document_extension(name),
+            "bytes": len(data),
+            "chars": len(text or ""),
+            "seconds": round(best, 4),
+            "mb_per_second": round(len(data) / best / 1024 / 1024, 2),
+        }
+    return results
+
+
+def bench_endpoints(app, document, concurrency_levels, requests):
+    """
+    Send the same request from a number of concurrent clients and measure latency and throughput
+    :return: A dict of endpoint label to a dict of concurrency level to its statistics
+    """
+    results = {}
+    for label, (path, body) in endpoint_requests(document).items():
+        results[label] = {}
+        for concurrency in concurrency_levels:
+            def send(_):
+                start = time.perf_counter()
+                status = app.app.test_client().post(path, json=body).status_code
+                return time.perf_counter() - start, status
+
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                start = time.perf_counter()
+                outcomes = list(executor.map(send, range(requests)))
+                wall_time = time.perf_counter() - start
+            latencies = sorted(latency for latency, _ in outcomes)
+            results[label][str(concurrency)] = {
+                "requests_per_second": round(requests / wall_time, 2),
+                "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+                "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+                "failed": sum(1 for _, status in outcomes if status != 200),
+            }
+    return results
+
+
+def bench_memory(app):
+    """
+    Measure the peak Python heap allocated while serving one request, for every document and endpoint
+    :return: A dict of "endpoint document" to the peak in KiB
+    """
+    results = {}
+    documents = [name.split("/", 1)[1] for name in load_test_documents()]
+    cases = [(label, document, path, body) for document in documents
+             for label, (path, body) in endpoint_requests(document).items() if label != "feedback"]
+    cases.append(("feedback", "-", *endpoint_requests(DOCX_DOCUMENT)["feedback"]))
+    client = app.app.test_client()
+    for label, document, path, body in cases:
+        tracemalloc.start()
+        client.post(path, json=body)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[f"{label} {document}"] = round(peak / 1024, 1)
+    return results
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=PROJECT_ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def flatten(results, prefix=""):
+    """
+    Flatten nested results into "a / b / c" keys for comparison
+    """
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix} / {key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def print_comparison(current, baseline):
+    print(f"\nComparison with {baseline['commit']} ({baseline['timestamp']})")
+    before = flatten(baseline["results"])
+    after = flatten(current["results"])
+    for name in sorted(after.keys() & before.keys()):
+        if before[name] == after[name] or not before[name]:
+            continue
+        change = (after[name] - before[name]) / before[name]
+        print(f"  {name:<70} {before[name]:>10} -> {after[name]:<10} ({change:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="requests per endpoint and concurrency level")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="fake LLM time to first token, seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="fake LLM generation speed, 0 = instant")
+    parser.add_argument("--reason-chars", type=int, default=0, help="pad each answer reason to grow the output")
+    parser.add_argument("--repeat", type=int, default=3, help="extraction runs per document, the best is kept")
+    parser.add_argument("--document", default=DOCX_DOCUMENT, help="document used for the endpoint latency runs")
+    parser.add_argument("--output", help="results file, defaults to benchmarks/results/<timestamp>-<commit>.json")
+    parser.add_argument("--compare", help="an earlier results file to compare against")
+    args = parser.parse_args()
+
+    # The bonus game picks its type at random; a fixed seed keeps the request mix identical between runs
+    random.seed(0)
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+    app = load_app(args)
+
+    # The app logs every request; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        extraction = bench_extraction(app.azure_blob, args.repeat)
+        endpoints = bench_endpoints(app, args.document, args.concurrency, args.requests)
+        memory = bench_memory(app)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": vars(args),
+        "results": {"extraction": extraction, "endpoints": endpoints, "peak_memory_kib": memory},
+    }
+
+    print(f"Commit {report['commit']}, {report['cpu_count']} CPUs, fake LLM latency {args.llm_latency}s\n")
+    print(f"{'document':<40}{'format':>7}{'KiB':>9}{'chars':>9}{'ms':>9}{'MB/s':>8}")
+    for name, result in extraction.items():
+        print(f"{name:<40}{result['format']:>7}{result['bytes'] / 1024:>9.0f}{result['chars']:>9}"
+              f"{result['seconds'] * 1000:>9.1f}{result['mb_per_second']:>8.2f}")
+
+    print(f"\n{'endpoint':<14}{'clients':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'failed':>8}")
+    for label, levels in endpoints.items():
+        for concurrency, result in levels.items():
+            print(f"{label:<14}{concurrency:>8}{result['requests_per_second']:>9.2f}{result['p50_ms']:>9.1f}"
+                  f"{result['p95_ms']:>9.1f}{result['failed']:>8}")
+
+    print(f"\n{'request':<54}{'peak KiB':>10}")
+    for name, peak in memory.items():
+        print(f"{name:<54}{peak:>10.1f}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Local stand-ins for Azure Blob Storage and Azure OpenAI so benchmarks run offline with controllable latency.
+"""
+import asyncio
+import datetime
+import glob
+import hashlib
+import json
+import os
+import re
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DOCUMENTS = os.path.join(PROJECT_ROOT, "test_documents")
+
+# Placeholder configuration so the app can be imported without real Azure credentials
+DUMMY_ENV = {
+    "AZURE_STORAGE_CONNECTION_STRING": "DefaultEndpointsProtocol=https;AccountName=benchmark;"
+                                       "AccountKey=YmVuY2htYXJr;EndpointSuffix=core.windows.net",
+    "AZURE_STORAGE_CONTAINER_NAME": "benchmark",
+    "AZURE_OPENAI_API_KEY": "benchmark",
+    "AZURE_OPENAI_ENDPOINT": "https://benchmark.openai.azure.com",
+    "AZURE_OPENAI_DEPLOYMENT_NAME": "benchmark",
+    "AZURE_OPENAI_API_VERSION": "2024-02-01",
+    "AZURE_OPENAI_TEMPERATURE": "0.2",
+}
+
+
+def load_test_documents(directory=TEST_DOCUMENTS, prefix="documents/"):
+    """
+    Read the bundled documents into a blob dict keyed the way the app names blobs
+    :param directory: The directory holding the documents
+    :param prefix: The blob name prefix
+    :return: A dict of blob name to bytes
+    """
+    blobs = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*"))):
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                blobs[prefix + os.path.basename(path)] = f.read()
+    return blobs
+
+
+class BlobNotFoundError(FileNotFoundError):
+    """
+    Raised for a missing blob, with the status code the storage SDK's ResourceNotFoundError carries
+    """
+    status_code = 404
+
+
+class FakeBlobProperties:
+    def __init__(self, data, name=None, metadata=None):
+        self.name = name
+        self.size = len(data)
+        self.etag = hashlib.md5(data).hexdigest()
+        self.last_modified = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        self.metadata = dict(metadata or {})
+
+
+class FakeDownloadStream:
+    def __init__(self, data, chunk_size, metadata=None):
+        self.data = data
+        self.size = len(data)
+        self.properties = FakeBlobProperties(data, metadata=metadata)
+        self.chunk_size = chunk_size
+
+    def readall(self):
+        return self.data
+
+    def chunks(self):
+        for start in range(0, len(self.data), self.chunk_size):
+            yield self.data[start:start + self.chunk_size]
+
+
+class FakeBlobClient:
+    def __init__(self, service, blob):
+        self.service = service
+        self.blob = blob
+
+    def _data(self):
+        if self.blob not in self.service.blobs:
+            raise BlobNotFoundError(f"The specified blob does not exist: {self.blob}")
+        return self.service.blobs[self.blob]
+
+    def _metadata(self):
+        return self.service.metadata.get(self.blob)
+
+    def get_blob_properties(self, **kwargs):
+        time.sleep(self.service.latency)
+        return FakeBlobProperties(self._data(), self.blob, self._metadata())
+
+    def download_blob(self, **kwargs):
+        time.sleep(self.service.latency)
+        return FakeDownloadStream(self._data(), self.service.chunk_size, self._metadata())
+
+    def upload_blob(self, data, overwrite=False, metadata=None, **kwargs):
+        time.sleep(self.service.latency)
+        if not overwrite and self.blob in self.service.blobs:
+            raise FileExistsError(f"The specified blob already exists: {self.blob}")
+        self.service.blobs[self.blob] = bytes(data)
+        self.service.metadata[self.blob] = dict(metadata or {})
+
+
+class FakeContainerClient:
+    def __init__(self, service):
+        self.service = service
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        time.sleep(self.service.latency)
+        for name in sorted(self.service.blobs):
+            if name.startswith(name_starts_with or ""):
+                yield FakeBlobProperties(self.service.blobs[name], name, self.service.metadata.get(name))
+
+
+class FakeBlobServiceClient:
+    """
+    An in-memory blob store that sleeps for a fixed latency on every request
+    """
+
+    def __init__(self, blobs, latency=0.0, chunk_size=4 * 1024 * 1024):
+        self.blobs = blobs
+        self.metadata = {}
+        self.latency = latency
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_directory(cls, directory=TEST_DOCUMENTS, **kwargs):
+        """
+        Serve the files in a directory as blobs under documents/
+        """
+        return cls(load_test_documents(directory), **kwargs)
+
+    def get_blob_client(self, container, blob):
+        return FakeBlobClient(self, blob)
+
+    def get_container_client(self, container):
+        return FakeContainerClient(self)
+
+
+class AsyncFakeDownloadStream(FakeDownloadStream):
+    async def readall(self):
+        return self.data
+
+    async def chunks(self):
+        for start in range(0, len(self.data), self.chunk_size):
+            yield self.data[start:start + self.chunk_size]
+
+
+class AsyncFakeBlobClient(FakeBlobClient):
+    async def get_blob_properties(self, **kwargs):
+        await asyncio.sleep(self.service.latency)
+        return FakeBlobProperties(self._data(), self.blob, self._metadata())
+
+    async def download_blob(self, **kwargs):
+        await asyncio.sleep(self.service.latency)
+        return AsyncFakeDownloadStream(self._data(), self.service.chunk_size, self._metadata())
+
+
+class AsyncFakeBlobServiceClient(FakeBlobServiceClient):
+    """
+    Async counterpart of FakeBlobServiceClient, shaped like azure.storage.blob.aio.BlobServiceClient
+    """
+
+    def get_blob_client(self, container, blob):
+        return AsyncFakeBlobClient(self, blob)
+
+    async def close(self):
+        pass
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    A deterministic chat model that answers each prompt in this repo with valid JSON. The simulated latency is a
+    fixed time to first token plus the output length at a fixed generation speed, and reason_chars pads every
+    answer reason to make the output larger.
+    """
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    reason_chars: int = 0
+
+    @property
+    def _llm_type(self):
+        return "fake-chat-model"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        content = self.content(messages)
+        time.sleep(self.delay(content))
+        return self._result(messages, content)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        content = self.content(messages)
+        await asyncio.sleep(self.delay(content))
+        return self._result(messages, content)
+
+    def content(self, messages):
+        return json.dumps(self.respond(messages[-1].content, self.reason_chars))
+
+    def delay(self, content):
+        if not self.tokens_per_second:
+            return self.latency
+        return self.latency + len(content) / 4 / self.tokens_per_second
+
+    @staticmethod
+    def _result(messages, content):
+        # Token counts use the same 4 characters per token estimate as prompt compaction
+        input_tokens = sum(len(message.content) for message in messages) // 4
+        output_tokens = len(content) // 4
+        message = AIMessage(content=content, usage_metadata={
+            "input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    @staticmethod
+    def respond(prompt, reason_chars=0):
+        """
+        Build a response for a rendered prompt
+        :param prompt: The prompt text
+        :param reason_chars: Roughly how many characters to pad each answer reason to
+        :return: The response as a JSON serialisable value
+        """
+        if "matching pairs mini-game" in prompt:
+            return {
+                "game_type": "matching",
+                "prompt": "Match each term to its definition.",
+                "pairs": [{"left": f"Term {index}", "right": f"Definition {index}"} for index in range(1, 5)],
+                "hint": "Start with the terms you know best."
+            }
+        if "ordering sequence mini-game" in prompt:
+            return {
+                "game_type": "ordering",
+                "prompt": "Put the steps in order.",
+                "items": [f"Step {index}" for index in range(1, 5)],
+                "answer_order": [0, 1, 2, 3],
+                "hint": "Think about what must happen first."
+            }
+        if "quiz attempt" in prompt:
+            return {
+                "quest_summary": {
+                    "overall_bloom_rating": 3,
+                    "overall_bloom_level": "Apply",
+                    "summary": "Solid attempt."
+                },
+                "subtopic_feedback": [],
+                "study_tips": ["Review the questions you missed."]
+            }
+
+        match = re.search(r"generate (\d+) questions", prompt)
+        num_questions = int(match.group(1)) if match else 1
+        return {"questions": [
+            {
+                "number": number,
+                "text": f"Question {number}?",
+                "hint": "Recall the key concept.",
+                "question_type": "mcq",
+                "structured_data": {},
+                "answers": [
+                    {"text": f"Answer {index}", "is_correct": index == 0,
+                     "reason": "Because." + " The reasoning continues." * (reason_chars // 25)}
+                    for index in range(4)
+                ]
+            }
+            for number in range(1, num_questions + 1)
+        ]}
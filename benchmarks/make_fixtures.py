@@ -0,0 +1,88 @@
+"""
+Generate the DOCX and PPTX benchmark fixtures in test_documents/. The content is fixed, so regenerating the
+fixtures does not change what the benchmarks measure.
+
+Usage:
+    python -m benchmarks.make_fixtures
+"""
+import datetime
+import os
+
+from docx import Document
+from pptx import Presentation
+from pptx.util import Inches, Pt
+
+from benchmarks.fakes import TEST_DOCUMENTS
+
+DOCX_FIXTURE = "sample_lecture_notes.docx"
+PPTX_FIXTURE = "sample_lecture_slides.pptx"
+FIXED_TIMESTAMP = datetime.datetime(2024, 1, 1)
+
+TOPICS = [
+    ("Transactions", "A transaction groups reads and writes into one unit of work that either commits or aborts."),
+    ("Atomicity", "Atomicity guarantees that a transaction's effects are applied completely or not at all."),
+    ("Consistency", "Consistency requires every committed transaction to move the database between valid states."),
+    ("Isolation", "Isolation hides the intermediate state of a transaction from concurrently running transactions."),
+    ("Durability", "Durability ensures that committed changes survive crashes, usually through a write-ahead log."),
+    ("Two-phase locking", "Two-phase locking acquires every lock before releasing any, which guarantees "
+                          "conflict-serializable schedules."),
+    ("Deadlocks", "A deadlock occurs when transactions wait on each other's locks; detectors break cycles in the "
+                  "wait-for graph."),
+    ("Timestamp ordering", "Timestamp ordering serialises transactions by start time and aborts any that would "
+                           "read or write out of order."),
+    ("Multiversion concurrency", "MVCC keeps several versions of each row so readers never block writers."),
+    ("Recovery", "ARIES recovery replays the log in analysis, redo and undo passes after a crash."),
+    ("Checkpoints", "Checkpoints bound recovery time by recording which pages were dirty and which transactions "
+                    "were active."),
+    ("Isolation levels", "Read committed, repeatable read and serializable trade anomalies such as phantoms "
+                         "against throughput."),
+]
+FOOTER = "SC2207 Database Systems | Lecture 7 | Confidential"
+
+
+def make_docx(path, paragraphs_per_topic=6):
+    document = Document()
+    document.core_properties.created = FIXED_TIMESTAMP
+    document.core_properties.modified = FIXED_TIMESTAMP
+    document.add_heading("Lecture 7: Transactions and Concurrency Control", level=0)
+    for number, (topic, summary) in enumerate(TOPICS, start=1):
+        document.add_heading(f"{number}. {topic}", level=1)
+        for index in range(paragraphs_per_topic):
+            document.add_paragraph(
+                f"{summary} Example {index + 1}: consider two transactions T{index} and T{index + 1} that update "
+                f"the same account balance while a report reads it; the outcome depends on how {topic.lower()} "
+                f"is enforced by the database engine."
+            )
+    document.save(path)
+
+
+def make_pptx(path, bullets_per_slide=5):
+    presentation = Presentation()
+    presentation.core_properties.created = FIXED_TIMESTAMP
+    presentation.core_properties.modified = FIXED_TIMESTAMP
+    layout = presentation.slide_layouts[1]
+    for number, (topic, summary) in enumerate(TOPICS, start=1):
+        slide = presentation.slides.add_slide(layout)
+        slide.shapes.title.text = f"{number}. {topic}"
+        body = slide.placeholders[1].text_frame
+        body.text = summary
+        for index in range(bullets_per_slide - 1):
+            paragraph = body.add_paragraph()
+            paragraph.text = f"Point {index + 1}: how {topic.lower()} affects schedule S{index} under contention"
+            paragraph.level = 1
+        # Repeated footer text, as exported decks usually carry, to exercise boilerplate stripping
+        footer = slide.shapes.add_textbox(Inches(0.5), Inches(7), Inches(9), Inches(0.4)).text_frame
+        footer.text = FOOTER
+        footer.paragraphs[0].runs[0].font.size = Pt(10)
+    presentation.save(path)
+
+
+def main():
+    for name, make in ((DOCX_FIXTURE, make_docx), (PPTX_FIXTURE, make_pptx)):
+        path = os.path.join(TEST_DOCUMENTS, name)
+        make(path)
+        print(f"Wrote {path} ({os.path.getsize(path)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
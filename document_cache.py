@@ -0,0 +1,180 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class DocumentCache:
+    """
+    Two-tier cache for extracted document text.
+
+    The first tier is a bounded in-memory LRU, the second an optional directory on disk. Entries are keyed on
+    the blob name together with its ETag and last-modified time, so a re-uploaded document never serves stale text.
+    """
+
+    def __init__(self, max_memory_bytes=64 * 1024 * 1024, max_memory_entries=256, disk_dir=None,
+                 max_disk_bytes=1024 * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_memory_entries = max_memory_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(blob_name, etag, last_modified):
+        """
+        Build a cache key for a blob version
+        :param blob_name: The blob name
+        :param etag: The blob ETag
+        :param last_modified: The blob last-modified timestamp
+        :return: A hex digest identifying this version of the blob
+        """
+        raw = f"{blob_name}\n{etag}\n{last_modified.isoformat() if last_modified else ''}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Look up extracted text, promoting disk hits into memory
+        :param key: The cache key
+        :return: The cached text, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return entry[0]
+
+        text = self._read_disk(key)
+        with self._lock:
+            if text is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._put_memory(key, text)
+        return text
+
+    def put(self, key, text):
+        """
+        Store extracted text in both tiers
+        :param key: The cache key
+        :param text: The extracted document text
+        """
+        if text is None:
+            return
+        with self._lock:
+            self._put_memory(key, text)
+        self._write_disk(key, text)
+
+    def stats(self):
+        """
+        Snapshot of cache counters and sizes
+        :return: A dict of hit/miss/eviction counters and current usage against the limits
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+            stats["evictions"] = stats["memory_evictions"] + stats["disk_evictions"]
+            stats["memory_entries"] = len(self._entries)
+            stats["memory_bytes"] = self._memory_bytes
+            stats["max_memory_entries"] = self.max_memory_entries
+            stats["max_memory_bytes"] = self.max_memory_bytes
+        stats["disk_enabled"] = bool(self.disk_dir)
+        if self.disk_dir:
+            stats["disk_bytes"] = sum(size for _, size, _ in self._disk_files())
+            stats["max_disk_bytes"] = self.max_disk_bytes
+        return stats
+
+    def _put_memory(self, key, text):
+        size = len(text.encode("utf-8"))
+        if size > self.max_memory_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= previous[1]
+        self._entries[key] = (text, size)
+        self._memory_bytes += size
+        while self._entries and (self._memory_bytes > self.max_memory_bytes
+                                 or len(self._entries) > self.max_memory_entries):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._memory_bytes -= evicted_size
+            self._counters["memory_evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.txt")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path)
+            return text
+        except OSError:
+            return None
+
+    def _write_disk(self, key, text):
+        if not self.disk_dir:
+            return
+        data = text.encode("utf-8")
+        if len(data) > self.max_disk_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[Document Cache] Failed to write disk entry: {str(e)}", flush=True)
+            return
+        self._trim_disk()
+
+    def _disk_files(self):
+        files = []
+        try:
+            names = os.listdir(self.disk_dir)
+        except OSError:
+            return files
+        for name in names:
+            if not name.endswith(".txt"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _trim_disk(self):
+        files = self._disk_files()
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_disk_bytes:
+            return
+        # Least recently used first; reads touch the file's mtime
+        for path, size, _ in sorted(files, key=lambda f: f[2]):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self._counters["disk_evictions"] += 1
@@ -0,0 +1,187 @@
+import os
+from io import BytesIO
+
+# Text extractors keyed by file extension. Each parser library is imported on first use of its format only,
+# so starting the app does not pay for pypdf, python-docx and python-pptx up front.
+EXTRACTORS = {}
+
+# Section extractors split a document into the units indexed for retrieval: pages, slides or heading-delimited
+# parts. Joined with newlines, the sections of a document give exactly the text of its text extractor.
+SECTION_EXTRACTORS = {}
+
+# Largest Word document section, in characters, before it is split at the next paragraph
+SECTION_MAX_CHARS = 4000
+
+
+def register_extractor(extension):
+    """
+    Register a text extractor for a file extension
+    :param extension: The file extension, without the dot
+    :return: A decorator that registers a function taking a file object and yielding text fragments
+    """
+    def decorator(fn):
+        EXTRACTORS[extension] = fn
+        return fn
+    return decorator
+
+
+def get_extractor(extension):
+    """
+    Get the text extractor for a file extension
+    :param extension: The file extension, without the dot
+    :return: The extractor function, or None if the format is not supported
+    """
+    return EXTRACTORS.get(extension)
+
+
+def register_section_extractor(extension):
+    """
+    Register a section extractor for a file extension
+    :param extension: The file extension, without the dot
+    :return: A decorator that registers a function taking a file object and yielding section texts
+    """
+    def decorator(fn):
+        SECTION_EXTRACTORS[extension] = fn
+        return fn
+    return decorator
+
+
+def get_section_extractor(extension):
+    """
+    Get the section extractor for a file extension
+    :param extension: The file extension, without the dot
+    :return: The extractor function, or None if the format is not supported
+    """
+    return SECTION_EXTRACTORS.get(extension)
+
+
+@register_extractor('docx')
+def iter_text_from_docx(document_file):
+    """
+    Extract text from a Word document paragraph by paragraph
+    :param document_file: A file object holding the document
+    :return: A generator of paragraph texts
+    """
+    from docx import Document
+
+    doc = Document(document_file)
+    for para in doc.paragraphs:
+        yield para.text
+
+
+@register_section_extractor('docx')
+def iter_sections_from_docx(document_file, max_chars=SECTION_MAX_CHARS):
+    """
+    Split a Word document into sections at each heading, and within long sections every max_chars characters
+    :param document_file: A file object holding the document
+    :param max_chars: The largest section size before it is split at the next paragraph
+    :return: A generator of section texts
+    """
+    from docx import Document
+
+    doc = Document(document_file)
+    section = []
+    size = 0
+    for para in doc.paragraphs:
+        style_name = para.style.name if para.style is not None else ''
+        is_heading = style_name.startswith('Heading') or style_name == 'Title'
+        if section and (is_heading or size + len(para.text) > max_chars):
+            yield '\n'.join(section)
+            section = []
+            size = 0
+        section.append(para.text)
+        size += len(para.text) + 1
+    if section:
+        yield '\n'.join(section)
+
+
+def open_pdf(document_file):
+    """
+    Open a PDF document for reading
+    :param document_file: A file object holding the document
+    :return: The PDF reader
+    """
+    from pypdf import PdfReader
+
+    return PdfReader(document_file)
+
+
+@register_extractor('pdf')
+def iter_text_from_pdf(document_file, pdf=None):
+    """
+    Extract text from a PDF document page by page
+    :param document_file: A file object holding the document
+    :param pdf: An already opened reader for the document, if any
+    :return: A generator of page texts
+    """
+    if pdf is None:
+        pdf = open_pdf(document_file)
+    for page in pdf.pages:
+        yield page.extract_text()
+
+
+@register_section_extractor('pdf')
+def iter_sections_from_pdf(document_file):
+    """
+    Split a PDF document into one section per page
+    :param document_file: A file object holding the document
+    :return: A generator of page texts
+    """
+    yield from iter_text_from_pdf(document_file)
+
+
+def extract_text_from_pdf_pages(document_bytes, start, stop):
+    """
+    Extract text from a range of pages in a PDF document. Runs inside a worker process.
+    :param document_bytes: The document in bytes
+    :param start: The first page index, inclusive
+    :param stop: The last page index, exclusive
+    :return: The extracted text of each page in order
+    """
+    pdf = open_pdf(BytesIO(document_bytes))
+    return [pdf.pages[index].extract_text() for index in range(start, stop)]
+
+
+def report_worker_pid(worker_pids):
+    """
+    Report the process ID of a new extraction worker, so the pool's owner can kill it. Runs inside a worker process.
+    :param worker_pids: The queue that collects the pool's worker process IDs
+    """
+    worker_pids.put(os.getpid())
+
+
+def iter_slide_runs(document_file):
+    """
+    Read the text runs of a PowerPoint document
+    :param document_file: A file object holding the document
+    :return: A generator of the list of text runs on each slide
+    """
+    from pptx import Presentation
+
+    ppt = Presentation(document_file)
+    for slide in ppt.slides:
+        yield [run.text for shape in slide.shapes if shape.has_text_frame
+               for paragraph in shape.text_frame.paragraphs for run in paragraph.runs]
+
+
+@register_extractor('pptx')
+def iter_text_from_pptx(document_file):
+    """
+    Extract text from a PowerPoint document run by run
+    :param document_file: A file object holding the document
+    :return: A generator of text runs
+    """
+    for runs in iter_slide_runs(document_file):
+        yield from runs
+
+
+@register_section_extractor('pptx')
+def iter_sections_from_pptx(document_file):
+    """
+    Split a PowerPoint document into one section per slide, leaving out slides without text
+    :param document_file: A file object holding the document
+    :return: A generator of slide texts
+    """
+    for runs in iter_slide_runs(document_file):
+        if runs:
+            yield '\n'.join(runs)
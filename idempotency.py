@@ -0,0 +1,336 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class IdempotencyKeyInUseError(RuntimeError):
+    """
+    Raised when a request with the same Idempotency-Key is still being processed after the wait timeout
+    """
+
+    def __init__(self, key, retry_after):
+        self.key = key
+        self.retry_after = retry_after
+        super().__init__(f"A request with Idempotency-Key {key} is still in progress, retry in {retry_after}s")
+
+
+class IdempotencyKeyMismatchError(RuntimeError):
+    """
+    Raised when an Idempotency-Key is reused with a different request body
+    """
+
+    def __init__(self, key):
+        self.key = key
+        super().__init__(f"Idempotency-Key {key} was already used with a different request")
+
+
+class IdempotencyStore:
+    """
+    Storage backend for idempotency records. A record is pending while its request runs and holds the response
+    once it has completed. Subclass this to keep records somewhere other than process memory or SQLite.
+    """
+
+    def claim(self, key, fingerprint, stale_after):
+        """
+        Atomically create a pending record, taking over a pending record older than stale_after or an expired one
+        :param key: The scoped idempotency key
+        :param fingerprint: A hash of the request, to detect a key reused for a different request
+        :param stale_after: Seconds after which a pending record is assumed abandoned, e.g. by a crashed worker
+        :return: None if the caller now owns the key, otherwise a copy of the existing record
+        """
+        raise NotImplementedError
+
+    def complete(self, key, status_code, body, ttl_seconds):
+        """
+        Store the response of a claimed request
+        :param key: The scoped idempotency key
+        :param status_code: The response status code
+        :param body: The JSON serialisable response body
+        :param ttl_seconds: How long the response is kept
+        """
+        raise NotImplementedError
+
+    def release(self, key):
+        """
+        Drop a claimed record without a response, so that a retry runs the request again
+        :param key: The scoped idempotency key
+        """
+        raise NotImplementedError
+
+    def get(self, key):
+        """
+        Get a record
+        :param key: The scoped idempotency key
+        :return: A copy of the record, or None if it does not exist or has expired
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class InMemoryIdempotencyStore(IdempotencyStore):
+    """
+    Idempotency store backed by a dict. Records are only shared between the threads of one process.
+    """
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key, fingerprint, stale_after):
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            record = self._records.get(key)
+            stale = record is not None and record["state"] == "pending" and record["created_at"] < now - stale_after
+            if record is not None and not stale:
+                return dict(record)
+            self._records[key] = {"fingerprint": fingerprint, "state": "pending", "status_code": None, "body": None,
+                                  "created_at": now, "expires_at": None}
+            return None
+
+    def complete(self, key, status_code, body, ttl_seconds):
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None:
+                record.update(state="done", status_code=status_code, body=body, expires_at=time.time() + ttl_seconds)
+
+    def release(self, key):
+        with self._lock:
+            self._records.pop(key, None)
+
+    def get(self, key):
+        with self._lock:
+            self._purge_expired(time.time())
+            record = self._records.get(key)
+            return dict(record) if record is not None else None
+
+    def stats(self):
+        with self._lock:
+            return {"records": len(self._records)}
+
+    def _purge_expired(self, now):
+        expired = [key for key, record in self._records.items()
+                   if record["expires_at"] is not None and record["expires_at"] < now]
+        for key in expired:
+            del self._records[key]
+
+
+class SQLiteIdempotencyStore(IdempotencyStore):
+    """
+    Idempotency store backed by a SQLite file, so records survive restarts and are shared by every worker process
+    on the host
+    """
+
+    def __init__(self, path):
+        self.path = path
+        connection = self._connect()
+        try:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, state TEXT NOT NULL, status_code INTEGER, "
+                "body TEXT, created_at REAL NOT NULL, expires_at REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS idempotency_expires_at ON idempotency (expires_at)")
+        finally:
+            connection.close()
+
+    def _connect(self):
+        # One connection per call keeps the store safe to use from any thread
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def claim(self, key, fingerprint, stale_after):
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM idempotency WHERE expires_at < ?", (now,))
+            connection.execute("DELETE FROM idempotency WHERE key = ? AND state = 'pending' AND created_at < ?",
+                               (key, now - stale_after))
+            inserted = connection.execute(
+                "INSERT OR IGNORE INTO idempotency (key, fingerprint, state, created_at) VALUES (?, ?, 'pending', ?)",
+                (key, fingerprint, now)
+            ).rowcount
+            record = None if inserted else self._select(connection, key)
+            connection.execute("COMMIT")
+            return record
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def complete(self, key, status_code, body, ttl_seconds):
+        connection = self._connect()
+        try:
+            connection.execute(
+                "UPDATE idempotency SET state = 'done', status_code = ?, body = ?, expires_at = ? WHERE key = ?",
+                (status_code, json.dumps(body), time.time() + ttl_seconds, key)
+            )
+        finally:
+            connection.close()
+
+    def release(self, key):
+        connection = self._connect()
+        try:
+            connection.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+        finally:
+            connection.close()
+
+    def get(self, key):
+        connection = self._connect()
+        try:
+            record = self._select(connection, key)
+        finally:
+            connection.close()
+        if record is not None and record["expires_at"] is not None and record["expires_at"] < time.time():
+            return None
+        return record
+
+    def stats(self):
+        connection = self._connect()
+        try:
+            return {"records": connection.execute("SELECT COUNT(*) FROM idempotency").fetchone()[0]}
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _select(connection, key):
+        row = connection.execute(
+            "SELECT fingerprint, state, status_code, body, created_at, expires_at FROM idempotency WHERE key = ?",
+            (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        fingerprint, state, status_code, body, created_at, expires_at = row
+        return {"fingerprint": fingerprint, "state": state, "status_code": status_code,
+                "body": json.loads(body) if body is not None else None, "created_at": created_at,
+                "expires_at": expires_at}
+
+
+class IdempotencyManager:
+    """
+    Runs a request at most once per Idempotency-Key. A repeated key returns the stored response, or waits for the
+    request that is still running with that key. Only successful responses are stored: after an error the key is
+    released, so a retry runs the request again.
+    """
+
+    def __init__(self, store=None, ttl_seconds=86400, wait_seconds=120, stale_after_seconds=600,
+                 poll_interval=0.1):
+        """
+        :param store: The idempotency store, defaults to an in-memory store
+        :param ttl_seconds: How long a stored response is replayed
+        :param wait_seconds: How long a repeated request waits for the original before giving up with a 409
+        :param stale_after_seconds: After how long a pending request is assumed lost and its key can be reclaimed
+        :param poll_interval: How often a waiting request checks the store, in seconds
+        """
+        self.store = store if store is not None else InMemoryIdempotencyStore()
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        self.stale_after_seconds = stale_after_seconds
+        self.poll_interval = poll_interval
+        self._counters = {"requests": 0, "replayed": 0, "waited": 0, "mismatched": 0, "timed_out": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(data):
+        return hashlib.sha256(data or b"").hexdigest()
+
+    def run(self, key, data, fn):
+        """
+        Run a request once for its key
+        :param key: The idempotency key, scoped to the endpoint by the caller
+        :param data: The raw request body
+        :param fn: Called with no arguments to run the request, returning a (body, status code) tuple
+        :return: A (body, status code, replayed) tuple
+        """
+        fingerprint = self.fingerprint(data)
+        deadline = time.monotonic() + self.wait_seconds
+        self._count("requests")
+        waited = False
+        while True:
+            outcome = self._try_claim(key, fingerprint, deadline)
+            if outcome is None:
+                return self._run_claimed(key, fn)
+            if outcome != "pending":
+                return outcome
+            if not waited:
+                self._count("waited")
+                waited = True
+            time.sleep(self.poll_interval)
+
+    async def arun(self, key, data, fn):
+        """
+        Async counterpart of run
+        :param fn: A coroutine function returning a (body, status code) tuple
+        """
+        fingerprint = self.fingerprint(data)
+        deadline = time.monotonic() + self.wait_seconds
+        self._count("requests")
+        waited = False
+        while True:
+            outcome = self._try_claim(key, fingerprint, deadline)
+            if outcome is None:
+                try:
+                    body, status_code = await fn()
+                except BaseException:
+                    self.store.release(key)
+                    raise
+                return self._finish(key, body, status_code)
+            if outcome != "pending":
+                return outcome
+            if not waited:
+                self._count("waited")
+                waited = True
+            await asyncio.sleep(self.poll_interval)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(self.store.stats())
+        return stats
+
+    def _try_claim(self, key, fingerprint, deadline):
+        """
+        :return: None if the key was claimed, "pending" if the caller should poll again, or the replayed response
+        """
+        record = self.store.claim(key, fingerprint, self.stale_after_seconds)
+        if record is None:
+            return None
+        if record["fingerprint"] != fingerprint:
+            self._count("mismatched")
+            raise IdempotencyKeyMismatchError(key)
+        if record["state"] == "done":
+            self._count("replayed")
+            print(f"[Idempotency] Replaying the stored response for {key}", flush=True)
+            return record["body"], record["status_code"], True
+        if time.monotonic() >= deadline:
+            self._count("timed_out")
+            remaining = self.stale_after_seconds - (time.time() - record["created_at"])
+            raise IdempotencyKeyInUseError(key, max(1, round(min(remaining, self.wait_seconds))))
+        return "pending"
+
+    def _run_claimed(self, key, fn):
+        try:
+            body, status_code = fn()
+        except BaseException:
+            self.store.release(key)
+            raise
+        return self._finish(key, body, status_code)
+
+    def _finish(self, key, body, status_code):
+        if 200 <= status_code < 300:
+            self.store.complete(key, status_code, body, self.ttl_seconds)
+        else:
+            self.store.release(key)
+        return body, status_code, False
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
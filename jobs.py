@@ -0,0 +1,155 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueueFullError(RuntimeError):
+    """
+    Raised when a job is submitted while the worker pool already has its maximum number of pending jobs
+    """
+    pass
+
+
+class JobStore:
+    """
+    Storage backend for job records. Subclass this to keep jobs somewhere other than process memory.
+    """
+
+    def create(self, job):
+        """
+        Store a new job record
+        :param job: The job record, including its job_id
+        """
+        raise NotImplementedError
+
+    def update(self, job_id, **fields):
+        """
+        Update fields of an existing job record
+        :param job_id: The job ID
+        :param fields: The fields to set
+        """
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """
+        Get a job record
+        :param job_id: The job ID
+        :return: A copy of the job record, or None if it does not exist or has expired
+        """
+        raise NotImplementedError
+
+
+class InMemoryJobStore(JobStore):
+    """
+    Job store backed by a dict. Finished jobs are dropped once they are older than the TTL.
+    """
+
+    def __init__(self, ttl_seconds=3600):
+        self.ttl_seconds = ttl_seconds
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._purge_expired()
+            self._jobs[job["job_id"]] = dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge_expired()
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.get("finished_at") is not None and job["finished_at"] < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+class JobManager:
+    """
+    Runs generation requests on a bounded in-process worker pool and records their progress in a job store
+    """
+
+    def __init__(self, store=None, max_workers=4, max_pending=100):
+        self.store = store if store is not None else InMemoryJobStore()
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, job_type, fn, *args):
+        """
+        Queue a job. The callable must return a (payload, status_code) tuple, like the synchronous endpoints.
+        :param job_type: A label for the kind of job
+        :param fn: The callable to run
+        :param args: Arguments for the callable
+        :return: The new job record
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFullError(f"Job queue is full ({self.max_pending} pending jobs)")
+            self._pending += 1
+
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "job_type": job_type,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "status_code": None,
+            "result": None,
+        }
+        self.store.create(job)
+        try:
+            self._executor.submit(self._run, job["job_id"], fn, args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return job
+
+    def get(self, job_id):
+        """
+        Get a job record
+        :param job_id: The job ID
+        :return: The job record, or None if it does not exist
+        """
+        return self.store.get(job_id)
+
+    def stats(self):
+        """
+        Snapshot of the worker pool usage
+        :return: A dict with the number of pending jobs and the pool limits
+        """
+        with self._lock:
+            return {
+                "pending_jobs": self._pending,
+                "max_pending": self.max_pending,
+                "max_workers": self.max_workers,
+            }
+
+    def _run(self, job_id, fn, args):
+        self.store.update(job_id, status="running", started_at=time.time())
+        try:
+            payload, status_code = fn(*args)
+            status = "succeeded" if status_code < 400 else "failed"
+        except Exception as e:
+            print(f"[Jobs] Job {job_id} raised: {str(e)}", flush=True)
+            payload, status_code, status = {"error": str(e)}, 500, "failed"
+        finally:
+            with self._lock:
+                self._pending -= 1
+        self.store.update(job_id, status=status, status_code=status_code, result=payload, finished_at=time.time())
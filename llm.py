@@ -1,62 +1,101 @@
 from flask.cli import load_dotenv
-from langchain_core.prompts import PromptTemplate
-from output_parser import parser
-from langchain_openai import AzureChatOpenAI
+import metrics
+from prompt_compaction import PromptCompactor
+from resilience import Resilience
+from scheduler import QuotaExceededError
+import asyncio
 import json
+import math
 import os
+import re
+import threading
+import time
+
+# Fraction of extra questions requested in chunked mode to make up for duplicates across sections
+QUESTION_OVERGENERATION = 0.2
+
 
 class LLM:
     
-    def __init__(self, azure_deployment, openai_api_version, temperature):
-        
-        api_key = os.getenv("AZURE_OPENAI_API_KEY")
-        azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+    def __init__(self, azure_deployment, openai_api_version, temperature, question_chunk_chars=0,
+                 max_concurrency=4, compactor=None, resilience=None, timeout=60, pool_size=20, scheduler=None):
         
-        self.model = AzureChatOpenAI(
-            api_key=api_key,
-            azure_endpoint=azure_endpoint,
-            openai_api_version=openai_api_version,
-            azure_deployment=azure_deployment,
-            temperature=temperature,
-        )
+        # langchain and the Azure OpenAI client are slow to import, so the model and the prompt registry are built
+        # on the first generation request or by warm_up, whichever comes first
+        self.azure_deployment = azure_deployment
+        self.openai_api_version = openai_api_version
+        self.temperature = temperature
+        self._model = None
+        self._prompts = None
+        self._lock = threading.Lock()
+
+        # Documents longer than this are split into sections for question generation (0 disables chunking)
+        self.question_chunk_chars = question_chunk_chars
+        self.max_concurrency = max_concurrency
+        self.compactor = compactor if compactor is not None else PromptCompactor()
+
+        # Model calls go through the retry policy and circuit breaker, so the client's own retries are turned off
+        self.resilience = resilience if resilience is not None else Resilience("llm", pool_size=pool_size)
+        self.timeout = timeout
+        self.pool_size = pool_size
+
+        # Admission control against the deployment's quotas, None to call the model without queueing
+        self.scheduler = scheduler
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import httpx
+                    from langchain_openai import AzureChatOpenAI
+
+                    limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+                    self._model = AzureChatOpenAI(
+                        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                        openai_api_version=self.openai_api_version,
+                        azure_deployment=self.azure_deployment,
+                        temperature=self.temperature,
+                        timeout=self.timeout,
+                        max_retries=0,
+                        http_client=httpx.Client(limits=limits, timeout=self.timeout),
+                        http_async_client=httpx.AsyncClient(limits=limits, timeout=self.timeout),
+                    )
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        with self._lock:
+            self._model = model
+            self._prompts = None
+
+    @property
+    def prompts(self):
+        """
+        The prompts and chains, built once for the lifetime of the model
+        """
+        if self._prompts is None:
+            model = self.model
+            with self._lock:
+                if self._prompts is None:
+                    from prompts import PromptRegistry
+
+                    self._prompts = PromptRegistry(model, self.resilience, self.scheduler)
+        return self._prompts
+
+    def warm_up(self):
+        """
+        Build the model client and exercise every prompt before they are needed by a request
+        """
+        return self.prompts.warm_up()
 
     def generate_questions_and_answers(self, document_content, num_questions, difficulty):
-        prompt = PromptTemplate(
-            template="You are a helpful learning assistant for students. Your goal is to facilitate their learning by "
-                     "testing their understanding of the content from a lecture note. Based on the provided lecture "
-                     "document, generate {num_questions} questions. Ensure that these questions are of {difficulty} "
-                     "difficulty. A question should include a list of 4 answers, and each answer has an indication "
-                     "whether it is a correct answer and a reason to justify why this answer is correct or incorrect. "
-                     "This is a multi select question and there can be more than one correct answer. "
-                     "The possible answers does not have to be solely from the content of the document. You may also "
-                     "generate other possible answers depending on the difficulty level.\n\n"
-                     "ADDITIONAL REQUIREMENTS:\n"
-                     "1) Avoid definition-only questions (max 20% if difficulty is Easy).\n"
-                     "2) Ensure coverage across different topics/sections of the document; do not cluster on one topic.\n"
-                     "3) Use plausible distractors based on common misconceptions.\n"
-                     "4) For Medium/Hard, prioritize application and scenario-based questions.\n"
-                     "5) Include at least 1 question that requires reasoning across multiple concepts.\n"
-                     "6) Keep wording concise and unambiguous.\n"
-                     "7) Keep answer options parallel in length and style.\n"
-                     "8) Target distribution (approx.):\n"
-                     "- Easy: Remember 30%, Understand 30%, Apply 20%, Analyze 10%, Evaluate 5%, Create 5%\n"
-                     "- Medium: Remember 15%, Understand 25%, Apply 25%, Analyze 20%, Evaluate 10%, Create 5%\n"
-                     "- Hard: Remember 10%, Understand 15%, Apply 25%, Analyze 25%, Evaluate 15%, Create 10%\n\n"
-                     "QUESTION TYPE TAGGING:\n"
-                     "Set question_type to one of: mcq, matching, categorising, latex_mcq.\n"
-                     "Use latex_mcq for calculation-based questions; format math using LaTeX.\n"
-                     "If question_type is matching or categorising, include a structured_data object:\n"
-                     "- matching: {{\"pairs\": [{{\"left\": \"...\", \"right\": \"...\"}}]}}\n"
-                     "- categorising: {{\"categories\": [{{\"name\": \"...\", \"items\": [\"...\"]}}]}}\n"
-                     "For every question, include a short hint in a field named \"hint\".\n"
-                     "Always include the standard 4-answer list for compatibility.\n"
-                     "{format_instructions} \n\n"
-                     "Below is the content of the lecture document:\n\n{document_content}",
-            input_variables=["num_questions", "difficulty", "document_content"],
-            partial_variables={"format_instructions": parser.get_format_instructions()}
-        )
+        if self.question_chunk_chars and len(document_content) > self.question_chunk_chars:
+            return self.generate_questions_and_answers_chunked(document_content, num_questions, difficulty)
 
-        chain = prompt | self.model | parser
+        document_content = self.compactor.compact_document(document_content, "questions")
+        chain = self.prompts.chain("questions")
 
         result = chain.invoke({
             "num_questions": num_questions,
@@ -64,30 +103,527 @@ class LLM:
             "document_content": document_content
         })
 
+        valid, fixable, missing = self.triage_questions(self.result_questions(result), num_questions)
+        if fixable or missing:
+            valid += self.repair_questions(fixable, missing, document_content, difficulty)
+        result = self.finish_questions(valid, num_questions)
+        self.apply_default_hints(result)
+        return result
+
+    async def agenerate_questions_and_answers(self, document_content, num_questions, difficulty):
+        """
+        Async counterpart of generate_questions_and_answers
+        """
+        if self.question_chunk_chars and len(document_content) > self.question_chunk_chars:
+            return await self.agenerate_questions_and_answers_chunked(document_content, num_questions, difficulty)
+
+        document_content = self.compactor.compact_document(document_content, "questions")
+        result = await self.prompts.chain("questions").ainvoke({
+            "num_questions": num_questions,
+            "difficulty": difficulty,
+            "document_content": document_content
+        })
+
+        valid, fixable, missing = self.triage_questions(self.result_questions(result), num_questions)
+        if fixable or missing:
+            valid += await self.arepair_questions(fixable, missing, document_content, difficulty)
+        result = self.finish_questions(valid, num_questions)
+        self.apply_default_hints(result)
+        return result
+
+    def stream_questions_and_answers(self, document_content, num_questions, difficulty):
+        """
+        Generate questions while streaming the model output, yielding each question as soon as it is complete.
+        A question is complete once the model has started on the next one, or the response has ended. Questions that
+        fail validation are held back and repaired, together with any questions missing from the response, once the
+        response has ended.
+        The call is admitted through the LLM scheduler before this returns, so a shed call raises here rather than
+        from the stream.
+        :return: A generator of questions
+        :raise QuotaExceededError: If the LLM scheduler sheds the call
+        """
+        document_content = self.compactor.compact_document(document_content, "questions_stream")
+        inputs = {
+            "num_questions": num_questions,
+            "difficulty": difficulty,
+            "document_content": document_content
+        }
+        config = self.prompts.admit("questions", inputs, "questions")
+        return self.iter_streamed_questions(inputs, config, document_content, num_questions, difficulty)
+
+    def iter_streamed_questions(self, inputs, config, document_content, num_questions, difficulty):
+        chain = self.prompts.chain("questions")
+        emitted = 0
+        yielded = 0
+        questions = []
+        valid = []
+        fixable = []
+
+        def ready(question):
+            # Number questions in the order they are sent, whatever numbers the model or the repair gave them
+            nonlocal yielded
+            yielded += 1
+            question["number"] = yielded
+            self.apply_default_hint(question)
+            return question
+
+        for partial in chain.stream(inputs, config):
+            questions = partial.get("questions", []) if isinstance(partial, dict) else []
+            if not isinstance(questions, list):
+                questions = []
+            while len(questions) > emitted + 1:
+                question = questions[emitted]
+                emitted += 1
+                if self.triage_question(question, valid, fixable):
+                    yield ready(question)
+
+        for question in questions[emitted:]:
+            if self.triage_question(question, valid, fixable):
+                yield ready(question)
+
+        missing = max(0, num_questions - len(valid) - len(fixable))
+        if fixable or missing:
+            self.log_triage(len(valid), len(fixable), missing)
+            for question in self.repair_questions(fixable, missing, document_content, difficulty):
+                yield ready(question)
+
+    def generate_questions_and_answers_chunked(self, document_content, num_questions, difficulty):
+        """
+        Generate questions for a long document by fanning out one request per section and merging the results.
+        Sections are generated concurrently, so latency follows the largest section rather than the whole document.
+        """
+        sections = self.split_sections(document_content)
+
+        # Ask for a few extra questions so that duplicates can be dropped without falling short
+        target = num_questions + math.ceil(num_questions * QUESTION_OVERGENERATION)
+        allocation = self.allocate_questions(sections, target)
+
+        section_questions = self.generate_section_questions(sections, allocation, difficulty)
+        merged = self.merge_section_questions(section_questions, num_questions)
+
+        # Top up once across all sections if removing duplicates left us short
+        shortfall = num_questions - len(merged)
+        if shortfall > 0:
+            print(f"[LLM Questions] Topping up {shortfall} questions after removing duplicates", flush=True)
+            top_up = self.allocate_questions(sections, shortfall)
+            extra_questions = self.generate_section_questions(sections, top_up, difficulty)
+            section_questions = [
+                questions + extra for questions, extra in zip(section_questions, extra_questions)
+            ]
+            merged = self.merge_section_questions(section_questions, num_questions)
+
+        result = self.finish_questions(merged, num_questions)
+        self.apply_default_hints(result)
+        return result
+
+    async def agenerate_questions_and_answers_chunked(self, document_content, num_questions, difficulty):
+        """
+        Async counterpart of generate_questions_and_answers_chunked
+        """
+        sections = self.split_sections(document_content)
+        target = num_questions + math.ceil(num_questions * QUESTION_OVERGENERATION)
+        allocation = self.allocate_questions(sections, target)
+
+        section_questions = await self.agenerate_section_questions(sections, allocation, difficulty)
+        merged = self.merge_section_questions(section_questions, num_questions)
+
+        shortfall = num_questions - len(merged)
+        if shortfall > 0:
+            print(f"[LLM Questions] Topping up {shortfall} questions after removing duplicates", flush=True)
+            top_up = self.allocate_questions(sections, shortfall)
+            extra_questions = await self.agenerate_section_questions(sections, top_up, difficulty)
+            section_questions = [
+                questions + extra for questions, extra in zip(section_questions, extra_questions)
+            ]
+            merged = self.merge_section_questions(section_questions, num_questions)
+
+        result = self.finish_questions(merged, num_questions)
+        self.apply_default_hints(result)
+        return result
+
+    def split_sections(self, document_content):
+        """
+        Split a document into sections for chunked question generation
+        """
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.question_chunk_chars,
+            chunk_overlap=min(200, self.question_chunk_chars // 10)
+        )
+        # Sections are already bounded in size, so only boilerplate is stripped here
+        document_content = self.compactor.compact_document(document_content, "questions_chunked", apply_budget=False)
+        return splitter.split_text(document_content)
+
+    def generate_section_questions(self, sections, allocation, difficulty):
+        """
+        Run the section chain for every section concurrently, tolerating failures in individual sections
+        :return: The list of generated questions for each section, in section order
+        """
+        inputs = self.section_inputs(sections, allocation, difficulty)
+        results = self.prompts.chain("questions_section").batch(
+            inputs, config={"max_concurrency": self.max_concurrency}, return_exceptions=True
+        )
+        return self.collect_section_results(results)
+
+    async def agenerate_section_questions(self, sections, allocation, difficulty):
+        """
+        Async counterpart of generate_section_questions
+        """
+        inputs = self.section_inputs(sections, allocation, difficulty)
+        results = await self.prompts.chain("questions_section").abatch(
+            inputs, config={"max_concurrency": self.max_concurrency}, return_exceptions=True
+        )
+        return self.collect_section_results(results)
+
+    @staticmethod
+    def section_inputs(sections, allocation, difficulty):
+        print(f"[LLM Questions] Generating {sum(allocation)} questions across {len(sections)} sections", flush=True)
+        return [
+            {
+                "num_questions": section_questions,
+                "difficulty": difficulty,
+                "document_content": section,
+                "section_number": index + 1,
+                "section_count": len(sections)
+            }
+            for index, (section, section_questions) in enumerate(zip(sections, allocation))
+        ]
+
+    @staticmethod
+    def collect_section_results(results):
+        """
+        Collect the questions of each section from a batch run, raising only if every section failed
+        """
+        section_questions = []
+        errors = []
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                print(f"[LLM Questions] Section {index + 1} failed: {str(result)}", flush=True)
+                metrics.record_fallback("question_section_failed")
+                errors.append(result)
+                section_questions.append([])
+            else:
+                # Invalid questions are dropped here; the chunked generators top up any shortfall afterwards
+                from output_parser import validate_question
+
+                questions = LLM.result_questions(result)
+                valid = [question for question in questions if not validate_question(question)]
+                if len(valid) < len(questions):
+                    print(f"[LLM Questions] Section {index + 1}: dropped {len(questions) - len(valid)} invalid "
+                          f"questions", flush=True)
+                    metrics.record_fallback("question_invalid")
+                section_questions.append(valid)
+        if errors and len(errors) == len(results):
+            raise errors[0]
+        return section_questions
+
+    @staticmethod
+    def allocate_questions(sections, num_questions):
+        """
+        Split a question count across sections in proportion to their length, giving every section at least one
+        """
+        total_length = sum(len(section) for section in sections) or 1
+        shares = [num_questions * len(section) / total_length for section in sections]
+        allocation = [max(1, math.floor(share)) for share in shares]
+        remaining = num_questions - sum(allocation)
+        by_remainder = sorted(range(len(sections)), key=lambda i: shares[i] - math.floor(shares[i]), reverse=True)
+        for index in by_remainder[:max(0, remaining)]:
+            allocation[index] += 1
+        return allocation
+
+    @staticmethod
+    def merge_section_questions(section_questions, num_questions):
+        """
+        Merge per-section questions, dropping duplicates and picking round-robin across sections for coverage.
+        The selected questions keep document order and are renumbered from 1.
+        """
+        seen = set()
+        candidates = []
+        for questions in section_questions:
+            unique = []
+            for question in questions:
+                if not isinstance(question, dict):
+                    continue
+                key = LLM.question_key(question)
+                if not key or key in seen:
+                    continue
+                seen.add(key)
+                unique.append(question)
+            candidates.append(unique)
+
+        selected = []
+        depth = 0
+        while len(selected) < num_questions and any(depth < len(questions) for questions in candidates):
+            for section_index, questions in enumerate(candidates):
+                if depth < len(questions) and len(selected) < num_questions:
+                    selected.append((section_index, depth, questions[depth]))
+            depth += 1
+
+        selected.sort(key=lambda item: (item[0], item[1]))
+        merged = []
+        for number, (_, _, question) in enumerate(selected, start=1):
+            question["number"] = number
+            merged.append(question)
+        return merged
+
+    @staticmethod
+    def question_key(question):
+        """
+        Normalise a question's text for duplicate detection
+        """
+        return " ".join(re.findall(r"[a-z0-9]+", str(question.get("text", "")).lower()))
+
+    @staticmethod
+    def result_questions(result):
+        questions = result.get("questions") if isinstance(result, dict) else None
+        return questions if isinstance(questions, list) else []
+
+    @staticmethod
+    def triage_question(question, valid, fixable):
+        """
+        Validate a question and add it to the valid questions or, if it is worth repairing, the fixable ones
+        :return: Whether the question is valid
+        """
+        from output_parser import validate_question
+
+        problems = validate_question(question)
+        if not problems:
+            valid.append(question)
+            return True
+        # A question without usable text has nothing to repair and is regenerated instead
+        if isinstance(question, dict) and isinstance(question.get("text"), str) and question["text"].strip():
+            fixable.append((question, problems))
+        return False
+
+    @staticmethod
+    def triage_questions(questions, num_questions):
+        """
+        Sort the questions of a response into valid ones and ones that need repair
+        :return: A (valid, fixable, missing) tuple: the valid questions, (question, problems) pairs to send back to
+                 the model, and the number of questions to generate afresh
+        """
+        valid = []
+        fixable = []
+        for question in questions:
+            LLM.triage_question(question, valid, fixable)
+        missing = max(0, num_questions - len(valid) - len(fixable))
+        if fixable or missing:
+            LLM.log_triage(len(valid), len(fixable), missing)
+        return valid, fixable, missing
+
+    @staticmethod
+    def log_triage(valid, fixable, missing):
+        print(f"[LLM Questions] Kept {valid} valid questions; repairing {fixable} and regenerating {missing}",
+              flush=True)
+        if fixable:
+            metrics.record_fallback("question_repair")
+        if missing:
+            metrics.record_fallback("question_regenerate")
+
+    def repair_questions(self, fixable, missing, document_content, difficulty):
+        """
+        Repair invalid questions with a prompt that contains only those questions and their problems, and generate
+        the missing ones with a request for just that many questions. A failed repair is logged, not raised.
+        :return: The valid questions produced by the repair
+        """
+        repaired = []
+        if fixable:
+            try:
+                fixed = self.prompts.chain("questions_fix").invoke(self.fix_inputs(fixable))
+                repaired += self.accept_repaired(fixed, len(fixable))
+            except Exception as e:
+                print(f"[LLM Questions] Repairing {len(fixable)} questions failed: {str(e)}", flush=True)
+        if missing:
+            try:
+                fresh = self.prompts.chain("questions").invoke(
+                    {"num_questions": missing, "difficulty": difficulty, "document_content": document_content}
+                )
+                repaired += self.accept_repaired(fresh, missing)
+            except Exception as e:
+                print(f"[LLM Questions] Regenerating {missing} questions failed: {str(e)}", flush=True)
+        return repaired
+
+    async def arepair_questions(self, fixable, missing, document_content, difficulty):
+        """
+        Async counterpart of repair_questions. The repair and the regeneration run concurrently.
+        """
+        calls = []
+        if fixable:
+            calls.append((len(fixable), self.prompts.chain("questions_fix").ainvoke(self.fix_inputs(fixable))))
+        if missing:
+            calls.append((missing, self.prompts.chain("questions").ainvoke(
+                {"num_questions": missing, "difficulty": difficulty, "document_content": document_content}
+            )))
+        results = await asyncio.gather(*(call for _, call in calls), return_exceptions=True)
+
+        repaired = []
+        for (limit, _), result in zip(calls, results):
+            if isinstance(result, Exception):
+                print(f"[LLM Questions] Repairing {limit} questions failed: {str(result)}", flush=True)
+            else:
+                repaired += self.accept_repaired(result, limit)
+        return repaired
+
+    @staticmethod
+    def fix_inputs(fixable):
+        return {
+            "problems": "\n".join(f"- Question {index}: {'; '.join(problems)}"
+                                  for index, (_, problems) in enumerate(fixable, start=1)),
+            "questions": json.dumps([{**question, "number": index}
+                                     for index, (question, _) in enumerate(fixable, start=1)], indent=2),
+        }
+
+    @staticmethod
+    def accept_repaired(result, limit):
+        """
+        Keep at most limit valid questions from a repair response
+        """
+        from output_parser import validate_question
+
+        return [question for question in LLM.result_questions(result) if not validate_question(question)][:limit]
+
+    @staticmethod
+    def finish_questions(questions, num_questions):
+        """
+        Drop duplicate questions and renumber the rest from 1
+        :return: The result dict
+        :raises ValueError: If no valid question is left
+        """
+        seen = set()
+        unique = []
+        for question in questions:
+            key = LLM.question_key(question)
+            if key in seen:
+                continue
+            seen.add(key)
+            question["number"] = len(unique) + 1
+            unique.append(question)
+        if not unique:
+            raise ValueError("The model did not return any valid questions")
+        if len(unique) < num_questions:
+            print(f"[LLM Questions] Returning {len(unique)} of {num_questions} questions after repair", flush=True)
+            metrics.record_fallback("questions_short")
+        return {"questions": unique}
+
+    @staticmethod
+    def apply_default_hints(result):
+        """
+        Fill in a default hint for every question that is missing one
+        """
         try:
             questions = result.get("questions", []) if isinstance(result, dict) else []
             for question in questions:
-                hint = question.get("hint")
-                if hint:
-                    continue
-                question_type = question.get("question_type", "mcq")
-                if question_type == "matching":
-                    question["hint"] = "Match each pair based on the core definitions."
-                elif question_type == "categorising":
-                    question["hint"] = "Group each item by the category definitions."
-                elif question_type == "latex_mcq":
-                    question["hint"] = "Set up the calculation carefully and check units."
-                else:
-                    question["hint"] = "Recall the key concept and eliminate distractors."
+                LLM.apply_default_hint(question)
         except Exception:
             pass
 
-        return result
+    @staticmethod
+    def apply_default_hint(question):
+        """
+        Fill in a default hint for a single question based on its type, if it is missing one
+        """
+        hint = question.get("hint")
+        if hint:
+            return
+        metrics.record_fallback("default_hint")
+        question_type = question.get("question_type", "mcq")
+        if question_type == "matching":
+            question["hint"] = "Match each pair based on the core definitions."
+        elif question_type == "categorising":
+            question["hint"] = "Group each item by the category definitions."
+        elif question_type == "latex_mcq":
+            question["hint"] = "Set up the calculation carefully and check units."
+        else:
+            question["hint"] = "Recall the key concept and eliminate distractors."
 
     def generate_personalised_feedback(self, attempt_data):
         """
         Generate personalised, educational feedback for student's quest attempt
         """
+        feedback, _, _ = self.run_personalised_feedback(attempt_data)
+        return feedback
+
+    async def agenerate_personalised_feedback(self, attempt_data):
+        """
+        Async counterpart of generate_personalised_feedback
+        """
+        feedback, _, _ = await self.arun_personalised_feedback(attempt_data)
+        return feedback
+
+    def generate_personalised_feedback_batch(self, attempts, max_concurrency=None):
+        """
+        Generate feedback for many quest attempts concurrently. A failing attempt does not affect the others.
+        :param attempts: The list of attempt data
+        :param max_concurrency: The maximum number of attempts in flight, defaults to the LLM concurrency limit
+        :return: One dict per attempt, in order, with the feedback, its status, an error if any, and the latency
+        """
+        from langchain_core.runnables import RunnableLambda
+
+        runner = RunnableLambda(self.timed_personalised_feedback)
+        results = runner.batch(
+            attempts,
+            config={"max_concurrency": max_concurrency or self.max_concurrency},
+            return_exceptions=True
+        )
+        return [
+            result if not isinstance(result, Exception)
+            else {"status": "error", "error": str(result), "feedback": None, "latency_ms": None}
+            for result in results
+        ]
+
+    def timed_personalised_feedback(self, attempt_data):
+        start = time.perf_counter()
+        try:
+            feedback, status, error = self.run_personalised_feedback(attempt_data)
+        except Exception as e:
+            feedback, status, error = None, "error", str(e)
+        return {
+            "status": status,
+            "error": error,
+            "feedback": feedback,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1)
+        }
+
+    def run_personalised_feedback(self, attempt_data):
+        """
+        Generate feedback for a quest attempt and report how it was produced
+        :return: A (feedback, status, error) tuple. The status is "ok", "fallback" when the model returned
+                 invalid JSON, or "error" when the call failed and the minimal feedback was used.
+        """
+        inputs, accuracy = self.feedback_inputs(attempt_data)
+        try:
+            result = self.prompts.chain("feedback").invoke(inputs)
+            with metrics.stage("parse"):
+                feedback = self.parse_feedback(result)
+            return feedback, "ok", None
+        except QuotaExceededError:
+            # Shed calls are reported to the client, which should retry later, rather than given fallback feedback
+            raise
+        except Exception as e:
+            return self.feedback_on_error(e, accuracy)
+
+    async def arun_personalised_feedback(self, attempt_data):
+        """
+        Async counterpart of run_personalised_feedback
+        """
+        inputs, accuracy = self.feedback_inputs(attempt_data)
+        try:
+            result = await self.prompts.chain("feedback").ainvoke(inputs)
+            with metrics.stage("parse"):
+                feedback = self.parse_feedback(result)
+            return feedback, "ok", None
+        except QuotaExceededError:
+            # Shed calls are reported to the client, which should retry later, rather than given fallback feedback
+            raise
+        except Exception as e:
+            return self.feedback_on_error(e, accuracy)
+
+    def feedback_inputs(self, attempt_data):
+        """
+        Calculate the attempt statistics and build the feedback prompt inputs
+        :return: A (prompt inputs, accuracy) tuple
+        """
         # Calculate basic statistics
         answers_list = attempt_data.get('answers', [])
         questions_map = {}
@@ -115,86 +651,46 @@ class LLM:
         )
         accuracy = (correct_count / total_count * 100) if total_count > 0 else 0
 
-        prompt = PromptTemplate(
-            template="You are an educational tutor. Analyze this student's quiz attempt and provide detailed, "
-             "constructive, and encouraging feedback.\n\n"
-             "STUDENT PERFORMANCE SUMMARY:\n"
-             "- Total Questions: {total_questions}\n"
-             "- Correct Answers: {correct_answers}\n"
-             "- Accuracy: {accuracy}%\n\n"
-             "DETAILED ANSWERS:\n{attempt_data}\n\n"
-             "INSTRUCTIONS:\n"
-             "Provide feedback in the following JSON format (return ONLY valid JSON, no markdown, no extra text):\n"
-             "{{\n"
-             '  "quest_summary": {{\n'
-             '    "overall_bloom_rating": 1,\n'
-             '    "overall_bloom_level": "Remember",\n'
-             '    "summary": "2-3 sentence summary of performance across the quest."\n'
-             "  }},\n"
-             '  "subtopic_feedback": [\n'
-             "    {{\n"
-             '      "subtopic": "Subtopic name",\n'
-             '      "bloom_rating": 2,\n'
-             '      "bloom_level": "Understand",\n'
-             '      "evidence": "Short evidence grounded in the student answers.",\n'
-             '      "improvement_focus": "One sentence on what to improve in this subtopic."\n'
-             "    }}\n"
-             "  ],\n"
-             '  "study_tips": [\n'
-             '    "Practical study tip 1",\n'
-             '    "Practical study tip 2"\n'
-             "  ]\n"
-             "}}\n\n"
-             "BLOOM SCALE (STRICT 1-6)\n"
-             "1 = Remember\n"
-             "2 = Understand\n"
-             "3 = Apply\n"
-             "4 = Analyse\n"
-             "5 = Evaluate\n"
-             "6 = Create\n\n"
-             "IMPORTANT GUIDELINES:\n"
-             "1. Use ONLY the bloom levels listed and map them strictly to the 1-6 ratings\n"
-             "2. Infer subtopics by grouping related questions; use concise subtopic names\n"
-             "3. Provide 3-8 subtopic entries depending on coverage\n"
-             "4. The quest summary should be 2-3 sentences and match the overall bloom rating\n"
-             "5. Provide 3-6 study tips as a list, focused on the weakest subtopics\n"
-             "6. Use an encouraging, supportive tone - emphasize growth mindset\n"
-             "7. Return ONLY the JSON object, no additional text before or after",
-            input_variables=["total_questions", "correct_answers", "accuracy", "attempt_data"]
-        )
+        return {
+            "total_questions": total_count,
+            "correct_answers": correct_count,
+            "accuracy": f"{accuracy:.1f}",
+            "attempt_data": self.compactor.compact_answers(answers_list, "feedback")
+        }, accuracy
 
-        chain = prompt | self.model
+    @staticmethod
+    def parse_feedback(result):
+        """
+        Parse and validate the feedback JSON from a model response
+        """
+        # Parse the response content as JSON
+        content = result.content.strip()
+        print("[LLM Raw]", content)
+        # Remove markdown code blocks if present
+        if content.startswith('```json'):
+            content = content.replace('```json', '').replace('```', '').strip()
+        elif content.startswith('```'):
+            content = content.replace('```', '').strip()
 
-        try:
-            result = chain.invoke({
-                "total_questions": total_count,
-                "correct_answers": correct_count,
-                "accuracy": f"{accuracy:.1f}",
-                "attempt_data": json.dumps(answers_list, indent=2)
-            })
-
-            # Parse the response content as JSON
-            content = result.content.strip()
-            print("[LLM Raw]", content)
-            # Remove markdown code blocks if present
-            if content.startswith('```json'):
-                content = content.replace('```json', '').replace('```', '').strip()
-            elif content.startswith('```'):
-                content = content.replace('```', '').strip()
-            
-            
-            feedback_json = json.loads(content)
-            
-            # Validate required keys
-            required_keys = ['quest_summary', 'subtopic_feedback', 'study_tips']
-            if not all(key in feedback_json for key in required_keys):
-                raise ValueError("Missing required feedback fields")
-
-            print(f"[LLM Feedback] Generated successfully")
-            return feedback_json
-
-        except json.JSONDecodeError as e:
+        feedback_json = json.loads(content)
+
+        # Validate required keys
+        required_keys = ['quest_summary', 'subtopic_feedback', 'study_tips']
+        if not all(key in feedback_json for key in required_keys):
+            raise ValueError("Missing required feedback fields")
+
+        print(f"[LLM Feedback] Generated successfully")
+        return feedback_json
+
+    @staticmethod
+    def feedback_on_error(e, accuracy):
+        """
+        Build fallback feedback after a failed generation
+        :return: A (feedback, status, error) tuple
+        """
+        if isinstance(e, json.JSONDecodeError):
             print(f"[LLM Feedback Error] JSON parsing failed: {str(e)}")
+            metrics.record_fallback("feedback_invalid_json")
 
             # Return fallback structure
             return {
@@ -210,77 +706,79 @@ class LLM:
                     "Redo similar practice questions to reinforce understanding.",
                     "Explain key concepts in your own words to check understanding."
                 ]
-            }
+            }, "fallback", str(e)
 
-        except Exception as e:
-            print(f"[LLM Feedback Error] Unexpected error: {str(e)}")
+        print(f"[LLM Feedback Error] Unexpected error: {str(e)}")
+        metrics.record_fallback("feedback_error")
 
-            # Return minimal fallback structure
-            return {
-                "quest_summary": {
-                    "overall_bloom_rating": 1,
-                    "overall_bloom_level": "Remember",
-                    "summary": "Completed the quest. Review the materials and keep practicing."
-                },
-                "subtopic_feedback": [],
-                "study_tips": ["Keep practicing to improve your understanding."]
-            }
+        # Return minimal fallback structure
+        return {
+            "quest_summary": {
+                "overall_bloom_rating": 1,
+                "overall_bloom_level": "Remember",
+                "summary": "Completed the quest. Review the materials and keep practicing."
+            },
+            "subtopic_feedback": [],
+            "study_tips": ["Keep practicing to improve your understanding."]
+        }, "error", str(e)
 
     def generate_bonus_game(self, document_content, game_type):
-        if game_type == "matching":
-            prompt = PromptTemplate(
-                template="You are a learning assistant. Create a matching pairs mini-game based on the document.\n"
-                         "Return ONLY valid JSON, no markdown.\n\n"
-                         "FORMAT:\n"
-                         "{{\n"
-                         '  "game_type": "matching",\n'
-                         '  "prompt": "...",\n'
-                         '  "pairs": [\n'
-                         '    {{"left": "...", "right": "..."}},\n'
-                         '    {{"left": "...", "right": "..."}},\n'
-                         '    {{"left": "...", "right": "..."}},\n'
-                         '    {{"left": "...", "right": "..."}}\n'
-                         '  ],\n'
-                         '  "hint": "..."\n'
-                         "}}\n\n"
-                         "RULES:\n"
-                         "- Generate 4 pairs.\n"
-                         "- Keep text concise (<= 8 words each).\n"
-                         "- Pairs must be clearly matched from the document.\n"
-                         "- Avoid obscure or minor details.\n\n"
-                         "DOCUMENT:\n{document_content}",
-                input_variables=["document_content"]
-            )
-        else:
-            prompt = PromptTemplate(
-                template="You are a learning assistant. Create an ordering sequence mini-game based on the document.\n"
-                         "Return ONLY valid JSON, no markdown.\n\n"
-                         "FORMAT:\n"
-                         "{{\n"
-                         '  "game_type": "ordering",\n'
-                         '  "prompt": "...",\n'
-                         '  "items": ["...", "...", "...", "..."],\n'
-                         '  "answer_order": [0, 1, 2, 3],\n'
-                         '  "hint": "..."\n'
-                         "}}\n\n"
-                         "RULES:\n"
-                         "- Generate 4 items in correct order in the items list.\n"
-                         "- answer_order must be the correct index order (0..3).\n"
-                         "- Use a process or sequence from the document.\n"
-                         "- Keep items concise (<= 8 words each).\n\n"
-                         "DOCUMENT:\n{document_content}",
-                input_variables=["document_content"]
-            )
-
-        chain = prompt | self.model
+        chain = self.bonus_game_chain(game_type)
         result = chain.invoke({
-            "document_content": document_content
+            "document_content": self.compactor.compact_document(document_content, "bonus_game")
         })
+        with metrics.stage("parse"):
+            game, problems = self.parse_bonus_game(result, game_type)
+        if problems:
+            result = self.prompts.chain("bonus_fix").invoke(self.bonus_fix_inputs(result, game_type, problems))
+            with metrics.stage("parse"):
+                game, problems = self.parse_bonus_game(result, game_type)
+            self.check_repaired_bonus_game(game_type, problems)
+        return game
 
-        content = result.content.strip()
-        if content.startswith('```json'):
-            content = content.replace('```json', '').replace('```', '').strip()
-        elif content.startswith('```'):
-            content = content.replace('```', '').strip()
+    async def agenerate_bonus_game(self, document_content, game_type):
+        """
+        Async counterpart of generate_bonus_game
+        """
+        chain = self.bonus_game_chain(game_type)
+        result = await chain.ainvoke({
+            "document_content": self.compactor.compact_document(document_content, "bonus_game")
+        })
+        with metrics.stage("parse"):
+            game, problems = self.parse_bonus_game(result, game_type)
+        if problems:
+            result = await self.prompts.chain("bonus_fix").ainvoke(self.bonus_fix_inputs(result, game_type, problems))
+            with metrics.stage("parse"):
+                game, problems = self.parse_bonus_game(result, game_type)
+            self.check_repaired_bonus_game(game_type, problems)
+        return game
+
+    def bonus_game_chain(self, game_type):
+        if game_type == "matching":
+            return self.prompts.chain("bonus_matching")
+        return self.prompts.chain("bonus_ordering")
+
+    @staticmethod
+    def parse_bonus_game(result, game_type):
+        """
+        Parse a bonus game from a model response, tolerating malformed JSON
+        :return: A (game, problems) tuple, where problems lists what is wrong with the game, if anything
+        """
+        from output_parser import bonus_game_problems, salvage_json
+
+        game = salvage_json(result.content)
+        if isinstance(game, dict):
+            game.setdefault("game_type", game_type)
+        return game, bonus_game_problems(game, game_type)
+
+    @staticmethod
+    def bonus_fix_inputs(result, game_type, problems):
+        print(f"[Bonus Game] Repairing {game_type} game: {'; '.join(problems)}", flush=True)
+        metrics.record_fallback("bonus_game_repair")
+        return {"game_type": game_type, "game": result.content.strip(),
+                "problems": "\n".join(f"- {problem}" for problem in problems)}
 
-        return json.loads(content)
+    @staticmethod
+    def check_repaired_bonus_game(game_type, problems):
+        if problems:
+            raise ValueError(f"The model returned an invalid {game_type} game: {'; '.join(problems)}")
@@ -0,0 +1,370 @@
+import contextvars
+import json
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as TallyCounter
+from contextlib import contextmanager
+
+# Latency buckets in seconds, wide enough for multi-minute LLM calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024,
+                64 * 1024 * 1024)
+PAGE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """
+    A monotonically increasing count per label combination
+    """
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    """
+    Cumulative bucket counts, sum and count of observations per label combination
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._values.items()}
+        for labels, (counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket{format_labels(self.labelnames, labels, [('le', bound)])} {bucket_count}"
+            yield f"{self.name}_bucket{format_labels(self.labelnames, labels, [('le', '+Inf')])} {count}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{format_labels(self.labelnames, labels)} {count}"
+
+
+class MetricsRegistry:
+    """
+    Holds every metric and renders them in the Prometheus text exposition format
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+REQUEST_DURATION = REGISTRY.histogram(
+    "eduquest_request_duration_seconds", "End-to-end request latency.", ["endpoint", "status"]
+)
+STAGE_DURATION = REGISTRY.histogram(
+    "eduquest_stage_duration_seconds", "Time spent in each stage of a request.", ["endpoint", "stage"]
+)
+DOCUMENT_BYTES = REGISTRY.histogram(
+    "eduquest_document_size_bytes", "Size of downloaded documents.", ["extension"], SIZE_BUCKETS
+)
+DOCUMENT_PAGES = REGISTRY.histogram(
+    "eduquest_document_pages", "Page count of downloaded PDF documents.", ["extension"], PAGE_BUCKETS
+)
+LLM_TOKENS = REGISTRY.counter(
+    "eduquest_llm_tokens_total", "Tokens reported by the model, by prompt or completion.", ["endpoint", "kind"]
+)
+FALLBACKS = REGISTRY.counter(
+    "eduquest_fallbacks_total", "Requests or sub-requests that took a fallback path.", ["endpoint", "kind"]
+)
+
+_current_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+class RequestTrace:
+    """
+    Per-request record of stage timings and attributes such as document size and token usage.
+    Stages that run more than once, such as one LLM call per section, are summed.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.thread_id = threading.get_ident()
+        self.stages = {}
+        self.attributes = {}
+        self.status = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def set(self, name, value):
+        with self._lock:
+            self.attributes[name] = value
+
+    def add(self, name, amount):
+        with self._lock:
+            self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def summary(self, duration):
+        with self._lock:
+            return {
+                "endpoint": self.endpoint,
+                "status": self.status,
+                "duration_ms": round(duration * 1000, 1),
+                "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()},
+                **self.attributes,
+            }
+
+
+def current_endpoint():
+    trace = _current_trace.get()
+    return trace.endpoint if trace is not None else "background"
+
+
+def start_trace(endpoint, profile=True):
+    """
+    Start tracing a request in the current context
+    :param endpoint: The endpoint name used as a metric label
+    :param profile: Whether the sampling profiler may sample this request's thread
+    :return: A token for finish_trace
+    """
+    trace = RequestTrace(endpoint)
+    if profile and profiler is not None:
+        profiler.register(trace)
+    return _current_trace.set(trace)
+
+
+def finish_trace(token, status=None):
+    """
+    Stop tracing the current request, record its latency and log its trace
+    :param token: The token returned by start_trace
+    :param status: The response status code
+    """
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    if trace is None:
+        return
+    duration = time.perf_counter() - trace.started
+    if status is not None:
+        trace.status = status
+    REQUEST_DURATION.observe(duration, trace.endpoint, str(trace.status))
+    print(f"[Request Trace] {json.dumps(trace.summary(duration))}", flush=True)
+    if profiler is not None:
+        profiler.unregister(trace, duration)
+
+
+@contextmanager
+def trace_request(endpoint):
+    """
+    Trace a unit of work outside a web request, such as a queued job
+    :param endpoint: The endpoint name used as a metric label
+    """
+    token = start_trace(endpoint)
+    try:
+        yield _current_trace.get()
+    finally:
+        finish_trace(token)
+
+
+def set_status(status):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.status = status
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a stage of the current request
+    :param name: The stage name, such as blob_download or llm_call
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def record_stage(name, seconds):
+    trace = _current_trace.get()
+    STAGE_DURATION.observe(seconds, trace.endpoint if trace is not None else "background", name)
+    if trace is not None:
+        trace.add_stage(name, seconds)
+
+
+def observe_document(extension, size_bytes=None, pages=None):
+    """
+    Record the size and page count of a downloaded document
+    """
+    trace = _current_trace.get()
+    if size_bytes is not None:
+        DOCUMENT_BYTES.observe(size_bytes, extension)
+        if trace is not None:
+            trace.set("document_bytes", size_bytes)
+    if pages is not None:
+        DOCUMENT_PAGES.observe(pages, extension)
+        if trace is not None:
+            trace.set("document_pages", pages)
+
+
+def annotate(name, value):
+    """
+    Attach an attribute, such as whether the document cache was hit, to the current request's trace
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.set(name, value)
+
+
+def record_token_usage(message):
+    """
+    Record the token usage reported on a model response, if any
+    :param message: The AI message or message chunk returned by the model
+    """
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    endpoint = current_endpoint()
+    trace = _current_trace.get()
+    for kind, key in (("prompt", "input_tokens"), ("completion", "output_tokens")):
+        tokens = usage.get(key) or 0
+        LLM_TOKENS.inc(endpoint, kind, amount=tokens)
+        if trace is not None:
+            trace.add(f"{kind}_tokens", tokens)
+
+
+def record_fallback(kind):
+    """
+    Count a fallback path, such as feedback built from a template after the model returned invalid JSON
+    :param kind: The fallback name
+    """
+    FALLBACKS.inc(current_endpoint(), kind)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(f"fallback_{kind}", 1)
+
+
+def render():
+    return REGISTRY.render()
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of in-flight request threads at a fixed interval and logs the most frequent stacks of
+    requests slower than the threshold. Only thread-per-request serving is profiled: coroutines in the async
+    mode share one thread and would be attributed to each other.
+    """
+
+    def __init__(self, threshold_seconds, interval_seconds=0.01, max_depth=12, top=5, hook=None):
+        self.threshold_seconds = threshold_seconds
+        self.interval_seconds = interval_seconds
+        self.max_depth = max_depth
+        self.top = top
+        # Called with the trace summary and the sampled stacks of each slow request; defaults to logging them
+        self.hook = hook if hook is not None else self.log_profile
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, trace):
+        with self._lock:
+            self._samples[trace] = TallyCounter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+
+    def unregister(self, trace, duration):
+        with self._lock:
+            samples = self._samples.pop(trace, None)
+        if samples is not None and duration >= self.threshold_seconds:
+            self.hook(trace.summary(duration), samples.most_common(self.top))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            frames = sys._current_frames()
+            with self._lock:
+                for trace, samples in self._samples.items():
+                    frame = frames.get(trace.thread_id)
+                    if frame is not None:
+                        stack = traceback.extract_stack(frame, limit=self.max_depth)
+                        samples[tuple(f"{entry.name} ({entry.filename.split('/')[-1]}:{entry.lineno})"
+                                      for entry in stack)] += 1
+
+    def log_profile(self, summary, stacks):
+        total = sum(count for _, count in stacks) or 1
+        lines = [f"[Slow Request] {json.dumps(summary)}"]
+        for stack, count in stacks:
+            lines.append(f"  {count} samples (~{count * self.interval_seconds * 1000:.0f} ms, "
+                         f"{count / total:.0%} of the top stacks):")
+            lines.extend(f"    {frame}" for frame in stack)
+        print("\n".join(lines), flush=True)
+
+
+# Set by configure_profiler when slow request profiling is enabled
+profiler = None
+
+
+def configure_profiler(threshold_seconds, interval_seconds=0.01, hook=None):
+    """
+    Enable the sampling profiler for requests slower than the threshold
+    :param threshold_seconds: The latency above which a request's samples are reported, 0 disables profiling
+    :param interval_seconds: The sampling interval
+    :param hook: A callable taking the trace summary and the most common stacks, defaults to logging them
+    """
+    global profiler
+    profiler = SamplingProfiler(threshold_seconds, interval_seconds, hook=hook) if threshold_seconds else None
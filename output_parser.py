@@ -1,6 +1,11 @@
-from langchain_core.pydantic_v1 import BaseModel, Field, validator
+import json
+import re
+from langchain_core.pydantic_v1 import BaseModel, Field, ValidationError, validator
 from typing import List, Dict, Any, Optional
 from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.utils.json import parse_json_markdown, parse_partial_json
+
+ANSWERS_PER_QUESTION = 4
 
 
 class Answer(BaseModel):
@@ -54,4 +59,125 @@ class QuestionList(BaseModel):
         return v
 
 
-parser = JsonOutputParser(pydantic_object=QuestionList)
+def salvage_json(text):
+    """
+    Parse JSON from a model response, tolerating markdown fences, trailing commas, text around the JSON object and
+    output cut off part way through
+    :param text: The response text
+    :return: The parsed value, or None if nothing could be recovered
+    """
+    text = (text or "").strip()
+    try:
+        return parse_json_markdown(text)
+    except ValueError:
+        pass
+
+    start = text.find("{")
+    if start == -1:
+        return None
+    candidate = re.sub(r",\s*([}\]])", r"\1", text[start:])
+    try:
+        return json.JSONDecoder().raw_decode(candidate)[0]
+    except ValueError:
+        pass
+    try:
+        # Closes unterminated strings, lists and objects, e.g. when the response hit the token limit
+        return parse_partial_json(candidate)
+    except ValueError:
+        return None
+
+
+def validate_question(question):
+    """
+    Check a generated question against the Question and Answer models and the quiz rules: exactly four answers,
+    at least one of them correct. Answers that fail validation are dropped before the rules are checked.
+    :param question: A question from the parsed model output
+    :return: A list of problems, empty if the question is valid
+    """
+    if not isinstance(question, dict):
+        return ["is not a JSON object"]
+
+    problems = []
+    answers = question.get("answers")
+    valid_answers = []
+    if isinstance(answers, list):
+        for index, answer in enumerate(answers, start=1):
+            try:
+                Answer.parse_obj(answer)
+                valid_answers.append(answer)
+            except (ValidationError, TypeError) as e:
+                problems.append(f"answer {index} is invalid ({error_summary(e)})")
+    try:
+        # The number is reassigned when the questions are merged, so only the rest of the question is checked
+        Question.parse_obj({**question, "number": 1, "answers": valid_answers})
+    except ValidationError as e:
+        problems.append(f"invalid question ({error_summary(e)})")
+    if len(valid_answers) != ANSWERS_PER_QUESTION:
+        problems.append(f"has {len(valid_answers)} valid answers instead of exactly {ANSWERS_PER_QUESTION}")
+    if not any(answer.get("is_correct") is True for answer in valid_answers):
+        problems.append("has no correct answer")
+    return problems
+
+
+def error_summary(e):
+    if isinstance(e, ValidationError):
+        return "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors())
+    return str(e)
+
+
+def bonus_game_problems(game, game_type):
+    """
+    Check a generated bonus game against the format its prompt asks for
+    :param game: The parsed model output
+    :param game_type: The requested game type, matching or ordering
+    :return: A list of problems, empty if the game is valid
+    """
+    if not isinstance(game, dict):
+        return ["the response is not a JSON object"]
+
+    problems = []
+    if not isinstance(game.get("prompt"), str) or not game.get("prompt"):
+        problems.append("prompt must be a non-empty string")
+    if game.get("hint") is not None and not isinstance(game.get("hint"), str):
+        problems.append("hint must be a string")
+    if game_type == "matching":
+        pairs = game.get("pairs")
+        if not isinstance(pairs, list) or len(pairs) < 2:
+            problems.append("pairs must be a list of at least 2 pairs")
+        else:
+            for index, pair in enumerate(pairs, start=1):
+                if not isinstance(pair, dict) or not all(
+                        isinstance(pair.get(side), str) and pair.get(side) for side in ("left", "right")):
+                    problems.append(f"pair {index} must have non-empty left and right strings")
+    else:
+        items = game.get("items")
+        if not isinstance(items, list) or len(items) < 2 or not all(isinstance(item, str) and item for item in items):
+            problems.append("items must be a list of at least 2 non-empty strings")
+        else:
+            answer_order = game.get("answer_order")
+            # bool is an int subclass, so reject it explicitly rather than reading true and false as 1 and 0
+            if not isinstance(answer_order, list) or not all(
+                    isinstance(index, int) and not isinstance(index, bool) for index in answer_order):
+                problems.append("answer_order must be a list of integer indices")
+            elif sorted(answer_order) != list(range(len(items))):
+                problems.append(f"answer_order must list every index from 0 to {len(items) - 1} exactly once")
+    return problems
+
+
+class TolerantJsonOutputParser(JsonOutputParser):
+    """
+    A JSON output parser that salvages what it can from malformed output instead of raising, so that the valid
+    questions in a response can be kept and only the rest regenerated
+    """
+
+    def parse_result(self, result, *, partial=False):
+        if partial:
+            return super().parse_result(result, partial=True)
+        parsed = salvage_json(result[0].text)
+        if parsed is None:
+            print(f"[Output Parser] No JSON could be recovered from {len(result[0].text)} characters", flush=True)
+            return {}
+        return parsed
+
+
+parser = TolerantJsonOutputParser(pydantic_object=QuestionList)
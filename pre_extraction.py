@@ -0,0 +1,86 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from io import BytesIO
+import extractors
+from azure_blob import SIDECAR_SUFFIXES, DocumentTooLargeError
+from section_index import SectionIndex
+
+
+def pre_extract(azure_blob, prefix="documents/", workers=4, force=False):
+    """
+    Extract the text and build the section index of every document under a prefix, and store both as gzipped
+    sidecar blobs next to the document, so requests can read them instead of downloading and parsing the document.
+    Documents whose sidecars were extracted from their current ETag are skipped unless force is set. Downloads and
+    uploads run on threads, and extraction runs in worker processes since it is CPU-bound.
+    :param azure_blob: The AzureBlob instance
+    :param prefix: The blob name prefix to pre-extract
+    :param workers: The number of extraction processes, and of download threads
+    :param force: Whether to re-extract documents whose sidecar is up to date
+    :return: A dict of counts: extracted, skipped, unsupported, too_large and failed
+    """
+    start = time.perf_counter()
+    documents, sidecars = azure_blob.list_documents(prefix)
+    summary = {"extracted": 0, "skipped": 0, "unsupported": 0, "too_large": 0, "failed": 0}
+
+    pending = []
+    for blob in documents:
+        if extractors.get_section_extractor(azure_blob.get_document_extension(blob.name)) is None:
+            summary["unsupported"] += 1
+        elif not force and all(sidecars.get(blob.name + suffix) == blob.etag for suffix in SIDECAR_SUFFIXES.values()):
+            summary["skipped"] += 1
+        else:
+            pending.append(blob.name)
+    print(f"[Pre-extract] {len(documents)} documents under {prefix}: {len(pending)} to extract, "
+          f"{summary['skipped']} up to date, {summary['unsupported']} unsupported", flush=True)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as processes, \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pre-extract") as threads:
+            futures = {threads.submit(pre_extract_document, azure_blob, processes, document_id): document_id
+                       for document_id in pending}
+            for future in as_completed(futures):
+                document_id = futures[future]
+                try:
+                    compressed_size = future.result()
+                    summary["extracted"] += 1
+                    print(f"[Pre-extract] {document_id}: sidecars written, {compressed_size} bytes", flush=True)
+                except DocumentTooLargeError as e:
+                    summary["too_large"] += 1
+                    print(f"[Pre-extract] {document_id}: {str(e)}", flush=True)
+                except Exception as e:
+                    summary["failed"] += 1
+                    print(f"[Pre-extract] {document_id}: extraction failed: {str(e)}", flush=True)
+
+    print(f"[Pre-extract] Done in {time.perf_counter() - start:.1f}s: {summary}", flush=True)
+    return summary
+
+
+def extract_document(extension, document_bytes):
+    """
+    Extract the text and build the section index of a document. Runs inside a worker process.
+    :param extension: The file extension, without the dot
+    :param document_bytes: The document in bytes
+    :return: A (document text, serialised section index) tuple
+    """
+    index = SectionIndex(extractors.get_section_extractor(extension)(BytesIO(document_bytes)))
+    return index.text(), index.to_json()
+
+
+def pre_extract_document(azure_blob, processes, document_id):
+    """
+    Download one document, extract it in a worker process and upload its sidecars
+    :param azure_blob: The AzureBlob instance
+    :param processes: The process pool for extraction
+    :param document_id: The document ID
+    :return: The compressed size of the sidecars in bytes
+    """
+    blob_client = azure_blob.blob_service_client.get_blob_client(container=azure_blob.container_name,
+                                                                 blob=document_id)
+    download_stream, document_content = azure_blob.resilience.call(azure_blob.download, document_id, blob_client,
+                                                                   spool=False)
+    extension = azure_blob.get_document_extension(document_id)
+    document_text, section_index = processes.submit(extract_document, extension, document_content).result()
+    # Tag the sidecars with the version actually downloaded in case the blob changed after it was listed
+    source_etag = download_stream.properties.etag
+    return (azure_blob.write_sidecar(document_id, document_text, source_etag)
+            + azure_blob.write_sidecar(document_id, section_index, source_etag, "section_index"))
@@ -0,0 +1,175 @@
+import json
+import math
+from collections import Counter
+import metrics
+
+# Rough characters per token for English text with OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+# Per-answer flags that always stay on the answer, even when every answer of a question shares the value
+ANSWER_FIELDS = {"is_correct", "answer_is_correct", "is_selected"}
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens in a piece of text
+    :param text: The text
+    :return: The estimated token count
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def compact_json(value):
+    """
+    Serialise a value to JSON without indentation or padding whitespace
+    :param value: A JSON serialisable value
+    :return: The compact JSON string
+    """
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def group_answers_by_question(answers_list):
+    """
+    Group a flat list of answer records by question_id. Fields that hold the same value for every answer of a
+    question, such as the question text, are stored once on the question instead of on every answer.
+    :param answers_list: The list of answer records from a quest attempt
+    :return: A list of questions, each with its shared fields and a list of per-answer fields
+    """
+    groups = {}
+    for answer in answers_list:
+        if not isinstance(answer, dict):
+            continue
+        groups.setdefault(answer.get("question_id"), []).append(answer)
+
+    questions = []
+    for question_id, answers in groups.items():
+        shared_keys = {key for key in answers[0] if key not in ANSWER_FIELDS and not key.startswith("answer")}
+        for answer in answers[1:]:
+            shared_keys &= {key for key in answer if key in answers[0] and answer[key] == answers[0][key]}
+        if len(answers) == 1:
+            # A lone answer keeps its fields on the answer so the structure stays uniform
+            shared_keys = {"question_id"} & shared_keys
+
+        question = {key: answers[0][key] for key in answers[0] if key in shared_keys}
+        question["question_id"] = question_id
+        question["answers"] = [
+            {key: value for key, value in answer.items() if key not in shared_keys and key != "question_id"}
+            for answer in answers
+        ]
+        questions.append(question)
+    return questions
+
+
+def strip_repeated_lines(text, min_repeats=3, min_length=8):
+    """
+    Remove boilerplate lines, such as slide headers and footers, that repeat across pages.
+    The first occurrence of each repeated line is kept so that headings are not lost entirely, and short lines
+    such as closing braces in code samples are never treated as boilerplate.
+    :param text: The document text
+    :param min_repeats: How many times a line must appear to count as boilerplate
+    :param min_length: The shortest line that can count as boilerplate
+    :return: The text without the repeated lines
+    """
+    lines = text.split("\n")
+    counts = Counter(line.strip() for line in lines if len(line.strip()) >= min_length)
+    repeated = {
+        line for line, count in counts.items()
+        if count >= min_repeats and any(character.isalpha() for character in line)
+    }
+    if not repeated:
+        return text
+
+    seen = set()
+    kept = []
+    for line in lines:
+        stripped = line.strip()
+        if stripped in repeated:
+            if stripped in seen:
+                continue
+            seen.add(stripped)
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def truncate_to_budget(text, max_tokens, segments=8):
+    """
+    Shrink text to a token budget while keeping coverage of the whole document. The text is divided into
+    contiguous segments of lines and each segment keeps its opening lines, where slide and section titles sit,
+    up to an equal share of the budget.
+    :param text: The document text
+    :param max_tokens: The token budget
+    :param segments: How many segments to split the document into
+    :return: The truncated text, or the original text if it already fits
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    lines = [line for line in text.split("\n") if line.strip()]
+    segments = max(1, min(segments, len(lines)))
+    segment_size = math.ceil(len(lines) / segments)
+    separator = "\n[...]\n"
+    share = max(1, (max_tokens - estimate_tokens(separator) * (segments - 1)) // segments)
+
+    kept_segments = []
+    for start in range(0, len(lines), segment_size):
+        remaining = share
+        kept = []
+        for line in lines[start:start + segment_size]:
+            line_tokens = estimate_tokens(line)
+            if line_tokens > remaining:
+                if remaining > 0:
+                    kept.append(line[:remaining * CHARS_PER_TOKEN])
+                break
+            kept.append(line)
+            remaining -= line_tokens
+        kept_segments.append("\n".join(kept))
+    return separator.join(kept_segments)
+
+
+class PromptCompactor:
+    """
+    Shrinks the variable parts of LLM prompts and logs how many tokens each request saved
+    """
+
+    def __init__(self, enabled=True, token_budget=0, min_repeats=3):
+        self.enabled = enabled
+        self.token_budget = token_budget
+        self.min_repeats = min_repeats
+
+    def compact_document(self, document_content, label, apply_budget=True):
+        """
+        Strip boilerplate from extracted document text and fit it to the token budget
+        :param document_content: The extracted document text
+        :param label: The name of the calling prompt, for logging
+        :param apply_budget: Whether to enforce the token budget
+        :return: The compacted text
+        """
+        if not self.enabled or not document_content:
+            return document_content
+        with metrics.stage("prompt_compaction"):
+            compacted = strip_repeated_lines(document_content, self.min_repeats)
+            if apply_budget and self.token_budget:
+                compacted = truncate_to_budget(compacted, self.token_budget)
+        self.log_savings(label, document_content, compacted)
+        return compacted
+
+    def compact_answers(self, answers_list, label):
+        """
+        Serialise quest attempt answers grouped by question in compact JSON
+        :param answers_list: The list of answer records
+        :param label: The name of the calling prompt, for logging
+        :return: The serialised answers
+        """
+        original = json.dumps(answers_list, indent=2)
+        if not self.enabled:
+            return original
+        with metrics.stage("prompt_compaction"):
+            compacted = compact_json(group_answers_by_question(answers_list))
+        self.log_savings(label, original, compacted)
+        return compacted
+
+    @staticmethod
+    def log_savings(label, original, compacted):
+        before = estimate_tokens(original)
+        after = estimate_tokens(compacted)
+        print(f"[Prompt Compaction] {label}: ~{before} -> ~{after} tokens (~{before - after} saved)", flush=True)
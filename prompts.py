@@ -0,0 +1,401 @@
+import time
+import metrics
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import Runnable
+from output_parser import parser
+from scheduler import PRIORITIES
+
+QUESTIONS_INSTRUCTIONS = ("You are a helpful learning assistant for students. Your goal is to facilitate their learning by "
+                          "testing their understanding of the content from a lecture note. Based on the provided lecture "
+                          "document, generate {num_questions} questions. Ensure that these questions are of {difficulty} "
+                          "difficulty. A question should include a list of 4 answers, and each answer has an indication "
+                          "whether it is a correct answer and a reason to justify why this answer is correct or incorrect. "
+                          "This is a multi select question and there can be more than one correct answer. "
+                          "The possible answers does not have to be solely from the content of the document. You may also "
+                          "generate other possible answers depending on the difficulty level.\n\n"
+                          "ADDITIONAL REQUIREMENTS:\n"
+                          "1) Avoid definition-only questions (max 20% if difficulty is Easy).\n"
+                          "2) Ensure coverage across different topics/sections of the document; do not cluster on one topic.\n"
+                          "3) Use plausible distractors based on common misconceptions.\n"
+                          "4) For Medium/Hard, prioritize application and scenario-based questions.\n"
+                          "5) Include at least 1 question that requires reasoning across multiple concepts.\n"
+                          "6) Keep wording concise and unambiguous.\n"
+                          "7) Keep answer options parallel in length and style.\n"
+                          "8) Target distribution (approx.):\n"
+                          "- Easy: Remember 30%, Understand 30%, Apply 20%, Analyze 10%, Evaluate 5%, Create 5%\n"
+                          "- Medium: Remember 15%, Understand 25%, Apply 25%, Analyze 20%, Evaluate 10%, Create 5%\n"
+                          "- Hard: Remember 10%, Understand 15%, Apply 25%, Analyze 25%, Evaluate 15%, Create 10%\n\n"
+                          "QUESTION TYPE TAGGING:\n"
+                          "Set question_type to one of: mcq, matching, categorising, latex_mcq.\n"
+                          "Use latex_mcq for calculation-based questions; format math using LaTeX.\n"
+                          "If question_type is matching or categorising, include a structured_data object:\n"
+                          "- matching: {{\"pairs\": [{{\"left\": \"...\", \"right\": \"...\"}}]}}\n"
+                          "- categorising: {{\"categories\": [{{\"name\": \"...\", \"items\": [\"...\"]}}]}}\n"
+                          "For every question, include a short hint in a field named \"hint\".\n"
+                          "Always include the standard 4-answer list for compatibility.\n"
+                          "{format_instructions} \n\n")
+
+QUESTIONS_TEMPLATE = QUESTIONS_INSTRUCTIONS + "Below is the content of the lecture document:\n\n{document_content}"
+
+QUESTIONS_SECTION_TEMPLATE = (QUESTIONS_INSTRUCTIONS + "Below is section {section_number} of {section_count} of the "
+                                                       "lecture document. Only ask about the content of this "
+                                                       "section:\n\n{document_content}")
+
+FEEDBACK_TEMPLATE = ("You are an educational tutor. Analyze this student's quiz attempt and provide detailed, "
+                     "constructive, and encouraging feedback.\n\n"
+                     "STUDENT PERFORMANCE SUMMARY:\n"
+                     "- Total Questions: {total_questions}\n"
+                     "- Correct Answers: {correct_answers}\n"
+                     "- Accuracy: {accuracy}%\n\n"
+                     "DETAILED ANSWERS:\n{attempt_data}\n\n"
+                     "INSTRUCTIONS:\n"
+                     "Provide feedback in the following JSON format (return ONLY valid JSON, no markdown, no extra text):\n"
+                     "{{\n"
+                     '  "quest_summary": {{\n'
+                     '    "overall_bloom_rating": 1,\n'
+                     '    "overall_bloom_level": "Remember",\n'
+                     '    "summary": "2-3 sentence summary of performance across the quest."\n'
+                     "  }},\n"
+                     '  "subtopic_feedback": [\n'
+                     "    {{\n"
+                     '      "subtopic": "Subtopic name",\n'
+                     '      "bloom_rating": 2,\n'
+                     '      "bloom_level": "Understand",\n'
+                     '      "evidence": "Short evidence grounded in the student answers.",\n'
+                     '      "improvement_focus": "One sentence on what to improve in this subtopic."\n'
+                     "    }}\n"
+                     "  ],\n"
+                     '  "study_tips": [\n'
+                     '    "Practical study tip 1",\n'
+                     '    "Practical study tip 2"\n'
+                     "  ]\n"
+                     "}}\n\n"
+                     "BLOOM SCALE (STRICT 1-6)\n"
+                     "1 = Remember\n"
+                     "2 = Understand\n"
+                     "3 = Apply\n"
+                     "4 = Analyse\n"
+                     "5 = Evaluate\n"
+                     "6 = Create\n\n"
+                     "IMPORTANT GUIDELINES:\n"
+                     "1. Use ONLY the bloom levels listed and map them strictly to the 1-6 ratings\n"
+                     "2. Infer subtopics by grouping related questions; use concise subtopic names\n"
+                     "3. Provide 3-8 subtopic entries depending on coverage\n"
+                     "4. The quest summary should be 2-3 sentences and match the overall bloom rating\n"
+                     "5. Provide 3-6 study tips as a list, focused on the weakest subtopics\n"
+                     "6. Use an encouraging, supportive tone - emphasize growth mindset\n"
+                     "7. Return ONLY the JSON object, no additional text before or after")
+
+BONUS_MATCHING_TEMPLATE = ("You are a learning assistant. Create a matching pairs mini-game based on the document.\n"
+                           "Return ONLY valid JSON, no markdown.\n\n"
+                           "FORMAT:\n"
+                           "{{\n"
+                           '  "game_type": "matching",\n'
+                           '  "prompt": "...",\n'
+                           '  "pairs": [\n'
+                           '    {{"left": "...", "right": "..."}},\n'
+                           '    {{"left": "...", "right": "..."}},\n'
+                           '    {{"left": "...", "right": "..."}},\n'
+                           '    {{"left": "...", "right": "..."}}\n'
+                           '  ],\n'
+                           '  "hint": "..."\n'
+                           "}}\n\n"
+                           "RULES:\n"
+                           "- Generate 4 pairs.\n"
+                           "- Keep text concise (<= 8 words each).\n"
+                           "- Pairs must be clearly matched from the document.\n"
+                           "- Avoid obscure or minor details.\n\n"
+                           "DOCUMENT:\n{document_content}")
+
+BONUS_ORDERING_TEMPLATE = ("You are a learning assistant. Create an ordering sequence mini-game based on the document.\n"
+                           "Return ONLY valid JSON, no markdown.\n\n"
+                           "FORMAT:\n"
+                           "{{\n"
+                           '  "game_type": "ordering",\n'
+                           '  "prompt": "...",\n'
+                           '  "items": ["...", "...", "...", "..."],\n'
+                           '  "answer_order": [0, 1, 2, 3],\n'
+                           '  "hint": "..."\n'
+                           "}}\n\n"
+                           "RULES:\n"
+                           "- Generate 4 items in correct order in the items list.\n"
+                           "- answer_order must be the correct index order (0..3).\n"
+                           "- Use a process or sequence from the document.\n"
+                           "- Keep items concise (<= 8 words each).\n\n"
+                           "DOCUMENT:\n{document_content}")
+
+QUESTIONS_FIX_TEMPLATE = ("You are a helpful learning assistant. The following quiz questions failed validation. "
+                          "Fix only the listed problems and keep everything else about each question unchanged. Every "
+                          "question must have exactly 4 answers, at least one answer marked as correct, and a reason "
+                          "for every answer.\n\n"
+                          "PROBLEMS:\n{problems}\n\n"
+                          "QUESTIONS:\n{questions}\n\n"
+                          "Return the corrected questions, in the same order. {format_instructions}")
+
+BONUS_FIX_TEMPLATE = ("The following {game_type} mini-game JSON failed validation:\n{game}\n\n"
+                      "PROBLEMS:\n{problems}\n\n"
+                      "Return ONLY the corrected JSON object, no markdown, keeping the same fields and content "
+                      "wherever they were valid.")
+
+# Representative values used to exercise every prompt during warm-up
+WARM_UP_INPUTS = {
+    "questions": {"num_questions": 5, "difficulty": "Easy", "document_content": "Warm-up document."},
+    "questions_section": {"num_questions": 2, "difficulty": "Easy", "document_content": "Warm-up section.",
+                          "section_number": 1, "section_count": 1},
+    "feedback": {"total_questions": 1, "correct_answers": 1, "accuracy": "100.0", "attempt_data": "[]"},
+    "bonus_matching": {"document_content": "Warm-up document."},
+    "bonus_ordering": {"document_content": "Warm-up document."},
+    "questions_fix": {"problems": "- Question 1 has no correct answer", "questions": "[]"},
+    "bonus_fix": {"game_type": "ordering", "game": "{}", "problems": "- items must be a list"},
+}
+
+
+class ResilientRunnable(Runnable):
+    """
+    Runs a model through a Resilience wrapper. Batches fall back to invoke per input, so each input is retried
+    on its own.
+    """
+
+    def __init__(self, bound, resilience):
+        self.bound = bound
+        self.resilience = resilience
+
+    @property
+    def InputType(self):
+        return self.bound.InputType
+
+    @property
+    def OutputType(self):
+        return self.bound.OutputType
+
+    def invoke(self, input, config=None, **kwargs):
+        return self.resilience.call(self.bound.invoke, input, config, **kwargs)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self.resilience.acall(self.bound.ainvoke, input, config, **kwargs)
+
+    def stream(self, input, config=None, **kwargs):
+        return self.resilience.stream(self.bound.stream, input, config, **kwargs)
+
+
+class TimedRunnable(Runnable):
+    """
+    Records the time spent in one step of a chain as a request stage
+    """
+
+    def __init__(self, bound, stage, observe=None, stream_passthrough=False):
+        self.bound = bound
+        self.stage = stage
+        # Called with each output or streamed chunk, e.g. to record token usage
+        self.observe = observe
+        # Parsers consume the model output incrementally, so streaming goes straight through them untimed
+        # rather than buffering the stream in order to time it
+        self.stream_passthrough = stream_passthrough
+
+    @property
+    def InputType(self):
+        return self.bound.InputType
+
+    @property
+    def OutputType(self):
+        return self.bound.OutputType
+
+    def invoke(self, input, config=None, **kwargs):
+        with metrics.stage(self.stage):
+            output = self.bound.invoke(input, config, **kwargs)
+        if self.observe is not None:
+            self.observe(output)
+        return output
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        with metrics.stage(self.stage):
+            output = await self.bound.ainvoke(input, config, **kwargs)
+        if self.observe is not None:
+            self.observe(output)
+        return output
+
+    def stream(self, input, config=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            for chunk in self.bound.stream(input, config, **kwargs):
+                if self.observe is not None:
+                    self.observe(chunk)
+                yield chunk
+        finally:
+            metrics.record_stage(self.stage, time.perf_counter() - start)
+
+    def transform(self, input, config=None, **kwargs):
+        if self.stream_passthrough:
+            yield from self.bound.transform(input, config, **kwargs)
+        else:
+            yield from super().transform(input, config, **kwargs)
+
+
+# Config metadata key holding a reservation admitted before the chain was run, see PromptRegistry.admit
+RESERVATION_KEY = "llm_reservation"
+
+
+class ScheduledRunnable(Runnable):
+    """
+    Admits model calls through the LLM scheduler at a fixed priority and settles each reservation against the
+    token usage reported on the response
+    """
+
+    def __init__(self, bound, scheduler, priority):
+        self.bound = bound
+        self.scheduler = scheduler
+        self.priority = priority
+
+    @property
+    def InputType(self):
+        return self.bound.InputType
+
+    @property
+    def OutputType(self):
+        return self.bound.OutputType
+
+    @staticmethod
+    def take_reservation(config):
+        # A reservation admitted ahead of the chain is used by the first attempt only; retries are admitted again
+        held = ((config or {}).get("metadata") or {}).get(RESERVATION_KEY)
+        return held.pop() if held else None
+
+    def invoke(self, input, config=None, **kwargs):
+        reservation = self.take_reservation(config) or self.scheduler.acquire(self.priority, input.to_string())
+        try:
+            output = self.bound.invoke(input, config, **kwargs)
+        except Exception as e:
+            self.scheduler.throttle(e)
+            raise
+        self.scheduler.settle(reservation, output)
+        return output
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        reservation = (self.take_reservation(config)
+                       or await self.scheduler.aacquire(self.priority, input.to_string()))
+        try:
+            output = await self.bound.ainvoke(input, config, **kwargs)
+        except Exception as e:
+            self.scheduler.throttle(e)
+            raise
+        self.scheduler.settle(reservation, output)
+        return output
+
+    def stream(self, input, config=None, **kwargs):
+        reservation = self.take_reservation(config) or self.scheduler.acquire(self.priority, input.to_string())
+        usage = None
+        try:
+            for chunk in self.bound.stream(input, config, **kwargs):
+                usage = chunk if usage is None else usage + chunk
+                yield chunk
+        except Exception as e:
+            self.scheduler.throttle(e)
+            raise
+        self.scheduler.settle(reservation, usage)
+
+
+class PromptRegistry:
+    """
+    Builds every prompt template and chain once so that requests only have to render and invoke them
+    """
+
+    def __init__(self, model, resilience=None, scheduler=None):
+        self.scheduler = scheduler
+        if scheduler is None:
+            if resilience is not None:
+                model = ResilientRunnable(model, resilience)
+            model = TimedRunnable(model, "llm_call", observe=metrics.record_token_usage)
+            models = {priority: model for priority in PRIORITIES}
+        else:
+            # One model per scheduling priority. The scheduler sits inside the retry loop so that every attempt,
+            # including a retry after a 429, is admitted and charged against the quota again. Time spent queued is
+            # recorded as its own stage, outside llm_call.
+            model = TimedRunnable(model, "llm_call", observe=metrics.record_token_usage)
+            models = {priority: ScheduledRunnable(model, scheduler, priority) for priority in PRIORITIES}
+            if resilience is not None:
+                models = {priority: ResilientRunnable(scheduled, resilience) for priority, scheduled in models.items()}
+        parse = TimedRunnable(parser, "parse", stream_passthrough=True)
+        format_instructions = parser.get_format_instructions()
+        self.prompts = {
+            "questions": PromptTemplate(
+                template=QUESTIONS_TEMPLATE,
+                input_variables=["num_questions", "difficulty", "document_content"],
+                partial_variables={"format_instructions": format_instructions}
+            ),
+            "questions_section": PromptTemplate(
+                template=QUESTIONS_SECTION_TEMPLATE,
+                input_variables=["num_questions", "difficulty", "document_content", "section_number",
+                                 "section_count"],
+                partial_variables={"format_instructions": format_instructions}
+            ),
+            "feedback": PromptTemplate(
+                template=FEEDBACK_TEMPLATE,
+                input_variables=["total_questions", "correct_answers", "accuracy", "attempt_data"]
+            ),
+            "bonus_matching": PromptTemplate(
+                template=BONUS_MATCHING_TEMPLATE,
+                input_variables=["document_content"]
+            ),
+            "bonus_ordering": PromptTemplate(
+                template=BONUS_ORDERING_TEMPLATE,
+                input_variables=["document_content"]
+            ),
+            "questions_fix": PromptTemplate(
+                template=QUESTIONS_FIX_TEMPLATE,
+                input_variables=["problems", "questions"],
+                partial_variables={"format_instructions": format_instructions}
+            ),
+            "bonus_fix": PromptTemplate(
+                template=BONUS_FIX_TEMPLATE,
+                input_variables=["game_type", "game", "problems"]
+            ),
+        }
+
+        # Question chains parse the JSON output, salvaging what they can from malformed output; the others return
+        # the raw message for their own parsing
+        render = {name: TimedRunnable(prompt, "prompt_render") for name, prompt in self.prompts.items()}
+        self.chains = {
+            "questions": render["questions"] | models["questions"] | parse,
+            "questions_section": render["questions_section"] | models["questions"] | parse,
+            "feedback": render["feedback"] | models["feedback"],
+            "bonus_matching": render["bonus_matching"] | models["bonus_game"],
+            "bonus_ordering": render["bonus_ordering"] | models["bonus_game"],
+            "questions_fix": render["questions_fix"] | models["questions"] | parse,
+            "bonus_fix": render["bonus_fix"] | models["bonus_game"],
+        }
+
+    def chain(self, name):
+        """
+        Get a prebuilt chain
+        :param name: The chain name
+        :return: The chain
+        """
+        return self.chains[name]
+
+    def admit(self, name, inputs, priority):
+        """
+        Admit a call to a chain through the LLM scheduler before running it, for callers that must know whether
+        the call is shed before committing to a response, such as a stream that has sent its headers
+        :param name: The prompt name
+        :param inputs: The chain inputs
+        :param priority: The priority of the chain's model, one of PRIORITIES
+        :return: The config to run the chain with, or None without a scheduler
+        :raise QuotaExceededError: If the call would wait longer than the deadline budget
+        """
+        if self.scheduler is None:
+            return None
+        reservation = self.scheduler.acquire(priority, self.prompts[name].format(**inputs))
+        return {"metadata": {RESERVATION_KEY: [reservation]}}
+
+    def warm_up(self):
+        """
+        Render every prompt once with representative inputs, without calling the model
+        :return: The render time of each prompt in milliseconds
+        """
+        timings = {}
+        for name, prompt in self.prompts.items():
+            start = time.perf_counter()
+            prompt.invoke(WARM_UP_INPUTS[name])
+            timings[name] = round((time.perf_counter() - start) * 1000, 3)
+        print(f"[Prompt Registry] Warmed up {len(timings)} prompts: {timings}", flush=True)
+        return timings
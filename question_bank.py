@@ -0,0 +1,236 @@
+import copy
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+# Modulus and seed for the MinHash permutations; a fixed seed keeps signatures stable for the life of the process
+MERSENNE_PRIME = (1 << 61) - 1
+PERMUTATION_SEED = 7207
+
+
+class _Pool:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.questions = []
+        self.signatures = []
+        self.serves = []
+        self.refilling = False
+        # Set once a top-up round produces nothing new, so a saturated document stops costing LLM calls
+        self.exhausted = False
+
+
+class QuestionBank:
+    """
+    Pre-generated question pools per (document, difficulty).
+
+    Requests are served by sampling from the pool, preferring the questions served least often, and the pool is
+    topped up in the background until it reaches its target size. Near-duplicate questions are dropped on the way
+    in by comparing MinHash signatures of their word shingles. Pools are keyed on a fingerprint of the document
+    text, so a re-uploaded document starts a fresh pool.
+    """
+
+    def __init__(self, generate, pool_size=40, batch_size=10, similarity_threshold=0.6, shingle_size=2,
+                 num_permutations=64, max_documents=256, workers=1):
+        """
+        :param generate: Called as generate(document_content, num_questions, difficulty) to generate questions
+        :param pool_size: The number of questions to keep per document and difficulty
+        :param batch_size: The number of questions requested per background generation call
+        :param similarity_threshold: The estimated Jaccard similarity above which a question is a near-duplicate
+        :param shingle_size: The number of words per shingle
+        :param num_permutations: The MinHash signature length
+        :param max_documents: The number of pools kept before the least recently used is dropped
+        :param workers: The number of background top-up threads
+        """
+        self.generate = generate
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.similarity_threshold = similarity_threshold
+        self.shingle_size = shingle_size
+        self.max_documents = max_documents
+
+        rng = random.Random(PERMUTATION_SEED)
+        self._permutations = [
+            (rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(num_permutations)
+        ]
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="question-bank")
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "top_ups": 0,
+            "top_up_failures": 0,
+            "questions_added": 0,
+            "near_duplicates": 0,
+            "evictions": 0,
+        }
+
+    def sample(self, document_id, difficulty, document_content, num_questions):
+        """
+        Serve questions from the pool, scheduling a top-up if the pool is below its target size
+        :param document_id: The document ID
+        :param difficulty: The difficulty level
+        :param document_content: The document text, used to detect a changed document and to top up the pool
+        :param num_questions: The number of questions wanted
+        :return: A {"questions": [...]} result like generate returns, or None if the pool is too small
+        """
+        key = (document_id, difficulty)
+        with self._lock:
+            pool = self._get_pool(key, self.fingerprint(document_content))
+            if len(pool.questions) < num_questions:
+                self._counters["misses"] += 1
+                selected = None
+            else:
+                self._counters["hits"] += 1
+                # Least served first, random among ties, then back in pool order so the quiz reads in order
+                ranked = sorted(range(len(pool.questions)), key=lambda index: (pool.serves[index], random.random()))
+                indices = sorted(ranked[:num_questions])
+                for index in indices:
+                    pool.serves[index] += 1
+                selected = copy.deepcopy([pool.questions[index] for index in indices])
+            pool_count = len(pool.questions)
+
+        metrics.annotate("question_bank", "hit" if selected is not None else "miss")
+        if selected is None:
+            # Nothing is scheduled on a miss: the caller generates directly and seeds the pool through add
+            print(f"[Question Bank] Miss for {key}: {pool_count} of {num_questions} questions pooled", flush=True)
+            return None
+
+        self._schedule_top_up(key, document_content)
+        for number, question in enumerate(selected, start=1):
+            question["number"] = number
+        return {"questions": selected}
+
+    def add(self, document_id, difficulty, document_content, result):
+        """
+        Add generated questions to the pool, dropping near-duplicates, and top the pool up in the background
+        :param document_id: The document ID
+        :param difficulty: The difficulty level
+        :param document_content: The document text the questions were generated from
+        :param result: A {"questions": [...]} result from generate
+        :return: The number of questions added
+        """
+        key = (document_id, difficulty)
+        added = self._add(key, self.fingerprint(document_content), result)
+        self._schedule_top_up(key, document_content)
+        return added
+
+    def stats(self):
+        """
+        Snapshot of bank counters and sizes
+        :return: A dict of hit/miss/top-up counters and the number of pooled documents and questions
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["pools"] = len(self._pools)
+            stats["questions"] = sum(len(pool.questions) for pool in self._pools.values())
+            stats["refilling"] = sum(1 for pool in self._pools.values() if pool.refilling)
+        requests = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / requests, 3) if requests else 0.0
+        return stats
+
+    @staticmethod
+    def fingerprint(document_content):
+        return hashlib.sha256((document_content or "").encode("utf-8")).hexdigest()
+
+    def signature(self, question):
+        """
+        Compute the MinHash signature of a question's text and answer options
+        :param question: The question dict
+        :return: A tuple of minimum permuted shingle hashes, or None if the question has no text
+        """
+        parts = [str(question.get("text", ""))]
+        answers = question.get("answers")
+        if isinstance(answers, list):
+            parts.extend(str(answer.get("text", "")) for answer in answers if isinstance(answer, dict))
+        # Each part is shingled on its own, so shuffling the answer options does not change the signature
+        shingles = set()
+        for part in parts:
+            words = re.findall(r"[a-z0-9]+", part.lower())
+            shingles.update(" ".join(words[i:i + self.shingle_size])
+                            for i in range(max(1, len(words) - self.shingle_size + 1)) if words)
+        if not shingles:
+            return None
+        hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+                  for shingle in shingles]
+        return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self._permutations)
+
+    @staticmethod
+    def similarity(first, second):
+        """
+        Estimate the Jaccard similarity of two shingle sets from their MinHash signatures
+        """
+        return sum(1 for a, b in zip(first, second) if a == b) / len(first)
+
+    def _get_pool(self, key, fingerprint):
+        pool = self._pools.get(key)
+        if pool is None or pool.fingerprint != fingerprint:
+            pool = self._pools[key] = _Pool(fingerprint)
+        self._pools.move_to_end(key)
+        while len(self._pools) > self.max_documents:
+            self._pools.popitem(last=False)
+            self._counters["evictions"] += 1
+        return pool
+
+    def _add(self, key, fingerprint, result):
+        questions = result.get("questions", []) if isinstance(result, dict) else []
+        # Signatures are computed outside the lock; only the comparison against the pool needs it
+        candidates = [(question, self.signature(question)) for question in questions if isinstance(question, dict)]
+
+        added = 0
+        duplicates = 0
+        with self._lock:
+            pool = self._get_pool(key, fingerprint)
+            for question, signature in candidates:
+                if signature is None:
+                    continue
+                if any(self.similarity(signature, existing) >= self.similarity_threshold
+                       for existing in pool.signatures):
+                    duplicates += 1
+                    continue
+                pool.questions.append(copy.deepcopy(question))
+                pool.signatures.append(signature)
+                pool.serves.append(0)
+                added += 1
+            self._counters["questions_added"] += added
+            self._counters["near_duplicates"] += duplicates
+        if duplicates:
+            print(f"[Question Bank] Dropped {duplicates} near-duplicate questions for {key}", flush=True)
+        return added
+
+    def _schedule_top_up(self, key, document_content):
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None or pool.refilling or pool.exhausted or len(pool.questions) >= self.pool_size:
+                return
+            pool.refilling = True
+        self._executor.submit(self._top_up, key, document_content, pool)
+
+    def _top_up(self, key, document_content, pool):
+        with metrics.trace_request("question_bank_top_up"):
+            try:
+                while len(pool.questions) < self.pool_size:
+                    with self._lock:
+                        self._counters["top_ups"] += 1
+                    result = self.generate(document_content=document_content, num_questions=self.batch_size,
+                                           difficulty=key[1])
+                    with self._lock:
+                        if self._pools.get(key) is not pool:
+                            # The document changed or the pool was evicted while generating
+                            return
+                    if not self._add(key, pool.fingerprint, result):
+                        pool.exhausted = True
+                        print(f"[Question Bank] No new questions for {key}, stopping at {len(pool.questions)}",
+                              flush=True)
+                        return
+                print(f"[Question Bank] Pool for {key} topped up to {len(pool.questions)} questions", flush=True)
+            except Exception as e:
+                with self._lock:
+                    self._counters["top_up_failures"] += 1
+                print(f"[Question Bank] Top-up failed for {key}: {str(e)}", flush=True)
+            finally:
+                pool.refilling = False
@@ -0,0 +1,319 @@
+import asyncio
+import math
+import random
+import threading
+import time
+from scheduler import QuotaExceededError
+
+# HTTP status codes that indicate a transient failure worth retrying
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Connection and timeout errors from the Azure SDK, openai and httpx, matched by name so that checking an
+# exception does not import those libraries
+TRANSIENT_ERROR_NAMES = {
+    "ServiceRequestError", "ServiceResponseError", "APIConnectionError", "APITimeoutError",
+    "TimeoutException", "NetworkError", "ClientConnectionError", "ServerTimeoutError",
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling a dependency whose circuit breaker is open
+    """
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable after repeated failures, retry in {math.ceil(retry_after)} seconds")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_transient(e):
+    """
+    Whether an error is likely to go away on retry, such as a timeout, a dropped connection or a 429/5xx response
+    :param e: The exception
+    :return: True if the call should be retried
+    """
+    if isinstance(e, CircuitOpenError):
+        return False
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(e, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(e, "response", None), "status_code", None)
+    if status_code is not None:
+        return status_code in TRANSIENT_STATUS_CODES
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(e).__mro__)
+
+
+class RetryPolicy:
+    """
+    Bounded retries with full-jitter exponential backoff. The deadline caps the total time spent on one call,
+    including every attempt and the waits between them: a retry is only started if it can run for its full
+    attempt timeout and still finish before the deadline.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0, deadline=None, attempt_timeout=None):
+        """
+        :param max_attempts: The most attempts per call, including the first
+        :param base_delay: The backoff ceiling after the first failure, doubled after each further failure
+        :param max_delay: The largest backoff ceiling
+        :param deadline: The total time budget for one call in seconds, or None for no budget
+        :param attempt_timeout: The longest one attempt can take, from the client's timeouts, or None if unknown
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+
+    def backoff(self, attempt):
+        """
+        The wait before the next attempt
+        :param attempt: The number of attempts made so far, starting from 1
+        :return: The delay in seconds
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def next_delay(self, attempt, started, e):
+        """
+        Decide whether to retry after a failed attempt
+        :param attempt: The number of attempts made so far
+        :param started: The perf_counter time of the first attempt
+        :param e: The exception raised by the attempt
+        :return: The delay before retrying, or None to give up
+        """
+        if attempt >= self.max_attempts or not is_transient(e):
+            return None
+        delay = self.backoff(attempt)
+        if self.deadline is not None:
+            # An attempt that times out runs for its full timeout, so it must fit in what is left of the budget
+            finish = time.perf_counter() - started + delay + (self.attempt_timeout or 0)
+            if finish > self.deadline:
+                return None
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Fails fast after consecutive transient failures. Once open, calls are rejected until the reset timeout has
+    passed, after which a single trial call is let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._counters = {"failures": 0, "rejected": 0, "opened": 0}
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Check that a call may go ahead
+        :raise CircuitOpenError: If the circuit is open
+        """
+        with self._lock:
+            if self.state == "closed":
+                return
+            retry_after = self._opened_at + self.reset_timeout - time.monotonic()
+            if self.state == "open" and retry_after <= 0:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self._counters["rejected"] += 1
+        raise CircuitOpenError(self.name, max(retry_after, 0))
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+            if self.state != "closed":
+                print(f"[Circuit Breaker] {self.name} closed", flush=True)
+            self.state = "closed"
+
+    def cancel_trial(self):
+        """
+        Let another trial call through after one was abandoned without an outcome
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._counters["failures"] += 1
+            self._consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self._consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self._counters["opened"] += 1
+                    print(f"[Circuit Breaker] {self.name} opened after {self._consecutive_failures} consecutive "
+                          f"failures", flush=True)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self._consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout_seconds": self.reset_timeout,
+                **self._counters,
+            }
+
+
+class Resilience:
+    """
+    Runs calls to one remote dependency through a retry policy and a circuit breaker, and counts what happened
+    """
+
+    def __init__(self, name, retry_policy=None, breaker=None, pool_size=None):
+        self.name = name
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(max_attempts=1)
+        self.breaker = breaker
+        # The connection pool size configured on the dependency's client, reported alongside the call counters
+        self.pool_size = pool_size
+        self._in_flight = 0
+        self._counters = {"calls": 0, "attempts": 0, "retries": 0, "failures": 0}
+        self._lock = threading.Lock()
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Call a function, retrying transient failures
+        :param fn: The function making the remote call
+        :return: The function's return value
+        """
+        started = self._start_call()
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                self._before_attempt()
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    delay = self._after_failure(attempt, started, e)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    continue
+                self._after_success()
+                return result
+        finally:
+            self._end_call()
+
+    async def acall(self, fn, *args, **kwargs):
+        """
+        Async counterpart of call
+        :param fn: The coroutine function making the remote call
+        :return: The awaited return value
+        """
+        started = self._start_call()
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                self._before_attempt()
+                try:
+                    result = await fn(*args, **kwargs)
+                except asyncio.CancelledError:
+                    if self.breaker is not None:
+                        self.breaker.cancel_trial()
+                    raise
+                except Exception as e:
+                    delay = self._after_failure(attempt, started, e)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    continue
+                self._after_success()
+                return result
+        finally:
+            self._end_call()
+
+    def stream(self, fn, *args, **kwargs):
+        """
+        Iterate over a streaming call. Failures are only retried before the first item has been yielded,
+        so the caller never sees output twice.
+        :param fn: The function returning an iterator over the remote response
+        :return: A generator over the response
+        """
+        started = self._start_call()
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                self._before_attempt()
+                yielded = False
+                try:
+                    for item in fn(*args, **kwargs):
+                        yielded = True
+                        yield item
+                except GeneratorExit:
+                    # The caller stopped reading, so the dependency was answering
+                    self._after_success()
+                    raise
+                except Exception as e:
+                    delay = self._after_failure(attempt, started, e)
+                    if delay is None or yielded:
+                        raise
+                    time.sleep(delay)
+                    continue
+                self._after_success()
+                return
+        finally:
+            self._end_call()
+
+    def stats(self):
+        with self._lock:
+            stats = {"in_flight": self._in_flight, "pool_size": self.pool_size, **self._counters}
+        stats["circuit_breaker"] = self.breaker.stats() if self.breaker is not None else None
+        return stats
+
+    def _start_call(self):
+        with self._lock:
+            self._counters["calls"] += 1
+            self._in_flight += 1
+        return time.perf_counter()
+
+    def _end_call(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _before_attempt(self):
+        if self.breaker is not None:
+            self.breaker.before_call()
+        with self._lock:
+            self._counters["attempts"] += 1
+
+    def _after_success(self):
+        if self.breaker is not None:
+            self.breaker.record_success()
+
+    def _after_failure(self, attempt, started, e):
+        if isinstance(e, QuotaExceededError):
+            # Shed by the LLM scheduler before reaching the dependency, so it says nothing about its health
+            if self.breaker is not None:
+                self.breaker.cancel_trial()
+            return None
+        transient = is_transient(e)
+        if self.breaker is not None:
+            # Errors such as a missing blob mean the dependency answered, so they do not count against it
+            if transient:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        delay = self.retry_policy.next_delay(attempt, started, e)
+        with self._lock:
+            if transient:
+                self._counters["failures"] += 1
+            if delay is not None:
+                self._counters["retries"] += 1
+        if delay is not None:
+            print(f"[Resilience] {self.name} attempt {attempt} failed ({type(e).__name__}: {str(e)}), "
+                  f"retrying in {delay:.2f}s", flush=True)
+        return delay
@@ -0,0 +1,213 @@
+import asyncio
+import itertools
+import math
+import threading
+import time
+import metrics
+from prompt_compaction import estimate_tokens
+
+# Lower runs first: interactive feedback ahead of bonus games, and both ahead of bulk question generation
+PRIORITIES = {"feedback": 0, "bonus_game": 1, "questions": 2}
+
+# Longest a waiting call sleeps before checking the queue again, so it notices when it has been overtaken
+MAX_POLL_SECONDS = 0.25
+
+
+class QuotaExceededError(RuntimeError):
+    """
+    Raised instead of queueing a model call that would wait longer than the queue's deadline budget
+    """
+
+    def __init__(self, priority, retry_after):
+        self.priority = priority
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"The Azure OpenAI quota is exhausted for {priority} requests, retry in "
+                         f"{self.retry_after} seconds")
+
+
+class TokenBucket:
+    """
+    Refills continuously at a per-minute rate up to one minute's worth. The level may go negative when a call
+    turns out to have used more than was reserved for it.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def time_until(self, amount):
+        """
+        Seconds until the bucket holds the given amount, assuming nothing else is taken
+        """
+        return max(0.0, (amount - self.level) / self.rate)
+
+
+class _Waiter:
+    def __init__(self, priority, tokens, sequence):
+        self.key = (PRIORITIES[priority], sequence)
+        self.priority = priority
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.queued = False
+
+
+class LLMScheduler:
+    """
+    Admission control for model calls against the deployment's tokens-per-minute and requests-per-minute quotas.
+
+    Each call reserves its estimated prompt tokens plus a completion estimate from a token bucket and one request
+    from a request bucket. Calls that cannot go ahead wait in a priority queue and are admitted in priority order,
+    then arrival order. A call whose estimated wait, behind the calls queued ahead of it, exceeds the deadline
+    budget is rejected straight away with QuotaExceededError, so overload turns into a fast 429 rather than a
+    request that times out. Reservations are settled against the token usage the model reports.
+    """
+
+    def __init__(self, tokens_per_minute=0, requests_per_minute=0, completion_tokens=1000, max_wait_seconds=20):
+        """
+        :param tokens_per_minute: The deployment's token quota, 0 for no token limit
+        :param requests_per_minute: The deployment's request quota, 0 for no request limit
+        :param completion_tokens: The completion tokens reserved per call until the actual usage is known
+        :param max_wait_seconds: The deadline budget: the longest a call may wait in the queue
+        """
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.completion_tokens = completion_tokens
+        self.max_wait_seconds = max_wait_seconds
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._counters = {"admitted": 0, "queued": 0, "shed": 0, "throttled": 0}
+
+    def acquire(self, priority, prompt):
+        """
+        Wait until a call may go ahead
+        :param priority: The call's priority, one of PRIORITIES
+        :param prompt: The rendered prompt, used to estimate the tokens to reserve
+        :return: The reservation to settle once the call has finished
+        :raise QuotaExceededError: If the call would wait longer than the deadline budget
+        """
+        waiter = self._enqueue(priority, prompt)
+        try:
+            with self._condition:
+                while True:
+                    delay = self._try_admit(waiter)
+                    if delay is None:
+                        return waiter
+                    self._condition.wait(min(delay, MAX_POLL_SECONDS))
+        finally:
+            self._finish_wait(waiter)
+
+    async def aacquire(self, priority, prompt):
+        """
+        Async counterpart of acquire. The queue is polled rather than waited on, so no thread is held.
+        """
+        waiter = self._enqueue(priority, prompt)
+        try:
+            while True:
+                with self._condition:
+                    delay = self._try_admit(waiter)
+                if delay is None:
+                    return waiter
+                await asyncio.sleep(min(delay, MAX_POLL_SECONDS))
+        finally:
+            self._finish_wait(waiter)
+
+    def settle(self, reservation, message=None):
+        """
+        Correct a reservation with the token usage reported on the model response
+        :param reservation: The reservation returned by acquire
+        :param message: The model response, or None to keep the reservation as charged
+        """
+        usage = getattr(message, "usage_metadata", None)
+        if self.tokens is None or not usage:
+            return
+        with self._condition:
+            self.tokens.refill(time.monotonic())
+            self.tokens.level = min(self.tokens.capacity,
+                                    self.tokens.level + reservation.tokens - (usage.get("total_tokens") or 0))
+            self._condition.notify_all()
+
+    def throttle(self, e):
+        """
+        Empty the buckets after the service rejected a call for exceeding its quota, so queued calls back off
+        :param e: The exception raised by the call
+        """
+        if getattr(e, "status_code", None) != 429:
+            return
+        with self._condition:
+            for bucket in (self.tokens, self.requests):
+                if bucket is not None:
+                    bucket.refill(time.monotonic())
+                    bucket.level = min(bucket.level, 0.0)
+            self._counters["throttled"] += 1
+        print("[LLM Scheduler] Azure OpenAI returned 429, pausing admissions until the quota refills", flush=True)
+
+    def stats(self):
+        with self._condition:
+            now = time.monotonic()
+            stats = dict(self._counters)
+            stats["waiting"] = {priority: sum(1 for waiter in self._queue if waiter.priority == priority)
+                                for priority in PRIORITIES}
+            for name, bucket in (("tokens", self.tokens), ("requests", self.requests)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    stats[f"{name}_available"] = round(bucket.level)
+                    stats[f"{name}_per_minute"] = bucket.capacity
+        stats["max_wait_seconds"] = self.max_wait_seconds
+        return stats
+
+    def _enqueue(self, priority, prompt):
+        tokens = estimate_tokens(prompt) + self.completion_tokens
+        if self.tokens is not None:
+            # A call larger than the whole quota could never be admitted, so it is charged the full bucket
+            tokens = min(tokens, self.tokens.capacity)
+        waiter = _Waiter(priority, tokens, next(self._sequence))
+        with self._condition:
+            self._queue.append(waiter)
+        return waiter
+
+    def _try_admit(self, waiter):
+        """
+        Admit the waiter if it is first in line and the quota allows it. Called with the condition held.
+        :return: None if admitted, otherwise how long to wait before trying again
+        :raise QuotaExceededError: If the estimated wait exceeds the deadline budget
+        """
+        now = time.monotonic()
+        ahead = [other for other in self._queue if other.key <= waiter.key]
+        estimate = 0.0
+        for bucket, amount in ((self.tokens, sum(other.tokens for other in ahead)), (self.requests, len(ahead))):
+            if bucket is not None:
+                bucket.refill(now)
+                estimate = max(estimate, bucket.time_until(amount))
+
+        if len(ahead) == 1 and estimate == 0:
+            for bucket, amount in ((self.tokens, waiter.tokens), (self.requests, 1)):
+                if bucket is not None:
+                    bucket.level -= amount
+            self._counters["admitted"] += 1
+            return None
+
+        waited = now - waiter.enqueued
+        if waited + estimate > self.max_wait_seconds:
+            self._counters["shed"] += 1
+            print(f"[LLM Scheduler] Shedding a {waiter.priority} call after {waited:.1f}s: {len(ahead) - 1} calls "
+                  f"ahead, estimated wait {estimate:.1f}s exceeds the {self.max_wait_seconds}s budget", flush=True)
+            raise QuotaExceededError(waiter.priority, estimate)
+        if not waiter.queued:
+            waiter.queued = True
+            self._counters["queued"] += 1
+        # A call further back may be admitted as soon as the ones ahead of it are, so it only sleeps briefly
+        return estimate if len(ahead) == 1 else MAX_POLL_SECONDS
+
+    def _finish_wait(self, waiter):
+        with self._condition:
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+            self._condition.notify_all()
+        metrics.record_stage("llm_queue", time.monotonic() - waiter.enqueued)
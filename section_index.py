@@ -0,0 +1,185 @@
+import heapq
+import json
+import math
+import re
+from collections import Counter
+from prompt_compaction import estimate_tokens, truncate_to_budget
+
+# BM25 term frequency saturation and document length normalisation
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Words too common to say anything about what a section covers
+STOP_WORDS = frozenset(
+    "a an and are as at be been but by can do for from has have how if in into is it its may not of on or "
+    "that the their there these this those to was we were what when which while who will with you your".split()
+)
+
+# Marks where sections were left out between two selected ones
+SEPARATOR = "\n[...]\n"
+
+# Version of the serialised index, bumped when the format changes so stale sidecars are rebuilt
+INDEX_VERSION = 1
+
+
+def tokenize(text):
+    """
+    Split text into lowercase index terms, dropping stop words and single characters
+    :param text: The text
+    :return: A list of terms
+    """
+    return [word for word in re.findall(r"[a-z0-9]+", (text or "").lower())
+            if len(word) > 1 and word not in STOP_WORDS]
+
+
+class SectionIndex:
+    """
+    BM25 index over the sections of one document: the pages of a PDF, the slides of a presentation or the
+    heading-delimited parts of a Word document.
+
+    Prompts that do not need the whole document get a selection of sections that fits a token budget: the
+    sections most relevant to a topic, or without a topic, the sections that together cover the most of the
+    document's distinctive vocabulary. Selected sections are kept in document order.
+    """
+
+    def __init__(self, sections, term_counts=None):
+        """
+        :param sections: The section texts in document order
+        :param term_counts: The term counts of each section, computed from the sections if not given
+        """
+        self.sections = list(sections)
+        self.term_counts = term_counts if term_counts is not None else [
+            Counter(tokenize(section)) for section in self.sections
+        ]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        count = len(self.sections)
+        self.idf = {term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+                    for term, frequency in document_frequency.items()}
+
+    def to_json(self):
+        return json.dumps({"version": INDEX_VERSION, "sections": self.sections, "term_counts": self.term_counts},
+                          separators=(",", ":"), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Load a serialised index
+        :param data: The JSON produced by to_json
+        :return: The index, or None if it was written in another format version
+        """
+        index = json.loads(data)
+        if index.get("version") != INDEX_VERSION:
+            return None
+        return cls(index["sections"], [Counter(counts) for counts in index["term_counts"]])
+
+    def text(self):
+        """
+        The full document text, the same as text extraction returns
+        """
+        return "\n".join(self.sections)
+
+    def scores(self, query):
+        """
+        Score every section against a query
+        :param query: The query text
+        :return: The BM25 score of each section, in document order
+        """
+        terms = set(tokenize(query))
+        scores = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            score = 0.0
+            for term in terms:
+                frequency = counts.get(term, 0)
+                if frequency:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (self.average_length or 1))
+                    score += self.idf[term] * frequency * (BM25_K1 + 1) / (frequency + norm)
+            scores.append(score)
+        return scores
+
+    def select(self, token_budget, topic=None):
+        """
+        Select the text to send to a prompt
+        :param token_budget: The most tokens the selection may take
+        :param topic: A topic to focus on, or None for a representative selection
+        :return: A (text, strategy) tuple, where strategy is "topic", "representative" or "full"
+        """
+        if topic:
+            scores = self.scores(topic)
+            ranked = sorted((index for index, score in enumerate(scores) if score > 0), key=lambda i: -scores[i])
+            if ranked:
+                return self.join(self.fit(ranked, token_budget)), "topic"
+            print(f"[Section Index] No section matches topic {topic!r}, using a representative selection",
+                  flush=True)
+        text = self.text()
+        if estimate_tokens(text) <= token_budget:
+            return text, "full"
+        return self.join(self.fit(self.by_coverage(), token_budget)), "representative"
+
+    def by_coverage(self):
+        """
+        Order sections greedily by how much of the document's vocabulary each adds per token, weighting terms by
+        their IDF and how often the document uses them. Gains only shrink as terms get covered, so a section's
+        stale gain is an upper bound and is only recomputed when it reaches the top of the heap.
+        :return: Section indices, most useful first; sections that add nothing new are left out
+        """
+        totals = Counter()
+        for counts in self.term_counts:
+            totals.update(counts)
+        weights = {term: self.idf[term] * math.log(1 + total) for term, total in totals.items()}
+        covered = set()
+
+        def gain(index):
+            return (sum(weights[term] for term in self.term_counts[index] if term not in covered)
+                    / max(1, estimate_tokens(self.sections[index])))
+
+        heap = [(-gain(index), index) for index in range(len(self.sections)) if self.term_counts[index]]
+        heapq.heapify(heap)
+        order = []
+        while heap:
+            _, index = heapq.heappop(heap)
+            current = gain(index)
+            if current <= 0:
+                continue
+            if heap and current < -heap[0][0]:
+                heapq.heappush(heap, (-current, index))
+                continue
+            order.append(index)
+            covered.update(self.term_counts[index])
+        return order
+
+    def fit(self, ranked, token_budget):
+        """
+        Take sections in rank order while they fit the budget, skipping any that would overflow it
+        :param ranked: Section indices, best first
+        :param token_budget: The token budget
+        :return: The chosen section indices, or the best section cut to the budget if none fits whole
+        """
+        separator_tokens = estimate_tokens(SEPARATOR)
+        remaining = token_budget
+        chosen = []
+        for index in ranked:
+            tokens = estimate_tokens(self.sections[index]) + separator_tokens
+            if tokens <= remaining:
+                chosen.append(index)
+                remaining -= tokens
+        if not chosen and ranked:
+            return [(ranked[0], truncate_to_budget(self.sections[ranked[0]], token_budget))]
+        return chosen
+
+    def join(self, chosen):
+        """
+        Join sections in document order, marking the gaps where sections were left out
+        :param chosen: Section indices, or (index, text) pairs for sections that were cut
+        :return: The joined text
+        """
+        parts = sorted(item if isinstance(item, tuple) else (item, self.sections[item]) for item in chosen)
+        text = ""
+        previous = None
+        for index, section in parts:
+            if previous is not None:
+                text += "\n" if index == previous + 1 else SEPARATOR
+            text += section
+            previous = index
+        return text
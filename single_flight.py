@@ -0,0 +1,125 @@
+import asyncio
+import copy
+import threading
+import metrics
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one in-flight computation. The first caller runs it and
+    every caller that arrives before it finishes waits for and shares its result or error. Nothing is cached
+    once the computation has finished.
+    """
+
+    def __init__(self, name, enabled=True, copy_results=False):
+        self.name = name
+        self.enabled = enabled
+        # Followers get a deep copy of the result, for results that callers may modify
+        self.copy_results = copy_results
+        self._flights = {}
+        self._tasks = {}
+        self._task_followers = {}
+        self._counters = {"calls": 0, "executions": 0, "coalesced": 0}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Call a function, or wait for the identical call already in flight
+        :param key: A hashable key identifying identical calls
+        :param fn: The function to call
+        :return: The function's return value
+        """
+        if not self.enabled:
+            return fn(*args, **kwargs)
+
+        with self._lock:
+            self._counters["calls"] += 1
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self._counters["executions"] += 1
+                leader = True
+            else:
+                flight.followers += 1
+                self._counters["coalesced"] += 1
+                leader = False
+
+        if not leader:
+            metrics.annotate(f"coalesced_{self.name}", True)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result) if self.copy_results else flight.result
+
+        try:
+            flight.result = fn(*args, **kwargs)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+            self._log(key, flight.followers)
+
+    async def ado(self, key, fn, *args, **kwargs):
+        """
+        Async counterpart of do. The computation runs as its own task, so a caller that is cancelled, for
+        example by a client disconnecting, does not cancel it for the others.
+        :param key: A hashable key identifying identical calls
+        :param fn: The coroutine function to call
+        :return: The awaited return value
+        """
+        if not self.enabled:
+            return await fn(*args, **kwargs)
+
+        with self._lock:
+            self._counters["calls"] += 1
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                task = self._tasks[key] = asyncio.ensure_future(fn(*args, **kwargs))
+                self._task_followers[key] = 0
+                self._counters["executions"] += 1
+                task.add_done_callback(lambda done: self._finish_task(key, done))
+            else:
+                self._task_followers[key] += 1
+                self._counters["coalesced"] += 1
+
+        if not leader:
+            metrics.annotate(f"coalesced_{self.name}", True)
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result) if self.copy_results and not leader else result
+
+    def _finish_task(self, key, task):
+        if not task.cancelled():
+            # Mark the error as retrieved in case every caller was cancelled before it finished
+            task.exception()
+        with self._lock:
+            del self._tasks[key]
+            followers = self._task_followers.pop(key)
+        self._log(key, followers)
+
+    def _log(self, key, followers):
+        if not followers:
+            return
+        stats = self.stats()
+        print(f"[Single Flight] {self.name}: {followers + 1} callers shared one call for {key}; "
+              f"{stats['coalesced']} of {stats['calls']} calls coalesced so far ({stats['coalesced_ratio']:.0%})",
+              flush=True)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._flights) + len(self._tasks)
+        stats["coalesced_ratio"] = round(stats["coalesced"] / stats["calls"], 3) if stats["calls"] else 0.0
+        return stats